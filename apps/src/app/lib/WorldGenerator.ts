@@ -74,8 +74,9 @@ export async function generateWorld(
         num_characters: options?.num_characters || 4,
         num_npcs: options?.num_npcs || 3,
         num_acts: options?.num_acts || 2,
-        model: options?.model || 'gemini-2.0-flash',
-        temperature: options?.temperature || 0.7,
+        // 沒指定就不送，由後端依任務路由決定模型與溫度
+        model: options?.model,
+        temperature: options?.temperature,
       }),
     });
 
@@ -97,7 +98,72 @@ export async function generateWorld(
   }
 }
 
+// ----------- 串流生成：每個區塊完成就先回呼 (NDJSON) -----------
+export type WorldSection = 'characters' | 'npcs' | 'acts' | 'ending' | 'locations';
+
+export async function generateWorldStream(
+  background: string,
+  onSection: (section: WorldSection, world: Partial<WorldData>) => void | Promise<void>,
+  options?: {
+    num_characters?: number;
+    num_npcs?: number;
+    num_acts?: number;
+    model?: string;
+    temperature?: number;
+  }
+): Promise<WorldData> {
+  const response = await fetch(`http://127.0.0.1:8000/api/world/world/games/generate_full/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'Accept': 'application/x-ndjson' },
+    body: JSON.stringify({
+      background: background,
+      num_characters: options?.num_characters || 4,
+      num_npcs: options?.num_npcs || 3,
+      num_acts: options?.num_acts || 2,
+      model: options?.model,
+      temperature: options?.temperature,
+    }),
+  });
+
+  if (!response.ok || !response.body) {
+    throw new Error(`Error ${response.status}: ${response.statusText}`);
+  }
+
+  const world: Partial<WorldData> = {};
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let newline: number;
+    while ((newline = buffer.indexOf('\n')) !== -1) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (!line) continue;
+
+      const { event, data } = JSON.parse(line);
+      if (event === 'error') {
+        throw new Error(data.detail);
+      }
+      if (event === 'done') {
+        console.log('World generated (stream):', data.timings);
+        return world as WorldData;
+      }
+      (world as any)[event] = data;
+      await onSection(event as WorldSection, { ...world });
+    }
+  }
+
+  throw new Error('生成世界內容失敗：串流提前結束');
+}
+
 // ----------- 生成並儲存到資料庫 -----------
+// 用串流生成：角色一出來就先寫入 gamescript / gamerole 並呼叫 onCharactersReady，
+// 房間可以先進入選角；劇本、結局、地圖與物件等全部生成完再補上。
 export async function generateWorldAndSave(
   roomId: string,
   roomCode: number,
@@ -109,47 +175,70 @@ export async function generateWorldAndSave(
     num_acts?: number;
     model?: string;
     temperature?: number;
-  }
+  },
+  onCharactersReady?: () => void
 ) {
   try {
-    const worldData = await generateWorld(roomCode, prompt, background, options);
-    if (!worldData) throw new Error('生成世界內容失敗');
+    let scriptId = null as string | null;
+    let roleIds = new Map<string, string>();   // 角色名稱 -> gamerole.id
 
-    const { data: script, error: scriptError } = await supabase
-      .from('gamescript')
-      .insert({
-        room_id: roomId,
-        prompt: prompt,
-        background: background,
-        answer: worldData.ending,
-      })
-      .select()
-      .single();
+    const worldData = await generateWorldStream(background, async (section, world) => {
+      if (section !== 'characters' || !world.characters) return;
 
-    if (scriptError || !script) throw new Error('儲存 GameScript 失敗: ' + scriptError?.message);
-    const scriptId = script.id;
-    
-    const { error: roomError } = await supabase
-      .from('room')
-      .update({ script_id: scriptId })
-      .eq('id', roomId);
+      const { data: script, error: scriptError } = await supabase
+        .from('gamescript')
+        .insert({
+          room_id: roomId,
+          prompt: prompt,
+          background: background,
+          answer: '',
+        })
+        .select()
+        .single();
 
-    if (roomError) throw new Error('更新 room 的 script_id 失敗: ' + roomError.message);
+      if (scriptError || !script) throw new Error('儲存 GameScript 失敗: ' + scriptError?.message);
+      scriptId = script.id;
 
-    const roles = worldData.characters.map((char) => {
-      const act1 = worldData.acts[0]?.scripts.find((s) => s.character === char.name)?.dialogue || '';
-      const act2 = worldData.acts[1]?.scripts.find((s) => s.character === char.name)?.dialogue || '';
-      return {
+      const { error: roomError } = await supabase
+        .from('room')
+        .update({ script_id: scriptId })
+        .eq('id', roomId);
+
+      if (roomError) throw new Error('更新 room 的 script_id 失敗: ' + roomError.message);
+
+      // 每個角色的劇本要等 acts 生成完才補上
+      const roles = world.characters.map((char) => ({
         script_id: scriptId,
         name: char.name,
         public_info: char.public_info,
         secret: char.secret,
         mission: char.mission,
-        dialogue1: act1,
-        dialogue2: act2,
-      };
-    });
-    await supabase.from('gamerole').insert(roles);
+        dialogue1: '',
+        dialogue2: '',
+      }));
+      const { data: roleInserts, error: roleError } = await supabase.from('gamerole').insert(roles).select();
+      if (roleError) throw new Error('儲存 GameRole 失敗: ' + roleError.message);
+      roleIds = new Map(roleInserts.map((r) => [r.name, r.id]));
+
+      onCharactersReady?.();
+    }, options);
+    if (!worldData || !scriptId) throw new Error('生成世界內容失敗');
+
+    const { error: answerError } = await supabase
+      .from('gamescript')
+      .update({ answer: worldData.ending })
+      .eq('id', scriptId);
+
+    if (answerError) throw new Error('更新 GameScript 結局失敗: ' + answerError.message);
+
+    await Promise.all(worldData.characters.map((char) => {
+      const act1 = worldData.acts[0]?.scripts.find((s) => s.character === char.name)?.dialogue || '';
+      const act2 = worldData.acts[1]?.scripts.find((s) => s.character === char.name)?.dialogue || '';
+      return supabase
+        .from('gamerole')
+        .update({ dialogue1: act1, dialogue2: act2 })
+        .eq('id', roleIds.get(char.name));
+    }));
 
     const maps = worldData.locations.map((loc) => ({
       script_id: scriptId,
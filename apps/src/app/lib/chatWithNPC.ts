@@ -1,23 +1,27 @@
+import { CHAT_HISTORY_LIMIT } from './config';
+
+// game / player / npc 都存在後端時只送 id 與這一句話，背景、角色與歷史由後端取得。
+// 世界還只存在 Supabase 時（後端沒有這些 id），要附上 background / npc_info / player_info / chat_history。
 export interface ChatRequest {
   game_id: string;
   player_id: string;
   npc_id: string;
   text: string;
-  model?: string;
+  model?: string;        // 不填由後端依任務路由決定模型與溫度
   temperature?: number;
-  background: string;
-  npc_info: {
+  background?: string;
+  npc_info?: {
     name: string;
     description: string;
   };
-  player_info: {  // 新增：玩家角色資訊
+  player_info?: {
     name: string;
     role: string;
     public_info: string;
     secret: string;
     mission: string;
   };
-  chat_history?: any[];
+  chat_history?: { role: 'user' | 'assistant'; content: string }[];
 }
 
 export interface ChatResponse {
@@ -38,30 +42,18 @@ export async function chatWithNPC(
     throw new Error('對話內容不能為空');
   }
 
-  if (!body.background) {
-    throw new Error('遊戲背景不能為空');
-  }
-
-  if (!body.npc_info) {
-    throw new Error('NPC 資訊不能為空');
-  }
-
-  if (!body.player_info) {
-    throw new Error('玩家角色資訊不能為空');
-  }
-
-  // 構建完整的請求體
+  // 構建請求體
   const requestBody: ChatRequest = {
     game_id: gameId,
     player_id: playerId,
     npc_id: npcId,
     text: body.text.trim(),
-    model: body.model || 'gemini-2.0-flash',
-    temperature: body.temperature ?? 0.7,
+    model: body.model,
+    temperature: body.temperature,
     background: body.background,
     npc_info: body.npc_info,
-    player_info: body.player_info,  // 新增：玩家角色資訊
-    chat_history: body.chat_history || []
+    player_info: body.player_info,
+    chat_history: body.chat_history?.slice(-CHAT_HISTORY_LIMIT),
   };
 
   console.log('發送請求到:', 'http://127.0.0.1:8000/api/chat/npc');
@@ -96,4 +88,82 @@ export async function chatWithNPC(
     console.error('請求失敗:', error);
     throw error;
   }
-}
\ No newline at end of file
+}
+
+// ----------- 串流版：NPC 對話一邊生成一邊顯示 (SSE) -----------
+export async function streamChatWithNPC(
+  gameId: string,
+  playerId: string,
+  npcId: string,
+  body: Partial<ChatRequest>,
+  onDelta: (dialogueSoFar: string) => void
+): Promise<ChatResponse> {
+  if (!body.text || body.text.trim() === '') {
+    throw new Error('對話內容不能為空');
+  }
+
+  const requestBody: ChatRequest = {
+    game_id: gameId,
+    player_id: playerId,
+    npc_id: npcId,
+    text: body.text.trim(),
+    model: body.model,
+    temperature: body.temperature,
+    background: body.background,
+    npc_info: body.npc_info,
+    player_info: body.player_info,
+    chat_history: body.chat_history?.slice(-CHAT_HISTORY_LIMIT),
+  };
+
+  const response = await fetch('http://127.0.0.1:8000/api/chat/npc/stream', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'Accept': 'text/event-stream',
+    },
+    body: JSON.stringify(requestBody)
+  });
+
+  if (!response.ok || !response.body) {
+    const errorText = await response.text();
+    throw new Error(`Chat API failed: ${response.status} ${response.statusText} - ${errorText}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let dialogue = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // SSE 事件以空行分隔
+    let sep: number;
+    while ((sep = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+
+      let event = 'message';
+      let data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      const payload = JSON.parse(data);
+
+      if (event === 'dialogue') {
+        dialogue += payload.delta;
+        onDelta(dialogue);
+      } else if (event === 'done') {
+        return payload as ChatResponse;
+      } else if (event === 'error') {
+        throw new Error(`API Error: ${payload.detail}`);
+      }
+    }
+  }
+
+  // 串流意外結束，回傳目前收到的內容
+  return { dialogue, hint: null, evidence: null };
+}
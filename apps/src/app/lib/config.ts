@@ -1 +1,3 @@
-export const MAX_PLAYER = 6;
\ No newline at end of file
+export const MAX_PLAYER = 6;
+// 每回合最多帶幾則對話歷史給後端（跟後端的 CHAT_HISTORY_MESSAGES 一致，多送的後端也會丟掉）
+export const CHAT_HISTORY_LIMIT = 20;
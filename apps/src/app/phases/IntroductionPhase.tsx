@@ -121,6 +121,13 @@ export default function IntroductionPhase({ roomId, playerId, roomCode, isHost,
 
   const handleRoleSelection = async () => {
     setGeneratingWorld(true);
+    // 角色一寫入就先進入選角，其餘內容在背景繼續生成
+    let advanced = false;
+    const advance = () => {
+      if (advanced) return;
+      advanced = true;
+      setCurrentPhase();
+    };
     try {
       console.log('發送 generateWorld 請求...');
       const { data: playersData, error: playersError } = await supabase
@@ -143,7 +150,8 @@ export default function IntroductionPhase({ roomId, playerId, roomCode, isHost,
           num_characters: playerCount || 4,
           num_npcs: 3,
           num_acts: 2,
-        }
+        },
+        advance
       );
   
       console.log('世界資料:', worldData);
@@ -154,7 +162,7 @@ export default function IntroductionPhase({ roomId, playerId, roomCode, isHost,
       toast.error(error instanceof Error ? error.message : '生成世界資料失敗');
     }
     finally {
-      setCurrentPhase();
+      advance();
       setGeneratingWorld(false); // 結束 loading
     }
   };
@@ -1,8 +1,9 @@
 'use client';
 import React, { useState, useEffect } from 'react';
 import { supabase } from '../lib/supabaseClient';
-import { chatWithNPC } from '../lib/chatWithNPC';
+import { streamChatWithNPC } from '../lib/chatWithNPC';
 import { useSyncedTimer } from '../lib/useSyncedTimer';
+import { CHAT_HISTORY_LIMIT } from '../lib/config';
 
 interface InvestigationPhaseProps {
   roomId: string;
@@ -27,6 +28,8 @@ const InvestigationPhase: React.FC<InvestigationPhaseProps> = ({
   const [objects, setObjects] = useState<{ id: string; map_id: string; name: string; content: string | null }[]>([]);
   const [npcs, setNpcs] = useState<{ id: string; map_id: string; name: string; info: string | null }[]>([]);
   const [chatDialogues, setChatDialogues] = useState<{ [npcId: string]: string }>({});
+  // 世界還沒存進後端，對話歷史由前端保存、每回合帶給後端（只留最近 CHAT_HISTORY_LIMIT 則）
+  const [chatHistories, setChatHistories] = useState<{ [npcId: string]: { role: 'user' | 'assistant'; content: string }[] }>({});
   const [inputText, setInputText] = useState<string>('');
 
   const timer = useSyncedTimer({
@@ -130,8 +133,9 @@ const InvestigationPhase: React.FC<InvestigationPhaseProps> = ({
         mission: "收集線索並解開謎團"
       };
   
-      // 發送對話請求
-      const response = await chatWithNPC(roomData.script_id, playerId, npcId, {
+      // 發送對話請求（串流：NPC 回應邊生成邊顯示）
+      const history = chatHistories[npcId] || [];
+      const response = await streamChatWithNPC(roomData.script_id, playerId, npcId, {
         text: inputText,
         background: scriptData?.background || '這是一個推理遊戲',
         npc_info: {
@@ -139,7 +143,12 @@ const InvestigationPhase: React.FC<InvestigationPhaseProps> = ({
           description: npc.info || '一個神秘的角色'
         },
         player_info: playerInfo,
-        chat_history: []
+        chat_history: history
+      }, (dialogueSoFar) => {
+        setChatDialogues((prev) => ({
+          ...prev,
+          [npcId]: dialogueSoFar
+        }));
       });
   
       // 儲存每個 NPC 對話紀錄
@@ -147,6 +156,14 @@ const InvestigationPhase: React.FC<InvestigationPhaseProps> = ({
         ...prev,
         [npcId]: response.dialogue || 'NPC 沒有回應'
       }));
+      setChatHistories((prev) => ({
+        ...prev,
+        [npcId]: [
+          ...history,
+          { role: 'user' as const, content: inputText },
+          { role: 'assistant' as const, content: response.dialogue },
+        ].slice(-CHAT_HISTORY_LIMIT)
+      }));
   
       if (response.hint) console.log('NPC 線索:', response.hint);
       if (response.evidence) console.log('NPC 提供證據:', response.evidence);
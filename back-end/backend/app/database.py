@@ -1,14 +1,70 @@
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
 import os
 
+from .migrations import run_migrations
+
 db_file = os.getenv("DATABASE_URL", "sqlite:///session.db")
-engine = create_engine(db_file, echo=False, connect_args={"check_same_thread": False})
+# 連線池大小；SQLite 同時只有一個 writer，太大沒有意義
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# 拿不到寫入鎖時最多等多久（毫秒），而不是馬上丟 "database is locked"
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+_url = make_url(db_file)
+_is_sqlite = _url.get_backend_name() == "sqlite"
+_is_sqlite_file = _is_sqlite and _url.database not in (None, "", ":memory:")
+
+def _engine_kwargs() -> dict:
+    kwargs = {"echo": False}
+    if _is_sqlite:
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if not _is_sqlite or _is_sqlite_file:
+        kwargs["pool_size"] = DB_POOL_SIZE
+        kwargs["max_overflow"] = DB_MAX_OVERFLOW
+    return kwargs
+
+def _set_sqlite_pragmas(dbapi_conn, _record) -> None:
+    """
+    每條新連線都設定：WAL 讓讀不會擋寫、寫不會擋讀；
+    synchronous=NORMAL 在 WAL 下只在 checkpoint 時 fsync；busy_timeout 讓寫入排隊等鎖
+    """
+    cursor = dbapi_conn.cursor()
+    if _is_sqlite_file:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.close()
 
-# 啟動時建立 table
+# 同步 engine：給 scripts、測試與既有的 MemoryService 直接使用
+engine = create_engine(db_file, **_engine_kwargs())
+
+# 非同步 engine：給 routers 用，SQLite 走 aiosqlite
+async_db_url = os.getenv("ASYNC_DATABASE_URL") or (
+    _url.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False) if _is_sqlite else None
+)
+async_engine = create_async_engine(async_db_url, **_engine_kwargs()) if async_db_url else None
+
+if _is_sqlite:
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    if async_engine is not None:
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+# 啟動時建立 table，再補上舊 DB 缺的欄位與索引
 def init_db():
+    from . import models  # noqa: F401  確保所有 table 都註冊到 metadata
     SQLModel.metadata.create_all(engine)
+    run_migrations(engine)
 
 # 取得 DB session
 def get_session():
     with Session(engine) as session:
-        yield session
\ No newline at end of file
+        yield session
+
+# 取得非同步 DB session；既有的同步邏輯用 await session.run_sync(lambda s: MemoryService(s)...) 呼叫
+async def get_async_session():
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
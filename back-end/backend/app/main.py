@@ -1,6 +1,12 @@
+import logging
 from fastapi import FastAPI
-from .database import init_db
-from .routers import world, world_gen, chat,players,npcs
+from fastapi.responses import PlainTextResponse
+from .database import init_db, engine, async_engine
+from .routers import world, world_gen, chat,players,npcs,games,rooms,stats
+from .services.llm_service import backend
+from .services.history_manager import history_manager
+from .services.world_pool import world_pool
+from .services.metrics import MetricsMiddleware, instrument_engine, registry
 import os
 from dotenv import load_dotenv
 from sqlalchemy import text
@@ -11,7 +17,18 @@ from fastapi.middleware.cors import CORSMiddleware
 basedir = os.path.dirname(os.path.dirname(__file__))
 load_dotenv(os.path.join(basedir, '..', '.env'))
 
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+
+# 每個 DB query 的耗時（同步與非同步 engine 都記）
+instrument_engine(engine)
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine)
+
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],  # 或 ["*"]，若你測試階段可開放所有
@@ -23,12 +40,27 @@ app.add_middleware(
 @app.on_event('startup')
 async def on_startup():
     init_db()
+    # 有設定 WORLD_POOL_THEMES 時開始在背景預先生成世界
+    world_pool.start(world_gen.generate_pooled_world)
+
+@app.on_event('shutdown')
+async def on_shutdown():
+    await world_pool.stop()
+    # 等背景的對話摘要寫完，不然 LLM 已經付費生成的摘要會跟著關機丟掉
+    await history_manager.drain()
+    # 關閉共用的 LLM 連線池與 DB 連線
+    await backend.aclose()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 app.include_router(world.router,     prefix='/api/world',   tags=['world'])
 app.include_router(world_gen.router, prefix='/api/world',   tags=['world-gen'])
 app.include_router(chat.router,      prefix='/api/chat',    tags=['chat'])
 app.include_router(players.router,    prefix="/api",       tags=["players"]) 
 app.include_router(npcs.router, prefix="/api",    tags=["npcs"])  
+app.include_router(games.router, prefix="/api",   tags=["games"])
+app.include_router(rooms.router, prefix="/api",   tags=["rooms"])
+app.include_router(stats.router, prefix="/api",   tags=["stats"])
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,4 +68,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-)
\ No newline at end of file
+)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Prometheus 格式的 route / LLM stage / DB 耗時與 token 數
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
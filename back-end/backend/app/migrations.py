@@ -0,0 +1,100 @@
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+# create_all 只會建新的 table，不會幫已經存在的 DB 補欄位或索引；
+# 這些變更寫成有版本號的 migration，啟動時依序補上還沒套用的。
+# 已經發佈的 migration 不要再改，有新的 schema 變更就往後加一個版本。
+
+
+def _add_message_npc_id(conn: Connection) -> None:
+    columns = [c["name"] for c in inspect(conn).get_columns("message")]
+    if "npc_id" not in columns:
+        conn.exec_driver_sql("ALTER TABLE message ADD COLUMN npc_id INTEGER REFERENCES npc (id)")
+
+
+def _add_foreign_key_indexes(conn: Connection) -> None:
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS ix_character_game_id ON character (game_id)",
+        "CREATE INDEX IF NOT EXISTS ix_player_game_id ON player (game_id)",
+        "CREATE INDEX IF NOT EXISTS ix_npc_game_id ON npc (game_id)",
+        "CREATE INDEX IF NOT EXISTS ix_npc_location_id ON npc (location_id)",
+        "CREATE INDEX IF NOT EXISTS ix_location_game_id ON location (game_id)",
+        "CREATE INDEX IF NOT EXISTS ix_gameobj_location_id ON gameobj (location_id)",
+        "CREATE INDEX IF NOT EXISTS ix_gameobj_owner_id ON gameobj (owner_id)",
+        "CREATE INDEX IF NOT EXISTS ix_message_player_id_timestamp ON message (player_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_message_player_id_npc_id_timestamp ON message (player_id, npc_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_conversationsummary_player_id_npc_id ON conversationsummary (player_id, npc_id)",
+    ):
+        conn.exec_driver_sql(statement)
+    # 讓 query planner 拿到新索引的統計資料
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("ANALYZE")
+
+
+def _make_gameobj_lock_nullable(conn: Connection) -> None:
+    lock = next(c for c in inspect(conn).get_columns("gameobj") if c["name"] == "lock")
+    if lock["nullable"]:
+        return
+    if conn.dialect.name != "sqlite":
+        conn.exec_driver_sql("ALTER TABLE gameobj ALTER COLUMN lock DROP NOT NULL")
+        return
+    # SQLite 不能拿掉欄位的 NOT NULL：建一張新表、搬資料、換名字，再補回索引
+    conn.exec_driver_sql(
+        "CREATE TABLE gameobj_new (id INTEGER NOT NULL PRIMARY KEY,"
+        " location_id INTEGER NOT NULL REFERENCES location (id), name VARCHAR NOT NULL,"
+        " lock INTEGER, clue VARCHAR, owner_id INTEGER REFERENCES player (id))"
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO gameobj_new (id, location_id, name, lock, clue, owner_id)"
+        " SELECT id, location_id, name, lock, clue, owner_id FROM gameobj"
+    )
+    conn.exec_driver_sql("DROP TABLE gameobj")
+    conn.exec_driver_sql("ALTER TABLE gameobj_new RENAME TO gameobj")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_gameobj_location_id ON gameobj (location_id)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_gameobj_owner_id ON gameobj (owner_id)")
+
+
+# (版本, 說明, 套用函式)
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "message.npc_id", _add_message_npc_id),
+    (2, "foreign key and conversation indexes", _add_foreign_key_indexes),
+    (3, "gameobj.lock nullable", _make_gameobj_lock_nullable),
+]
+
+
+def current_version(engine: Engine) -> int:
+    with engine.connect() as conn:
+        if not inspect(conn).has_table("schema_version"):
+            return 0
+        return conn.exec_driver_sql("SELECT MAX(version) FROM schema_version").scalar() or 0
+
+
+def run_migrations(engine: Engine) -> int:
+    """
+    套用還沒套用過的 migration，每個版本一個 transaction；回傳目前的 schema 版本
+    """
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            " version INTEGER PRIMARY KEY,"
+            " description VARCHAR NOT NULL,"
+            " applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
+    version = current_version(engine)
+    for number, description, apply in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as conn:
+            apply(conn)
+            conn.exec_driver_sql(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (number, description),
+            )
+        logger.info("套用 schema migration %s: %s", number, description)
+        version = number
+    return version
@@ -1,7 +1,7 @@
 from sqlmodel import SQLModel, Field, Relationship
 from typing import List, Optional, Dict, Any, Tuple
 from sqlalchemy.types import JSON
-from sqlalchemy import Column
+from sqlalchemy import Column, Index
 import datetime
 
 class Game(SQLModel, table=True):
@@ -23,7 +23,7 @@ class Game(SQLModel, table=True):
 
 class Character(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    game_id: int = Field(foreign_key="game.id")
+    game_id: int = Field(foreign_key="game.id", index=True)
     name: str
     role: str
     public_info: str
@@ -35,7 +35,7 @@ class Character(SQLModel, table=True):
     
 class Player(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    game_id: int = Field(foreign_key="game.id")
+    game_id: int = Field(foreign_key="game.id", index=True)
     user_id: str                                         # 前端的玩家識別
     character_id: Optional[int] = Field(foreign_key="character.id")
     joined_at: datetime.datetime = Field(default_factory=datetime.datetime.now)
@@ -48,17 +48,37 @@ class Player(SQLModel, table=True):
 
 
 class Message(SQLModel, table=True):
+    # 對話紀錄都是「某玩家（與某 NPC）最近 N 則」，依時間排序
+    __table_args__ = (
+        Index("ix_message_player_id_timestamp", "player_id", "timestamp"),
+        Index("ix_message_player_id_npc_id_timestamp", "player_id", "npc_id", "timestamp"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     player_id: int = Field(foreign_key="player.id")
+    npc_id: Optional[int] = Field(default=None, foreign_key="npc.id")   # 對話對象的 NPC
     role: str                                            # "user" or "assistant" or "system"
     content: str
     timestamp: datetime.datetime = Field(default_factory=datetime.datetime.now)
 
     player: Player = Relationship(back_populates="messages")
+
+class ConversationSummary(SQLModel, table=True):
+    """
+    玩家與某個 NPC 較早對話的滾動摘要，covered_until 之前（含）的訊息都已經被摘要進來
+    """
+    __table_args__ = (
+        Index("ix_conversationsummary_player_id_npc_id", "player_id", "npc_id"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    player_id: int = Field(foreign_key="player.id")
+    npc_id: Optional[int] = Field(default=None, foreign_key="npc.id")
+    content: str
+    covered_until: int                                   # 最後一則被摘要的 Message.id
+    updated_at: datetime.datetime = Field(default_factory=datetime.datetime.now)
     
 class Location(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    game_id: int       = Field(foreign_key="game.id")
+    game_id: int       = Field(foreign_key="game.id", index=True)
     name: str
 
     # 這裡關聯 NPC、Object
@@ -68,9 +88,9 @@ class Location(SQLModel, table=True):
 
 class GameObj(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    location_id: int  = Field(foreign_key="location.id")
+    location_id: int  = Field(foreign_key="location.id", index=True)
     name: str
-    lock: int = Field(
+    lock: Optional[int] = Field(
         default=None, 
         description="可解鎖此物件的 NPC ID，若為 None 則表示無需解鎖"
     )
@@ -80,6 +100,7 @@ class GameObj(SQLModel, table=True):
     owner_id:     Optional[int]      = Field(
         foreign_key="player.id",
         default=None,
+        index=True,
         description="已解鎖此物件的玩家 ID"
     )
     owner:        Optional["Player"] = Relationship(back_populates="unlocked_objects")
@@ -88,12 +109,23 @@ class GameObj(SQLModel, table=True):
     
 class Npc(SQLModel, table=True):
     id:          Optional[int] = Field(default=None, primary_key=True)
-    game_id:     int           = Field(foreign_key="game.id")
+    game_id:     int           = Field(foreign_key="game.id", index=True)
     name:        str
     description: str           # NPC 的簡短介紹或立場
 
     # 新增關聯到 Location
-    location_id: Optional[int] = Field(foreign_key="location.id", default=None)
+    location_id: Optional[int] = Field(foreign_key="location.id", default=None, index=True)
     location: Optional[Location] = Relationship(back_populates="npcs")
     
     game: Game = Relationship(back_populates="npcs")
+
+
+class IdempotencyRecord(SQLModel, table=True):
+    """
+    generate_full 的冪等紀錄：同一個 Idempotency-Key 重送時直接回傳存下來的結果，不再生成一次
+    """
+    key: str = Field(primary_key=True)                   # 前端送來的 Idempotency-Key
+    game_id: int = Field(foreign_key="game.id", index=True)
+    request_hash: str                                    # 同一個 key 配不同內容要拒絕
+    response: Dict[str, Any] = Field(sa_column=Column(JSON))
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.now)
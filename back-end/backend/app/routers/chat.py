@@ -1,8 +1,22 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+import json
+import logging
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, model_validator
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
-from ..services.llm_service import call_llm_for_chat
+from ..database import async_engine, get_async_session
+from ..models import Game, Npc, Player, Character
+from ..services.memory_services import MemoryService
+from ..services.conversation_store import CHAT_HISTORY_MESSAGES, conversation_store
+from ..services.history_manager import history_manager
+from ..services.llm_service import call_llm_for_chat, stream_llm_for_chat
+from ..services.llm_scheduler import Priority, llm_context, llm_scheduler
+from ..services.structured_log import log_event
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="",
@@ -21,84 +35,202 @@ class NpcInfo(BaseModel):
     description: str
 
 class ChatRequest(BaseModel):
-    game_id: str = Field(..., description="遊戲 ID")
-    player_id: str = Field(..., description="玩家 ID")
-    npc_id: str = Field(..., description="NPC ID")
+    game_id: Union[int, str] = Field(..., description="遊戲 ID")
+    player_id: Union[int, str] = Field(..., description="玩家 ID")
+    npc_id: Union[int, str] = Field(..., description="NPC ID")
     text: str = Field(..., description="玩家說的話")
-    model: str = Field(default="gemini-2.0-flash", description="LLM 模型名稱")
-    temperature: float = Field(default=0.7, ge=0, le=1, description="隨機性控制 (0~1)")
-    background: str = Field(..., description="遊戲故事背景")
-    npc_info: NpcInfo = Field(..., description="NPC 資訊")
-    player_info: PlayerInfo = Field(..., description="玩家角色資訊")  # 新增
-    chat_history: List[Dict[str, str]] = Field(default_factory=list, description="對話歷史")
+    model: Optional[str] = Field(default=None, description="LLM 模型名稱；不填則依 model routing 決定")
+    temperature: Optional[float] = Field(default=None, ge=0, le=1, description="隨機性控制 (0~1)；不填用預設")
+    # 相容舊版前端：世界只存在 Supabase、後端 DB 沒有這場遊戲時，由 client 帶上下文。
+    # 有 npc_info 就不查 DB，歷史用 chat_history，對話也不寫回 server。
+    background: Optional[str] = Field(None, description="遊戲故事背景（client 帶上下文時）")
+    npc_info: Optional[NpcInfo] = Field(None, description="NPC 資訊（client 帶上下文時）")
+    player_info: Optional[PlayerInfo] = Field(None, description="玩家角色資訊（client 帶上下文時）")
+    chat_history: Optional[List[Dict[str, str]]] = Field(None, description="對話歷史（client 帶上下文時）")
+
+    @model_validator(mode="after")
+    def _server_ids(self) -> "ChatRequest":
+        # 由 server 組上下文時，id 必須是後端 DB 的 id
+        if self.npc_info is None:
+            try:
+                self.game_id, self.player_id, self.npc_id = int(self.game_id), int(self.player_id), int(self.npc_id)
+            except ValueError:
+                raise ValueError("沒有附 npc_info 時，game_id / player_id / npc_id 必須是後端的 id")
+        return self
+
+    @property
+    def client_context(self) -> bool:
+        return self.npc_info is not None
+
+    @property
+    def context_key(self) -> Optional[Tuple[int, int, int]]:
+        # client 帶的上下文每次都可能不同，不進 system instruction 快取
+        return None if self.client_context else (self.game_id, self.npc_id, self.player_id)
 
 class ChatResponse(BaseModel):
     dialogue: str = Field(..., description="NPC 的完整對話回應")
     hint: Optional[str] = Field(None, description="線索提示")
     evidence: Optional[str] = Field(None, description="證據")
 
+def _load_chat_context(
+    session: Session, req: ChatRequest
+) -> Tuple[str, Dict[str, Any], Dict[str, Any], List[Dict[str, str]]]:
+    """
+    由 id 在 server 端組出對話需要的背景、玩家角色、NPC 與歷史紀錄
+    """
+    if not req.text or not req.text.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="對話內容不能為空"
+        )
+    if req.client_context:
+        player_info = req.player_info.model_dump() if req.player_info else {}
+        history = (req.chat_history or [])[-CHAT_HISTORY_MESSAGES:]
+        return req.background or "", player_info, req.npc_info.model_dump(), history
+
+    game = session.get(Game, req.game_id)
+    if not game:
+        raise HTTPException(404, "Game not found")
+    npc = session.get(Npc, req.npc_id)
+    if not npc or npc.game_id != req.game_id:
+        raise HTTPException(404, "NPC not found in this game")
+    player = session.get(Player, req.player_id)
+    if not player or player.game_id != req.game_id:
+        raise HTTPException(404, "Player not found in this game")
+
+    # 玩家尚未認領角色時，交給 LLM 端的預設值
+    player_info: Dict[str, Any] = {}
+    if player.character_id is not None:
+        char = session.get(Character, player.character_id)
+        if char:
+            player_info = {
+                "name": char.name,
+                "role": char.role,
+                "public_info": char.public_info,
+                "secret": char.secret,
+                "mission": char.mission,
+            }
+    npc_info = {
+        "name": npc.name,
+        "description": npc.description,
+    }
+
+    # 較早的對話會被折疊成摘要，送進 LLM 的歷史維持在 token 預算內
+    history = history_manager.prepare(MemoryService(session), req.player_id, req.npc_id, npc.name)
+    return game.background or "", player_info, npc_info, history
+
+def _remember_turn(session: Session, req: ChatRequest, dialogue: str) -> None:
+    if req.client_context:
+        return   # 歷史由 client 自己保存
+    mem = MemoryService(session)
+    conversation_store.append(mem, req.player_id, req.npc_id, "user", req.text)
+    conversation_store.append(mem, req.player_id, req.npc_id, "assistant", dialogue)
+
 @router.post("/npc", response_model=ChatResponse)
-async def chat_with_npc(req: ChatRequest):
+async def chat_with_npc(req: ChatRequest, session: AsyncSession = Depends(get_async_session)):
     """
     與 NPC 對話的 API
     """
     try:
-        print(f"=== Chat API Called ===")
-        print(f"Received request: {req}")
-        
-        if not req.text or not req.text.strip():
-            raise HTTPException(
-                status_code=400,
-                detail="對話內容不能為空"
-            )
+        background, player_info, npc_info, history = await session.run_sync(_load_chat_context, req)
+        # 讀完就結束 transaction、把連線還給連線池，不要在等 LLM 的這段時間佔著；寫入時再拿一條
+        await session.close()
+        log_event(logger, logging.DEBUG, "chat_request", game_id=req.game_id, player_id=req.player_id,
+                  npc_id=req.npc_id, text_chars=len(req.text), history=len(history))
 
-        # 直接使用前端傳來的玩家角色資訊
-        player_info = {
-            "name": req.player_info.name,
-            "role": req.player_info.role,
-            "public_info": req.player_info.public_info,
-            "secret": req.player_info.secret,
-            "mission": req.player_info.mission
-        }
-
-        # 直接使用前端傳來的 NPC 資訊
-        npc_info = {
-            "name": req.npc_info.name,
-            "description": req.npc_info.description
-        }
-
-        print(f"玩家角色資訊: {player_info}")
-        print(f"NPC 資訊: {npc_info}")
-
-        # 呼叫 LLM 服務
-        result = await call_llm_for_chat(
-            background=req.background,
-            player_character=player_info,
-            npc_character=npc_info,
-            history=req.chat_history,
-            user_text=req.text,
-            model=req.model,
-            temperature=req.temperature
-        )
-
-        print(f"LLM result: {result}")
+        # 呼叫 LLM 服務（玩家正在等，用最高優先級）
+        with llm_context(Priority.INTERACTIVE, user=f"player:{req.player_id}"):
+            result = await call_llm_for_chat(
+                background=background,
+                player_character=player_info,
+                npc_character=npc_info,
+                history=history,
+                user_text=req.text,
+                model=req.model,
+                temperature=req.temperature,
+                context_key=req.context_key
+            )
 
         response = ChatResponse(
             dialogue=result.get("dialogue", "抱歉，我現在無法回應。"),
             hint=result.get("hint"),
             evidence=result.get("evidence")
         )
-        
-        print(f"Returning response: {response}")
+        await session.run_sync(_remember_turn, req, response.dialogue)
+
         return response
 
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error in chat_with_npc: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("chat_with_npc 失敗")
         raise HTTPException(
-            status_code=500, 
+            status_code=500,
             detail=f"對話處理失敗: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+async def stream_chat_turn(
+    req: ChatRequest, context: Tuple[str, Dict[str, Any], Dict[str, Any], List[Dict[str, str]]]
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    串流的一回合對話（SSE 與遊戲房間的 WebSocket 共用）：
+    逐段 yield ("dialogue", 新增的文字)，存好對話後 yield ("done", ChatResponse)
+    """
+    background, player_info, npc_info, history = context
+    with llm_context(Priority.INTERACTIVE, user=f"player:{req.player_id}"):
+        async for kind, payload in stream_llm_for_chat(
+            background=background,
+            player_character=player_info,
+            npc_character=npc_info,
+            history=history,
+            user_text=req.text,
+            model=req.model,
+            temperature=req.temperature,
+            context_key=req.context_key
+        ):
+            if kind == "dialogue":
+                yield kind, payload
+                continue
+            response = ChatResponse(
+                dialogue=payload.get("dialogue") or "抱歉，我現在無法回應。",
+                hint=payload.get("hint"),
+                evidence=payload.get("evidence")
+            )
+            # 串流開始後 request 的 session 可能已關閉，另開一個寫入
+            async with AsyncSession(async_engine, expire_on_commit=False) as write_session:
+                await write_session.run_sync(_remember_turn, req, response.dialogue)
+            yield "done", response
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/npc/stream")
+async def chat_with_npc_stream(req: ChatRequest, session: AsyncSession = Depends(get_async_session)):
+    """
+    串流版的 NPC 對話 (Server-Sent Events)：
+    - event: dialogue  data: {"delta": "..."}   NPC 對話逐段送出
+    - event: done      data: ChatResponse        完整結果，含 hint / evidence
+    - event: error     data: {"detail": "..."}
+    """
+    context = await session.run_sync(_load_chat_context, req)
+    await session.close()
+    # 串流開始後就不能改 status code，排隊已滿要在這裡先回 429
+    llm_scheduler.check_admission(Priority.INTERACTIVE)
+
+    async def events():
+        try:
+            async for kind, payload in stream_chat_turn(req, context):
+                if kind == "dialogue":
+                    yield _sse("dialogue", {"delta": payload})
+                else:
+                    yield _sse("done", payload.model_dump())
+        except Exception as e:
+            logger.exception("chat_with_npc_stream 失敗")
+            yield _sse("error", {"detail": f"對話處理失敗: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # 關掉中間層的快取與緩衝，token 才會即時送到瀏覽器
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
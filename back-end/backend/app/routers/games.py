@@ -0,0 +1,197 @@
+# back-end/backend/app/routers/games.py
+
+from typing import Dict, List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import BaseModel, ConfigDict, Field
+from sqlalchemy.orm import selectinload
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..database import get_async_session
+from ..models import Game, GameObj, Location
+from ..services.game_rooms import game_rooms
+from ..services.memory_services import MemoryService
+from ..services.read_cache import read_cache
+from .world_gen import ActInfo, GameObjectInfo, LocationInfo
+
+router = APIRouter(
+    prefix="/games/{game_id}",
+    tags=["games"],
+)
+
+class StateNpcInfo(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    id:          int
+    name:        str
+    description: str
+    location_id: Optional[int]
+
+class StateCharacterInfo(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    id:          int
+    name:        str
+    role:        str
+    public_info: str
+    secret:      Optional[str] = Field(None, description="只有自己的角色才會給")
+    mission:     Optional[str] = Field(None, description="只有自己的角色才會給")
+
+class PlayerInfo(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    id:           int
+    user_id:      str
+    character_id: Optional[int]
+
+class GameState(BaseModel):
+    game_id:    int
+    version:    int
+    background: Optional[str]
+    acts:       List[ActInfo]
+    ending:     Optional[str]
+    characters: List[StateCharacterInfo]
+    npcs:       List[StateNpcInfo]
+    locations:  List[LocationInfo]
+    players:    List[PlayerInfo]
+
+UnlockStatus = Literal["unlocked", "already_owned", "taken", "locked", "not_found"]
+
+class UnlockRequest(BaseModel):
+    player_id:  int
+    object_ids: List[int] = Field(..., min_length=1, max_length=100, description="要解鎖的物件 ID")
+
+class SingleUnlockRequest(BaseModel):
+    player_id: int
+
+class UnlockResult(BaseModel):
+    object_id: int
+    status:    UnlockStatus
+    clue:      Optional[str] = Field(None, description="只有解鎖成功或本來就是自己的物件才會給")
+
+class UnlockResponse(BaseModel):
+    results: List[UnlockResult]
+
+# 單一物件解鎖失敗時的 HTTP 狀態
+_UNLOCK_ERRORS: Dict[str, tuple] = {
+    "taken":     (409, "物件已經被其他玩家解鎖"),
+    "locked":    (403, "還沒有跟負責這個物件的 NPC 對話過"),
+    "not_found": (404, "Object not found in this game"),
+}
+
+def _build_state(game: Game, version: int, player_id: Optional[int]) -> GameState:
+    """
+    線索只給解鎖它的玩家，秘密與任務只給扮演該角色的玩家；沒帶 player_id 時都不給
+    """
+    npcs_by_location = {}
+    for npc in game.npcs:
+        npcs_by_location.setdefault(npc.location_id, []).append(npc.id)
+    own_character = None
+    if player_id is not None:
+        player = next((p for p in game.players if p.id == player_id), None)
+        if player is None:
+            raise HTTPException(404, "Player not found in this game")
+        own_character = player.character_id
+    return GameState(
+        game_id=game.id,
+        version=version,
+        background=game.background,
+        acts=game.acts or [],
+        ending=game.ending,
+        characters=[
+            StateCharacterInfo.model_validate(c) if c.id == own_character
+            else StateCharacterInfo(id=c.id, name=c.name, role=c.role, public_info=c.public_info)
+            for c in game.characters
+        ],
+        npcs=game.npcs,
+        locations=[
+            LocationInfo(
+                id=loc.id,
+                name=loc.name,
+                npcs=npcs_by_location.get(loc.id, []),
+                objects=[
+                    GameObjectInfo(id=o.id, name=o.name, lock=o.lock,
+                                   clue=o.clue if player_id is not None and o.owner_id == player_id else None,
+                                   owner_id=o.owner_id)
+                    for o in loc.objects
+                ],
+            )
+            for loc in game.locations
+        ],
+        players=game.players,
+    )
+
+@router.get("/state", response_model=GameState, responses={304: {"description": "狀態沒有變動"}})
+async def get_game_state(
+    game_id: int,
+    request: Request,
+    player_id: Optional[int] = Query(None, description="查詢的玩家；只有他自己的線索、秘密與任務會出現在結果裡"),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    一次拿回重建遊戲需要的所有資料（角色、NPC、地點與物件、玩家）。
+    關聯用 selectinload 預先載入，固定 6 個 query；版本沒變時由 read_cache 回 304 或快取的 body
+    （每個玩家看到的內容不同，快取與 ETag 依 player_id 分開）。
+    """
+    async def load(version: int) -> GameState:
+        result = await session.exec(
+            select(Game)
+            .where(Game.id == game_id)
+            .options(
+                selectinload(Game.characters),
+                selectinload(Game.npcs),
+                selectinload(Game.players),
+                selectinload(Game.locations).selectinload(Location.objects),
+            )
+        )
+        game = result.first()
+        if not game:
+            raise HTTPException(404, "Game not found")
+        return _build_state(game, version, player_id)
+
+    return await read_cache.respond(request, "game_state", game_id, load, viewer=player_id)
+
+async def unlock(session: AsyncSession, game_id: int, player_id: int, object_ids: List[int]) -> List[UnlockResult]:
+    """
+    解鎖物件（HTTP 與遊戲房間的 WebSocket 共用），搶到的物件廣播 object_unlocked 給房間裡的人
+    """
+    def run(s) -> List[UnlockResult]:
+        try:
+            statuses = MemoryService(s).unlock_objects(game_id, player_id, object_ids)
+        except ValueError as e:
+            raise HTTPException(404, str(e))
+        owned = [i for i, status in statuses.items() if status in ("unlocked", "already_owned")]
+        clues = dict(s.exec(select(GameObj.id, GameObj.clue).where(GameObj.id.in_(owned))).all()) if owned else {}
+        return [UnlockResult(object_id=i, status=status, clue=clues.get(i)) for i, status in statuses.items()]
+
+    results = await session.run_sync(run)
+    for r in results:
+        if r.status == "unlocked":
+            # 線索只給解鎖的人，其他人只知道物件被誰拿走了
+            game_rooms.publish(game_id, "object_unlocked", {"object_id": r.object_id, "player_id": player_id})
+    return results
+
+@router.post("/objects/unlock", response_model=UnlockResponse)
+async def unlock_objects(
+    game_id: int,
+    req: UnlockRequest,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    一次解鎖多個物件，每個物件各自回報結果（部分成功也是 200）。
+    玩家要跟物件 lock 的 NPC 說過話；同時有很多人搶同一個物件時只會有一個人成功。
+    """
+    return UnlockResponse(results=await unlock(session, game_id, req.player_id, req.object_ids))
+
+@router.post("/objects/{object_id}/unlock", response_model=UnlockResult)
+async def unlock_object(
+    game_id: int,
+    object_id: int,
+    req: SingleUnlockRequest,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    解鎖單一物件：成功（或本來就是自己的）200，被搶走 409，還沒跟 NPC 說過話 403
+    """
+    [result] = await unlock(session, game_id, req.player_id, [object_id])
+    if result.status in _UNLOCK_ERRORS:
+        status_code, detail = _UNLOCK_ERRORS[result.status]
+        raise HTTPException(status_code, detail)
+    return result
@@ -1,13 +1,15 @@
 # back-end/backend/app/routers/npcs.py
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List
 from pydantic import BaseModel, ConfigDict
 
-from ..database import get_session
+from ..database import get_async_session
 from ..models import Game, Npc
 from ..services.memory_services import MemoryService
+from ..services.read_cache import read_cache
 
 router = APIRouter(
     prefix="/games/{game_id}/npcs",
@@ -21,15 +23,19 @@ class NpcInfo(BaseModel):
     description: str
 
 @router.get("", response_model=List[NpcInfo])
-def list_npcs(
+async def list_npcs(
     game_id: int,
-    session: Session = Depends(get_session),
+    request: Request,
+    session: AsyncSession = Depends(get_async_session),
 ):
-    # 確認遊戲存在
-    game = session.get(Game, game_id)
-    if not game:
-        raise HTTPException(404, "Game not found")
+    # NPC 生成後就不太會變：版本沒變時直接回快取，不查 DB
+    async def load(version: int) -> List[NpcInfo]:
+        # 確認遊戲存在
+        game = await session.get(Game, game_id)
+        if not game:
+            raise HTTPException(404, "Game not found")
 
-    mem = MemoryService(session)
-    npcs = mem.get_npcs(game_id)
-    return npcs
+        npcs = await session.run_sync(lambda s: MemoryService(s).get_npcs(game_id))
+        return [NpcInfo.model_validate(n) for n in npcs]
+
+    return await read_cache.respond(request, "npcs", game_id, load)
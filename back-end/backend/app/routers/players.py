@@ -2,12 +2,14 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from ..database import get_session
+from ..database import get_async_session
 from ..models import Game, Character, Player
 from ..services.memory_services import MemoryService
+from ..services.game_rooms import game_rooms
 
-router = APIRouter(prefix="/api/games/{game_id}/players", tags=["players"])
+router = APIRouter(prefix="/games/{game_id}/players", tags=["players"])
 
 class ClaimRequest(BaseModel):
     user_id: str = Field(..., description="前端玩家自己的一個識別，比如 username 或 UUID")
@@ -19,31 +21,38 @@ class ClaimResponse(BaseModel):
     character_id: int
 
 @router.post("", response_model=ClaimResponse)
-def claim_character(
+async def claim_character(
     game_id: int,
     req: ClaimRequest,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
+    return await claim(session, game_id, req)
+
+async def claim(session: AsyncSession, game_id: int, req: ClaimRequest) -> ClaimResponse:
+    """
+    認領角色（HTTP 與遊戲房間的 WebSocket 共用），成功後廣播 player_joined 給房間裡的人
+    """
     # 1. 確保遊戲存在
-    game = session.get(Game, game_id)
+    game = await session.get(Game, game_id)
     if not game:
         raise HTTPException(404, "Game not found")
 
     # 2. 確保角色存在且屬於這場遊戲
-    char = session.get(Character, req.character_id)
+    char = await session.get(Character, req.character_id)
     if not char or char.game_id != game_id:
         raise HTTPException(400, "Invalid character for this game")
 
     # 3. 建立 Player 紀錄
-    mem = MemoryService(session)
-    player = mem.assign_player(
+    player = await session.run_sync(lambda s: MemoryService(s).assign_player(
         game_id      = game_id,
         user_id      = req.user_id,
         character_id = req.character_id
-    )
+    ))
 
-    return ClaimResponse(
+    response = ClaimResponse(
         player_id    = player.id,
         game_id      = player.game_id,
         character_id = player.character_id
     )
+    game_rooms.publish(game_id, "player_joined", {**response.model_dump(), "user_id": req.user_id})
+    return response
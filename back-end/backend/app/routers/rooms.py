@@ -0,0 +1,157 @@
+# back-end/backend/app/routers/rooms.py
+
+import asyncio
+import logging
+from typing import List, Literal, Optional, Set
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel, Field, ValidationError
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..database import async_engine
+from ..models import Game, Player
+from ..services.game_rooms import RoomConnection, game_rooms
+from ..services.llm_scheduler import Priority, llm_scheduler
+from .chat import ChatRequest, _load_chat_context, stream_chat_turn
+from .games import unlock
+from .players import ClaimRequest, claim
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/games/{game_id}",
+    tags=["rooms"],
+)
+
+class RoomMessage(BaseModel):
+    """
+    client 送上來的訊息；request_id 由 client 自訂，回覆會帶同一個 request_id
+    """
+    type:         Literal["chat", "claim", "unlock", "ping"]
+    request_id:   Optional[str] = None
+    npc_id:       Optional[int] = Field(None, description="chat：對話的 NPC")
+    text:         Optional[str] = Field(None, description="chat：玩家說的話")
+    model:        Optional[str] = None
+    temperature:  Optional[float] = Field(None, ge=0, le=1)
+    user_id:      Optional[str] = Field(None, description="claim：玩家識別")
+    character_id: Optional[int] = Field(None, description="claim：要認領的角色")
+    object_ids:   Optional[List[int]] = Field(None, max_length=100, description="unlock：要解鎖的物件")
+
+async def _check_membership(game_id: int, player_id: Optional[int]) -> None:
+    async with AsyncSession(async_engine) as session:
+        if await session.get(Game, game_id) is None:
+            raise HTTPException(404, "Game not found")
+        if player_id is not None:
+            player = await session.get(Player, player_id)
+            if not player or player.game_id != game_id:
+                raise HTTPException(404, "Player not found in this game")
+
+def _presence(conn: RoomConnection, online: bool) -> None:
+    if conn.player_id is None:
+        return
+    game_rooms.publish(conn.game_id, "presence", {
+        "player_id": conn.player_id,
+        "online": online,
+        "players_online": game_rooms.players_online(conn.game_id),
+    })
+
+async def _chat(conn: RoomConnection, msg: RoomMessage) -> None:
+    """
+    一回合 NPC 對話：逐段送 chat_delta，最後送 chat_done（只給發問的玩家）
+    """
+    if conn.player_id is None:
+        raise HTTPException(400, "請先認領角色（claim）或連線時帶 player_id")
+    if msg.npc_id is None or not msg.text:
+        raise HTTPException(422, "chat 需要 npc_id 與 text")
+    req = ChatRequest(game_id=conn.game_id, player_id=conn.player_id, npc_id=msg.npc_id,
+                      text=msg.text, model=msg.model, temperature=msg.temperature)
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        context = await session.run_sync(_load_chat_context, req)
+    llm_scheduler.check_admission(Priority.INTERACTIVE)
+    async for kind, payload in stream_chat_turn(req, context):
+        if kind == "dialogue":
+            conn.send("chat_delta", {"npc_id": msg.npc_id, "delta": payload}, msg.request_id)
+        else:
+            conn.send("chat_done", {"npc_id": msg.npc_id, **payload.model_dump()}, msg.request_id)
+
+async def _claim(conn: RoomConnection, msg: RoomMessage) -> None:
+    if msg.user_id is None or msg.character_id is None:
+        raise HTTPException(422, "claim 需要 user_id 與 character_id")
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        result = await claim(session, conn.game_id, ClaimRequest(user_id=msg.user_id, character_id=msg.character_id))
+    conn.send("claimed", result.model_dump(), msg.request_id)
+    if conn.player_id is None:
+        conn.player_id = result.player_id
+        _presence(conn, True)
+
+async def _unlock(conn: RoomConnection, msg: RoomMessage) -> None:
+    if conn.player_id is None:
+        raise HTTPException(400, "請先認領角色（claim）或連線時帶 player_id")
+    if not msg.object_ids:
+        raise HTTPException(422, "unlock 需要 object_ids")
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        results = await unlock(session, conn.game_id, conn.player_id, msg.object_ids)
+    conn.send("unlock_result", {"results": [r.model_dump() for r in results]}, msg.request_id)
+
+async def _handle(conn: RoomConnection, msg: RoomMessage) -> None:
+    try:
+        if msg.type == "chat":
+            await _chat(conn, msg)
+        elif msg.type == "claim":
+            await _claim(conn, msg)
+        elif msg.type == "unlock":
+            await _unlock(conn, msg)
+        else:
+            conn.send("pong", {}, msg.request_id)
+    except HTTPException as e:
+        conn.send("error", {"status": e.status_code, "detail": e.detail}, msg.request_id)
+    except Exception as e:
+        logger.exception("遊戲房間訊息處理失敗 type=%s", msg.type)
+        conn.send("error", {"status": 500, "detail": f"處理失敗: {str(e)}"}, msg.request_id)
+
+@router.websocket("/ws")
+async def game_room(websocket: WebSocket, game_id: int, player_id: Optional[int] = None):
+    """
+    遊戲房間的 WebSocket（一條連線處理這場遊戲的所有互動）：
+    - client -> server：{"type": "chat" | "claim" | "unlock" | "ping", "request_id": ..., ...}
+    - server -> client：{"type": ..., "data": {...}, "request_id"?: ...}
+      chat_delta / chat_done / claimed / unlock_result / pong / error 只回給送出的人；
+      player_joined / presence / object_unlocked 廣播給房間裡所有人
+    同一條連線可以同時進行多個 chat，用 request_id 分辨。
+    """
+    try:
+        await _check_membership(game_id, player_id)
+    except HTTPException as e:
+        await websocket.accept()
+        await websocket.close(code=4000 + e.status_code, reason=e.detail)
+        return
+
+    conn = await game_rooms.connect(websocket, game_id, player_id)
+    conn.send("welcome", {
+        "game_id": game_id,
+        "player_id": player_id,
+        "players_online": game_rooms.players_online(game_id),
+    })
+    _presence(conn, True)
+    tasks: Set[asyncio.Task] = set()
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                msg = RoomMessage.model_validate_json(raw)
+            except ValidationError as e:
+                conn.send("error", {"status": 422, "detail": e.errors(include_url=False, include_context=False)})
+                continue
+            # 每則訊息各自一個 task，慢的 chat 不會擋住同一條連線的其他訊息
+            task = asyncio.get_running_loop().create_task(_handle(conn, msg))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # client 已經走了：還在跑的 chat 不用再生成，也別繼續佔著 interactive 的名額
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await game_rooms.disconnect(conn)
+        _presence(conn, False)
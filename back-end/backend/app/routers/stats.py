@@ -0,0 +1,45 @@
+# back-end/backend/app/routers/stats.py
+from typing import Any, Dict
+from fastapi import APIRouter, HTTPException
+
+from ..services.context_cache import chat_context_cache
+from ..services.game_rooms import game_rooms
+from ..services.llm_resilience import resilient
+from ..services.llm_scheduler import llm_scheduler
+from ..services.model_router import model_router
+from ..services.read_cache import read_cache
+from ..services.response_cache import response_cache
+from ..services.single_flight import llm_single_flight
+from ..services.world_pool import world_pool
+
+router = APIRouter(prefix="/stats", tags=["stats"])
+
+def _sources() -> Dict[str, Any]:
+    """
+    名稱 -> 有 stats() 的元件（每次請求才取，測試可以 monkeypatch 換掉）
+    """
+    return {
+        "chat-context-cache": chat_context_cache,   # NPC 對話 system instruction 快取與 token 用量
+        "llm-cache": response_cache,                # 背景與世界生成的 LLM 回應快取
+        "llm-scheduler": llm_scheduler,             # 各優先級進行中、排隊中、被拒絕 (429) 的數量
+        "llm-resilience": resilient,                # 重試、hedge、斷路器狀態與延遲
+        "llm-single-flight": llm_single_flight,     # 相同 LLM 請求合併的次數與比例
+        "model-routes": model_router,               # 各任務目前使用的模型、SLO 與延遲
+        "read-cache": read_cache,                   # 遊戲 GET API 讀取快取
+        "rooms": game_rooms,                        # 遊戲房間 WebSocket 連線與廣播
+        "world-pool": world_pool,                   # 預先生成的世界
+    }
+
+@router.get("")
+def all_stats():
+    """
+    所有元件的執行狀態（JSON）；Prometheus 格式的耗時與 token 指標在 /metrics
+    """
+    return {name: source.stats() for name, source in _sources().items()}
+
+@router.get("/{name}")
+def component_stats(name: str):
+    source = _sources().get(name)
+    if source is None:
+        raise HTTPException(404, f"Unknown stats: {name}")
+    return source.stats()
@@ -1,42 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from sqlmodel import Session
-from ..database import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from ..database import get_async_session
 from ..models import Game
 from ..services.memory_services import MemoryService
 from ..services.llm_service import call_llm_for_background  # 你自己包的 LLM 呼叫
+from ..services.llm_scheduler import Priority, client_key, llm_context
 
 router = APIRouter()
 
 class BackgroundRequest(BaseModel):
     prompt: str
+    fresh: bool = False   # True 時不用快取，一定重新生成
 
 class BackgroundResponse(BaseModel):
     background: str
+    game_id: int   # 實際使用的遊戲 ID（path 裡的遊戲不存在時會新建一場）
 
-@router.post("/games/{game_id}/background")
-def generate_background(
+@router.post("/games/{game_id}/background", response_model=BackgroundResponse)
+async def generate_background(
     game_id: int,
     req: BackgroundRequest,
-    session: Session = Depends(get_session)
+    request: Request,
+    session: AsyncSession = Depends(get_async_session)
 ):
-    mem = MemoryService(session)
-
     # 1. 嘗試拿 Game，若不存在就自動建立一筆
-    game = session.get(Game,game_id)
-    if game:
-        mem.clear_game(game_id)
-    if not game:
-        game = mem.create_game()
+    def prepare_game(s: Session) -> int:
+        mem = MemoryService(s)
+        game = s.get(Game,game_id)
+        if game:
+            mem.clear_game(game_id)
+            return game_id
         # 如果前端 path 裡給的 id 和實際 auto-increment id 不同，
         # 你可以選擇忽略 path 裡的 game_id，只用新建的 game.id
-        game_id = game.id
+        return mem.create_game().id
+
+    game_id = await session.run_sync(prepare_game)
 
     # 2. 呼叫 LLM 產生背景
-    background_text = call_llm_for_background(req.prompt)
+    with llm_context(Priority.WORLD_GEN, user=client_key(request)):
+        background_text = await call_llm_for_background(req.prompt, fresh=req.fresh)
 
     # 3. 存到 database
-    mem.save_background(game_id, background_text)
+    await session.run_sync(lambda s: MemoryService(s).save_background(game_id, background_text))
 
     # 4. 回傳
-    return {"background": background_text}
+    return BackgroundResponse(background=background_text, game_id=game_id)
@@ -1,13 +1,30 @@
-from fastapi import APIRouter, HTTPException
+import json
+import asyncio
+import hashlib
+import logging
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+
+from ..database import async_engine, get_async_session
+from ..models import Game
+from ..services.memory_services import GameHasPlayers, MemoryService
 
 from ..services.llm_service import (
+    call_llm_for_background,
     call_llm_for_characters,
     call_llm_for_npcs,
     call_llm_for_scenes_and_ending,
     call_llm_for_locations,
 )
+from ..services.stage_graph import StageGraph
+from ..services.world_pool import world_pool
+from ..services.llm_scheduler import Priority, client_key, llm_context, llm_scheduler
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/world/games", tags=["world-gen"])
 
@@ -16,8 +33,10 @@ class WorldGenRequest(BaseModel):
     num_characters: int = Field(4, ge=3, le=6, description="生成角色數量")
     num_npcs:       int = Field(3, ge=1, description="生成 NPC 數量")
     num_acts:       int = Field(2, ge=1, le=10, description="生成幕數")
-    model:          str = Field("gemini-2.0-flash", description="LLM 模型名稱")
-    temperature:    float = Field(0.7, ge=0, le=1, description="隨機性控制 (0~1)")
+    model:          Optional[str] = Field(None, description="LLM 模型名稱；不填則依 model routing 決定")
+    temperature:    Optional[float] = Field(None, ge=0, le=1, description="隨機性控制 (0~1)；不填用各任務的預設")
+    fresh:          bool = Field(False, description="不用快取的結果，一定重新生成")
+    game_id:        Optional[int] = Field(None, description="有給的話生成結果會存進這場遊戲")
 
 class CharacterInfo(BaseModel):
     model_config = ConfigDict(from_attributes=True)
@@ -64,52 +83,77 @@ class WorldGenResponse(BaseModel):
     ending:     str
     locations:  List[LocationInfo]
 
-@router.post("/generate_full", response_model=WorldGenResponse)
-async def generate_full_content(req: WorldGenRequest):
+class GeneratedWorldResponse(WorldGenResponse):
+    game_id: Optional[int] = Field(None, description="存進的遊戲 ID；有存時各 id 都是 DB 的 id")
+
+def _build_world_graph(req: WorldGenRequest) -> StageGraph:
+    """
+    generate_full 的 stage 依賴圖：
+        characters -> npcs -> { scenes, locations }
+    scenes 與 locations 只依賴角色和 NPC，彼此獨立，所以會同時執行。
+    """
     background = req.background
 
     # 生成角色
-    raw_chars = await call_llm_for_characters(
-        background=background,
-        num_characters=req.num_characters,
-        model=req.model,
-        temperature=req.temperature,
-    )
-    for i, ch in enumerate(raw_chars):
-        ch["id"] = i + 1
+    async def characters():
+        raw_chars = await call_llm_for_characters(
+            background=background,
+            num_characters=req.num_characters,
+            model=req.model,
+            temperature=req.temperature,
+            fresh=req.fresh,
+        )
+        for i, ch in enumerate(raw_chars):
+            ch["id"] = i + 1
+        return raw_chars
 
     # 生成 NPC
-    raw_npcs = await call_llm_for_npcs(
-        background=background,
-        characters=[{"name": c["name"]} for c in raw_chars],
-        num_npcs=req.num_npcs,
-        model=req.model,
-        temperature=req.temperature,
-    )
-    for i, n in enumerate(raw_npcs):
-        n["id"] = i + 1
+    async def npcs(characters):
+        raw_npcs = await call_llm_for_npcs(
+            background=background,
+            characters=[{"name": c["name"]} for c in characters],
+            num_npcs=req.num_npcs,
+            model=req.model,
+            temperature=req.temperature,
+            fresh=req.fresh,
+        )
+        for i, n in enumerate(raw_npcs):
+            n["id"] = i + 1
+        return raw_npcs
 
     # 生成每一幕劇本 + 結局
-    scenes, ending = await call_llm_for_scenes_and_ending(
-        background=background,
-        characters=[{"name": c["name"]} for c in raw_chars],
-        locations=[],  # 空列表，因為沒資料庫地點
-        npcs=[{"name": n["name"]} for n in raw_npcs],
-        num_acts=req.num_acts,
-        model=req.model,
-        temperature=req.temperature,
-    )
+    async def scenes(characters, npcs):
+        return await call_llm_for_scenes_and_ending(
+            background=background,
+            characters=[{"name": c["name"]} for c in characters],
+            locations=[],  # 空列表，因為沒資料庫地點
+            npcs=[{"name": n["name"]} for n in npcs],
+            num_acts=req.num_acts,
+            model=req.model,
+            temperature=req.temperature,
+            fresh=req.fresh,
+        )
 
     # 生成地點與物件
-    locations_data = await call_llm_for_locations(
-        background=background,
-        characters=[{"name": c["name"]} for c in raw_chars],
-        npcs=[{"id": n["id"]} for n in raw_npcs],
-        model=req.model,
-        temperature=req.temperature,
+    async def locations(characters, npcs):
+        return await call_llm_for_locations(
+            background=background,
+            characters=[{"name": c["name"]} for c in characters],
+            npcs=[{"id": n["id"]} for n in npcs],
+            model=req.model,
+            temperature=req.temperature,
+            fresh=req.fresh,
+        )
+
+    return (
+        StageGraph()
+        .add("characters", characters)
+        .add("npcs",       npcs,      deps=["characters"])
+        .add("scenes",     scenes,    deps=["characters", "npcs"])
+        .add("locations",  locations, deps=["characters", "npcs"])
     )
 
-    # 準備回傳資料
+def _build_locations(locations_data: List[dict]) -> List[LocationInfo]:
     response_locations = []
     for i, loc_dict in enumerate(locations_data):
         objects_info = [
@@ -130,11 +174,357 @@ async def generate_full_content(req: WorldGenRequest):
                 objects=objects_info,
             )
         )
+    return response_locations
+
+# 還在生成中的 Idempotency-Key -> (request hash, 結果的 future)，重複的請求等同一份結果
+_inflight: Dict[str, Tuple[str, "asyncio.Future[Dict[str, Any]]"]] = {}
+
+def _request_hash(req: WorldGenRequest) -> str:
+    return hashlib.sha256(req.model_dump_json().encode("utf-8")).hexdigest()
+
+def _idempotency_conflict() -> HTTPException:
+    return HTTPException(422, "Idempotency-Key 已經用在內容不同的請求")
+
+def _has_players_conflict(e: GameHasPlayers) -> HTTPException:
+    return HTTPException(409, str(e))
+
+async def _check_save_target(
+    req: WorldGenRequest,
+    idempotency_key: Optional[str],
+    session: AsyncSession,
+) -> Union[None, Dict[str, Any], "asyncio.Future[Dict[str, Any]]"]:
+    """
+    generate_full（含串流版）開始生成前的檢查。同一個 Idempotency-Key 已經存好結果時回傳該結果，
+    還在生成中時回傳它的 future，key 用在內容不同的請求時丟 422；
+    都沒有時回傳 None，並先擋下已經有玩家的遊戲，不要生成完才發現存不進去（save_world 寫入時還會再檢查一次）
+    """
+    if idempotency_key and req.game_id is None:
+        raise HTTPException(422, "Idempotency-Key 需要搭配 game_id")
+    if req.game_id is None:
+        return None
+    if await session.get(Game, req.game_id) is None:
+        raise HTTPException(404, "Game not found")
+
+    if idempotency_key:
+        request_hash = _request_hash(req)
+        record = await session.run_sync(lambda s: MemoryService(s).get_idempotency(idempotency_key))
+        if record is not None:
+            if record.request_hash != request_hash:
+                raise _idempotency_conflict()
+            return record.response
+        if idempotency_key in _inflight:
+            inflight_hash, future = _inflight[idempotency_key]
+            if inflight_hash != request_hash:
+                raise _idempotency_conflict()
+            return future
+
+    if await session.run_sync(lambda s: MemoryService(s).has_players(req.game_id)):
+        raise _has_players_conflict(GameHasPlayers(req.game_id))
+    return None
+
+def _start_inflight(idempotency_key: str, request_hash: str) -> "asyncio.Future[Dict[str, Any]]":
+    future = asyncio.get_running_loop().create_future()
+    # 沒有人等的時候失敗也不要跳 "exception was never retrieved"
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _inflight[idempotency_key] = (request_hash, future)
+    return future
+
+def _finish_inflight(idempotency_key: str, future: "asyncio.Future[Dict[str, Any]]", error: Optional[BaseException] = None) -> None:
+    if not future.done():
+        if isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            future.cancel()
+    if _inflight.get(idempotency_key, (None, None))[1] is future:
+        del _inflight[idempotency_key]
+
+@router.post("/generate_full", response_model=GeneratedWorldResponse)
+async def generate_full_content(
+    req: WorldGenRequest,
+    request: Request,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    生成整個世界；有給 game_id 就存進該遊戲（一個 transaction）。
+    帶 Idempotency-Key 時，同一個 key 重送（包含前一個還在生成中）會拿到同一份結果，
+    不會再付一次 LLM 的錢；回應帶 Idempotent-Replayed: true。
+    """
+    existing = await _check_save_target(req, idempotency_key, session)
+    # 生成或等別人生成都要好幾十秒：先結束讀取的 transaction、把連線還給連線池，存檔時再拿一條
+    await session.close()
+    if existing is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+        if isinstance(existing, asyncio.Future):
+            # shield：這個重複請求被取消時不能連帶取消原本的生成
+            return await asyncio.shield(existing)
+        return existing
+    if not idempotency_key:
+        return await _generate_and_save(req, request, response, session)
+
+    request_hash = _request_hash(req)
+    future = _start_inflight(idempotency_key, request_hash)
+    try:
+        result = await _generate_and_save(req, request, response, session, idempotency_key, request_hash)
+    except BaseException as e:
+        _finish_inflight(idempotency_key, future, e)
+        raise
+    future.set_result(result)
+    _finish_inflight(idempotency_key, future)
+    return result
+
+async def _generate_and_save(
+    req: WorldGenRequest,
+    request: Request,
+    response: Response,
+    session: AsyncSession,
+    idempotency_key: Optional[str] = None,
+    request_hash: Optional[str] = None,
+) -> Dict[str, Any]:
+    with llm_context(Priority.WORLD_GEN, user=client_key(request)):
+        run = await _build_world_graph(req).run()
+    for t in run.timings.values():
+        logger.info("generate_full stage %s: %.2fs", t.name, t.duration)
+    # 每個 stage 的耗時放在 Server-Timing，瀏覽器 devtools 可以直接看
+    response.headers["Server-Timing"] = run.server_timing()
+
+    world = _world_response(run.results)
+    if req.game_id is None:
+        return GeneratedWorldResponse(**world.model_dump()).model_dump()
+    return await session.run_sync(
+        lambda s: _save_generated(s, req.game_id, req.background, world, idempotency_key, request_hash)
+    )
+
+def _save_generated(
+    s: Session,
+    game_id: int,
+    background: str,
+    world: WorldGenResponse,
+    idempotency_key: Optional[str] = None,
+    request_hash: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    把生成好的世界存進遊戲（連同冪等紀錄一個 transaction），回傳換成 DB id 的結果。
+    world 裡地點與物件的 id 已由 _build_locations 依序編號，LLM 給的 id 可能重複或跳號。
+    """
+    mem = MemoryService(s)
+    try:
+        ids = mem.save_world(game_id, {"background": background, **world.model_dump()}, commit=False)
+        result = _with_db_ids(world, ids, game_id).model_dump()
+        if idempotency_key:
+            mem.add_idempotency(idempotency_key, game_id, request_hash, result)
+        s.commit()
+    except GameHasPlayers as e:
+        # 檢查之後、寫入之前有玩家加入
+        s.rollback()
+        raise _has_players_conflict(e)
+    except Exception:
+        s.rollback()
+        raise
+    return result
+
+def _with_db_ids(world: WorldGenResponse, ids: Dict[str, Dict[Any, int]], game_id: int) -> GeneratedWorldResponse:
+    """
+    把生成時的 id（1 開始）換成 save_world 寫入後的 DB id，前端之後可以直接拿來對話、查詢
+    """
+    npc_ids = ids["npcs"]
+    return GeneratedWorldResponse(
+        game_id=game_id,
+        characters=[c.model_copy(update={"id": ids["characters"][c.id]}) for c in world.characters],
+        npcs=[n.model_copy(update={"id": npc_ids[n.id]}) for n in world.npcs],
+        acts=world.acts,
+        ending=world.ending,
+        locations=[
+            loc.model_copy(update={
+                "id": ids["locations"][loc.id],
+                "npcs": [npc_ids[n] for n in loc.npcs if n in npc_ids],
+                "objects": [
+                    # 跟 save_world 一樣，不認得的 lock 存成 None（那邊已經記過 log）
+                    o.model_copy(update={"id": ids["objects"][(loc.id, o.id)], "lock": npc_ids.get(o.lock)})
+                    for o in loc.objects
+                ],
+            })
+            for loc in world.locations
+        ],
+    )
+
+def _world_response(results: Dict[str, Any]) -> WorldGenResponse:
+    raw_chars = results["characters"]
+    raw_npcs = results["npcs"]
+    scenes, ending = results["scenes"]
 
     return WorldGenResponse(
         characters=[CharacterInfo(**c) for c in raw_chars],
         npcs=[NpcInfo(**n) for n in raw_npcs],
         acts=scenes,
         ending=ending,
-        locations=response_locations,
+        locations=_build_locations(results["locations"]),
+    )
+
+def _section_events(stage: str, result: Any) -> Iterator[Tuple[str, Any]]:
+    """
+    把 stage 結果轉成串流事件，payload 沿用 WorldGenResponse 的子模型
+    """
+    if stage == "characters":
+        yield "characters", [CharacterInfo(**c).model_dump() for c in result]
+    elif stage == "npcs":
+        yield "npcs", [NpcInfo(**n).model_dump() for n in result]
+    elif stage == "scenes":
+        acts, ending = result
+        yield "acts", [ActInfo(**a).model_dump() for a in acts]
+        yield "ending", ending
+    elif stage == "locations":
+        yield "locations", [loc.model_dump() for loc in _build_locations(result)]
+
+def _replay_events(result: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+    """
+    重播同一個 Idempotency-Key 存好的結果：各區塊（id 已經是 DB 的 id）、saved、done
+    """
+    for key in ("characters", "npcs", "locations", "acts", "ending"):
+        yield key, result[key]
+    yield "saved", result
+    yield "done", {"timings": {}}
+
+async def _tracked(
+    idempotency_key: str, request_hash: str, events: AsyncIterator[Tuple[str, Any]]
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    串流生成期間把 key 登記在 _inflight，同一個 key 的重複請求等 saved 事件的那份結果。
+    在 generator 裡才登記：client 在開始串流前就斷線時 generator 不會被執行，登記了就清不掉
+    """
+    if idempotency_key in _inflight:
+        # 檢查之後、開始串流之前，同一個 key 的另一個請求先開始了
+        inflight_hash, future = _inflight[idempotency_key]
+        if inflight_hash != request_hash:
+            raise _idempotency_conflict()
+        for event in _replay_events(await asyncio.shield(future)):
+            yield event
+        return
+
+    future = _start_inflight(idempotency_key, request_hash)
+    try:
+        async for event, data in events:
+            if event == "saved":
+                future.set_result(data)
+            yield event, data
+    except BaseException as e:
+        # 包含 client 斷線時的 GeneratorExit：等這份結果的請求跟著失敗，之後可以重送
+        _finish_inflight(idempotency_key, future, e)
+        raise
+    _finish_inflight(idempotency_key, future)
+
+@router.post("/generate_full/stream")
+async def generate_full_content_stream(
+    req: WorldGenRequest,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    generate_full 的串流版：每個區塊一生成完就送出一個事件，
+    前端可以先顯示角色，幕與地點還在生成也沒關係。
+
+    預設回傳 NDJSON（每行一個 {"event": ..., "data": ...}），
+    Accept: text/event-stream 時改用 SSE 格式。
+    事件依序可能為 characters, npcs, acts, ending, locations，最後是 done（含各 stage 耗時）或 error。
+    有給 game_id 時跟 generate_full 一樣存進該遊戲，done 之前多一個 saved 事件
+    （整個世界，id 都換成 DB 的 id）；Idempotency-Key 的規則也相同，重送時重播同一份結果。
+    """
+    use_sse = "text/event-stream" in request.headers.get("accept", "")
+    # 串流開始後就不能改 status code，404 / 409 / 422 / 429 都要在這裡先回
+    existing = await _check_save_target(req, idempotency_key, session)
+    await session.close()
+    if existing is None:
+        llm_scheduler.check_admission(Priority.WORLD_GEN)
+    user = client_key(request)
+    request_hash = _request_hash(req)
+
+    def encode(event: str, data: Any) -> str:
+        if use_sse:
+            return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+
+    async def generate() -> AsyncIterator[Tuple[str, Any]]:
+        timings = {}
+        results = {}
+        with llm_context(Priority.WORLD_GEN, user=user):
+            async for stage, result, timing in _build_world_graph(req).iter_completed():
+                results[stage] = result
+                timings[stage] = round(timing.duration, 3)
+                logger.info("generate_full stage %s: %.2fs", stage, timing.duration)
+                for event, data in _section_events(stage, result):
+                    yield event, data
+        if req.game_id is not None:
+            world = _world_response(results)
+            async with AsyncSession(async_engine, expire_on_commit=False) as write_session:
+                saved = await write_session.run_sync(
+                    lambda s: _save_generated(s, req.game_id, req.background, world, idempotency_key, request_hash)
+                )
+            yield "saved", saved
+        yield "done", {"timings": timings}
+
+    async def events():
+        try:
+            if existing is None:
+                source = _tracked(idempotency_key, request_hash, generate()) if idempotency_key else generate()
+                async for event, data in source:
+                    yield encode(event, data)
+            else:
+                result = await asyncio.shield(existing) if isinstance(existing, asyncio.Future) else existing
+                for event, data in _replay_events(result):
+                    yield encode(event, data)
+        except Exception as e:
+            logger.exception("generate_full stream failed")
+            yield encode("error", {"detail": f"生成失敗: {str(e)}"})
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if existing is not None:
+        headers["Idempotent-Replayed"] = "true"
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream" if use_sse else "application/x-ndjson",
+        headers=headers,
     )
+
+class PoolClaimRequest(BaseModel):
+    theme:   str = Field(..., description="主題（需為 WORLD_POOL_THEMES 之一）")
+    game_id: Optional[int] = Field(None, description="有給的話拿到的世界會存進這場遊戲")
+
+class PooledWorldResponse(GeneratedWorldResponse):
+    background: str
+
+async def generate_pooled_world(theme: str) -> dict:
+    """
+    world pool 的補貨函式：背景 + generate_full 整套。
+    一律 fresh，不然回應快取會讓同主題的每個世界都一模一樣。
+    用最低的優先級，不跟玩家搶 LLM 名額。
+    """
+    with llm_context(Priority.PREGEN, user="world-pool"):
+        background = await call_llm_for_background(theme, fresh=True)
+        run = await _build_world_graph(WorldGenRequest(background=background, fresh=True)).run()
+    return {"background": background, **_world_response(run.results).model_dump()}
+
+@router.post("/pool/claim", response_model=PooledWorldResponse)
+async def claim_pooled_world(req: PoolClaimRequest, session: AsyncSession = Depends(get_async_session)):
+    """
+    直接拿一個預先生成好的世界；pool 裡沒有時回 404，前端改走 generate_full。
+    有給 game_id 時跟 generate_full 一樣存進該遊戲，回傳的 id 都是 DB 的 id；
+    沒給時只是預覽，id 是生成時的編號，不能拿來對話、解鎖或查 /state。
+    """
+    if req.game_id is not None:
+        # 先檢查再拿，存不進去的話世界不會白白從 pool 裡消失
+        if await session.get(Game, req.game_id) is None:
+            raise HTTPException(404, "Game not found")
+        if await session.run_sync(lambda s: MemoryService(s).has_players(req.game_id)):
+            raise _has_players_conflict(GameHasPlayers(req.game_id))
+    world = world_pool.claim(req.theme)
+    if world is None:
+        raise HTTPException(404, "No pre-generated world for this theme")
+    if req.game_id is None:
+        return world
+
+    background = world["background"]
+    generated = WorldGenResponse(**world)
+    saved = await session.run_sync(lambda s: _save_generated(s, req.game_id, background, generated))
+    return {"background": background, **saved}
@@ -0,0 +1,232 @@
+import os
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+# LRU 最多保留幾組 (game, npc, player) 的 system instruction
+CHAT_CONTEXT_CACHE_SIZE = int(os.getenv("CHAT_CONTEXT_CACHE_SIZE", "512"))
+# 是否把 system instruction 註冊成 Gemini 端的 cached content（需要模型與帳號支援）
+LLM_PROVIDER_CACHE = os.getenv("LLM_PROVIDER_CACHE", "0") == "1"
+# Gemini 的 context cache 有最小 token 數限制，太短的 instruction 不值得也無法快取
+LLM_PROVIDER_CACHE_MIN_TOKENS = int(os.getenv("LLM_PROVIDER_CACHE_MIN_TOKENS", "1024"))
+LLM_PROVIDER_CACHE_TTL = int(os.getenv("LLM_PROVIDER_CACHE_TTL", "3600"))   # 秒
+
+ContextKey = Tuple[int, int, int]   # (game_id, npc_id, player_id)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗估 token 數：中日韓文字（含全形標點）大約一字一個 token，其餘大約四個字元一個 token
+    """
+    cjk = sum(
+        1 for ch in text
+        if "\u2e80" <= ch <= "\u9fff" or "\uf900" <= ch <= "\ufaff" or "\uff00" <= ch <= "\uffef"
+    )
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+@dataclass
+class ChatContext:
+    key: ContextKey
+    system_instruction: str
+    config: types.GenerateContentConfig      # 含 system_instruction 的完整設定
+    instruction_tokens: int
+    cached_content: Dict[str, str] = field(default_factory=dict)   # model -> Gemini cached content 名稱
+
+    def config_for(
+        self,
+        model: str,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> types.GenerateContentConfig:
+        """
+        回傳這次呼叫要用的 config；有 provider 端快取時改用 cached_content，
+        不再重送 system instruction。
+        """
+        update: Dict[str, Any] = {}
+        if temperature is not None and temperature != self.config.temperature:
+            update["temperature"] = temperature
+        if max_tokens is not None and max_tokens != self.config.max_output_tokens:
+            update["max_output_tokens"] = max_tokens
+        name = self.cached_content.get(model)
+        if name:
+            update["cached_content"] = name
+            update["system_instruction"] = None
+        return self.config.model_copy(update=update) if update else self.config
+
+
+class ChatContextCache:
+    """
+    NPC 對話的 system instruction / GenerateContentConfig 快取。
+    同一組 (game, npc, player) 的設定在整場遊戲中不會變，只建一次，放在 LRU 裡；
+    開啟 LLM_PROVIDER_CACHE 時會再註冊成 Gemini 端的 cached content，
+    之後每回合只送 cache 名稱。也順便統計每回合省下的 input token。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CHAT_CONTEXT_CACHE_SIZE,
+        provider_cache: bool = LLM_PROVIDER_CACHE,
+        provider_min_tokens: int = LLM_PROVIDER_CACHE_MIN_TOKENS,
+        provider_ttl: int = LLM_PROVIDER_CACHE_TTL,
+    ):
+        self.max_entries = max_entries
+        self.provider_cache = provider_cache
+        self.provider_min_tokens = provider_min_tokens
+        self.provider_ttl = provider_ttl
+        self._entries: "OrderedDict[ContextKey, ChatContext]" = OrderedDict()
+        self._creating: set = set()
+        self._lock = threading.Lock()
+        self._backend = None
+        self.stats_counters: Dict[str, int] = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "provider_caches": 0,
+            "provider_failures": 0,
+            "turns": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "instruction_tokens_reused": 0,
+        }
+
+    def get_or_build(
+        self,
+        key: ContextKey,
+        build: Callable[[], Tuple[str, types.GenerateContentConfig]],
+    ) -> ChatContext:
+        with self._lock:
+            ctx = self._entries.get(key)
+            if ctx is not None:
+                self._entries.move_to_end(key)
+                self.stats_counters["hits"] += 1
+                self.stats_counters["instruction_tokens_reused"] += ctx.instruction_tokens
+                return ctx
+            self.stats_counters["misses"] += 1
+
+        instruction, config = build()
+        ctx = ChatContext(
+            key=key,
+            system_instruction=instruction,
+            config=config,
+            instruction_tokens=estimate_tokens(instruction),
+        )
+        evicted = []
+        with self._lock:
+            ctx = self._entries.setdefault(key, ctx)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                _, old = self._entries.popitem(last=False)
+                evicted.append(old)
+                self.stats_counters["evictions"] += 1
+        for old in evicted:
+            self._release(old)
+        return ctx
+
+    async def ensure_provider_cache(self, ctx: ChatContext, model: str, backend) -> None:
+        """
+        需要時把 system instruction 註冊成 provider 端的 cached content。
+        後端不支援（supports_provider_cache 為 False）或建立失敗（模型不支援、token 太少等）
+        就維持一般呼叫，不影響對話。
+        """
+        if not self.provider_cache or not backend.supports_provider_cache or model in ctx.cached_content:
+            return
+        if ctx.instruction_tokens < self.provider_min_tokens:
+            return
+        marker = (ctx.key, model)
+        if marker in self._creating:
+            return   # 別的請求正在建立，這回合先走一般呼叫
+        self._creating.add(marker)
+        try:
+            name = await backend.create_cache(
+                model=model,
+                system_instruction=ctx.system_instruction,
+                ttl_seconds=self.provider_ttl,
+            )
+            ctx.cached_content[model] = name
+            self._backend = backend
+            self.stats_counters["provider_caches"] += 1
+        except Exception as e:
+            # 記下來，之後同一組不再重試
+            ctx.cached_content[model] = ""
+            self.stats_counters["provider_failures"] += 1
+            logger.warning("建立 provider context cache 失敗，改用一般呼叫: %s", e)
+        finally:
+            self._creating.discard(marker)
+
+    def record_usage(self, usage: Any) -> None:
+        """
+        記錄一次回應的 usage_metadata
+        """
+        if usage is None:
+            return
+        with self._lock:
+            self.stats_counters["turns"] += 1
+            self.stats_counters["prompt_tokens"] += usage.prompt_token_count or 0
+            self.stats_counters["cached_tokens"] += usage.cached_content_token_count or 0
+
+    def invalidate_game(self, game_id: int) -> None:
+        with self._lock:
+            keys = [k for k in self._entries if k[0] == game_id]
+            removed = [self._entries.pop(k) for k in keys]
+        for ctx in removed:
+            self._release(ctx)
+
+    def invalidate_player(self, game_id: int, player_id: int) -> None:
+        """
+        玩家認領或更換角色時呼叫：instruction 裡的玩家角色資訊已經不對了
+        """
+        with self._lock:
+            keys = [k for k in self._entries if k[0] == game_id and k[2] == player_id]
+            removed = [self._entries.pop(k) for k in keys]
+        for ctx in removed:
+            self._release(ctx)
+
+    def clear(self) -> None:
+        with self._lock:
+            removed = list(self._entries.values())
+            self._entries.clear()
+        for ctx in removed:
+            self._release(ctx)
+
+    def _release(self, ctx: ChatContext) -> None:
+        """
+        被淘汰的 context 若有 provider 端快取，背景刪掉（不刪也會在 TTL 後過期）
+        """
+        names = [n for n in ctx.cached_content.values() if n]
+        if not names or self._backend is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        for name in names:
+            loop.create_task(self._delete_quietly(name))
+
+    async def _delete_quietly(self, name: str) -> None:
+        try:
+            await self._backend.delete_cache(name)
+        except Exception as e:
+            logger.debug("刪除 provider context cache %s 失敗: %s", name, e)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self.stats_counters)
+            s["entries"] = len(self._entries)
+        turns = s["turns"] or 1
+        lookups = (s["hits"] + s["misses"]) or 1
+        s["hit_ratio"] = round(s["hits"] / lookups, 3)
+        s["avg_prompt_tokens_per_turn"] = round(s["prompt_tokens"] / turns, 1)
+        # provider 端快取命中的 token 不用重新計費，就是每回合省下的 input token
+        s["avg_saved_tokens_per_turn"] = round(s["cached_tokens"] / turns, 1)
+        return s
+
+
+chat_context_cache = ChatContextCache()
@@ -0,0 +1,98 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+# 每段對話（玩家 x NPC）在記憶體裡保留的訊息數，與送進 LLM 的歷史長度相同
+CHAT_HISTORY_MESSAGES = int(os.getenv("CHAT_HISTORY_MESSAGES", "20"))
+# 最多快取幾段對話，超過時把最久沒用到的丟掉（下次再從 DB 載入）
+CHAT_HISTORY_CACHE_SIZE = int(os.getenv("CHAT_HISTORY_CACHE_SIZE", "1000"))
+
+Key = Tuple[int, int]   # (player_id, npc_id)
+
+
+class ConversationStore:
+    """
+    NPC 對話歷史的 server 端記憶：每位玩家、每個 NPC 一個 ring buffer，擋在 Message 表前面。
+    - 讀：buffer 有就直接用，沒有才從 Message 表載入最後 N 則
+    - 寫：write-through，先寫 DB 再放進 buffer
+    前端每回合只需要送 id 與新的一句話，request 大小不會隨對話變長。
+    每段對話的滾動摘要（ConversationSummary）也快取在這裡。
+    """
+
+    def __init__(self, max_messages: int = CHAT_HISTORY_MESSAGES, max_conversations: int = CHAT_HISTORY_CACHE_SIZE):
+        self.max_messages = max_messages
+        self.max_conversations = max_conversations
+        self._buffers: "OrderedDict[Key, Deque[Dict[str, Any]]]" = OrderedDict()
+        self._summaries: Dict[Key, Optional[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def _buffer(self, mem, player_id: int, npc_id: int) -> Deque[Dict[str, Any]]:
+        key = (player_id, npc_id)
+        with self._lock:
+            buf = self._buffers.get(key)
+            if buf is not None:
+                self._buffers.move_to_end(key)
+                return buf
+
+        messages = mem.get_conversation_context(player_id, limit=self.max_messages, npc_id=npc_id)
+        loaded = deque(
+            ({"id": m.id, "role": m.role, "content": m.content} for m in messages),
+            maxlen=self.max_messages,
+        )
+        with self._lock:
+            # 載入期間別人可能已經放好了，以先放好的為準
+            buf = self._buffers.setdefault(key, loaded)
+            self._buffers.move_to_end(key)
+            while len(self._buffers) > self.max_conversations:
+                old_key, _ = self._buffers.popitem(last=False)
+                self._summaries.pop(old_key, None)
+        return buf
+
+    def history(self, mem, player_id: int, npc_id: int) -> List[Dict[str, Any]]:
+        buf = self._buffer(mem, player_id, npc_id)
+        with self._lock:
+            return list(buf)
+
+    def append(self, mem, player_id: int, npc_id: int, role: str, content: str) -> None:
+        buf = self._buffer(mem, player_id, npc_id)
+        msg = mem.append_message(player_id, role, content, npc_id=npc_id)
+        with self._lock:
+            buf.append({"id": msg.id, "role": role, "content": content})
+
+    def summary(self, mem, player_id: int, npc_id: int) -> Optional[Dict[str, Any]]:
+        """
+        這段對話目前的滾動摘要 {"content", "covered_until"}，沒有則為 None
+        """
+        key = (player_id, npc_id)
+        with self._lock:
+            if key in self._summaries:
+                return self._summaries[key]
+        row = mem.get_summary(player_id, npc_id)
+        value = {"content": row.content, "covered_until": row.covered_until} if row else None
+        with self._lock:
+            return self._summaries.setdefault(key, value)
+
+    def set_summary(self, mem, player_id: int, npc_id: int, content: str, covered_until: int) -> None:
+        mem.save_summary(player_id, npc_id, content, covered_until)
+        with self._lock:
+            self._summaries[(player_id, npc_id)] = {"content": content, "covered_until": covered_until}
+
+    def forget_players(self, player_ids: Iterable[int]) -> None:
+        """
+        玩家被刪除時一併丟掉他們的 buffer（id 之後可能被重複使用）
+        """
+        ids = set(player_ids)
+        with self._lock:
+            for key in [k for k in self._buffers if k[0] in ids]:
+                del self._buffers[key]
+            for key in [k for k in self._summaries if k[0] in ids]:
+                del self._summaries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buffers.clear()
+            self._summaries.clear()
+
+
+conversation_store = ConversationStore()
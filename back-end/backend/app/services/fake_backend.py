@@ -0,0 +1,244 @@
+import os
+import re
+import json
+import random
+import asyncio
+import itertools
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from google.genai import errors as genai_errors
+from google.genai import types
+
+from .context_cache import estimate_tokens
+from .llm_backend import LLM_MAX_CONCURRENCY, LLM_TIMEOUT, LlmBackend
+
+# 延遲是 lognormal：中位數 LLM_FAKE_LATENCY_MS，分散程度 LLM_FAKE_LATENCY_SIGMA（0 = 固定延遲），
+# 再加上每個輸出 token LLM_FAKE_MS_PER_TOKEN
+LLM_FAKE_LATENCY_MS    = float(os.getenv("LLM_FAKE_LATENCY_MS", "50"))
+LLM_FAKE_LATENCY_SIGMA = float(os.getenv("LLM_FAKE_LATENCY_SIGMA", "0.5"))
+LLM_FAKE_MS_PER_TOKEN  = float(os.getenv("LLM_FAKE_MS_PER_TOKEN", "0"))
+LLM_FAKE_ERROR_RATE    = float(os.getenv("LLM_FAKE_ERROR_RATE", "0"))     # 回 503 的機率（會觸發重試）
+LLM_FAKE_SEED          = os.getenv("LLM_FAKE_SEED")
+
+
+def _text_of(contents: Any) -> str:
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, types.Content):
+        return "".join(p.text or "" for p in contents.parts or [])
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(_text_of(c) for c in contents)
+    return str(contents or "")
+
+
+def _schema_dict(schema: Any) -> Dict[str, Any]:
+    """
+    response_schema 可能是 dict 或 types.Schema，統一成小寫 type 的 dict
+    """
+    if isinstance(schema, types.Schema):
+        schema = schema.model_dump(exclude_none=True, mode="json")
+    if not isinstance(schema, dict):
+        return {}
+    out = dict(schema)
+    if "type" in out:
+        out["type"] = str(out["type"]).lower()
+    if "properties" in out:
+        out["properties"] = {k: _schema_dict(v) for k, v in out["properties"].items()}
+    if "items" in out:
+        out["items"] = _schema_dict(out["items"])
+    return out
+
+
+def _number(pattern: str, text: str, default: int) -> int:
+    m = re.search(pattern, text)
+    return int(m.group(1)) if m else default
+
+
+def _json_list(pattern: str, text: str) -> List[Any]:
+    m = re.search(pattern, text)
+    if not m:
+        return []
+    try:
+        return json.loads(m.group(1))
+    except json.JSONDecodeError:
+        return []
+
+
+class FakeBackend(LlmBackend):
+    """
+    不連網的假 Gemini：依 response_schema（與 prompt 裡的數量、名單）回傳合法的結果，
+    每個 call_llm_for_* 都拿得到能通過後續解析的內容。
+    延遲分布與錯誤率可調，拿來跑壓測（benchmarks/loadtest.py）與離線測試。
+    """
+
+    supports_provider_cache = True
+
+    def __init__(
+        self,
+        latency_ms: float = LLM_FAKE_LATENCY_MS,
+        latency_sigma: float = LLM_FAKE_LATENCY_SIGMA,
+        ms_per_token: float = LLM_FAKE_MS_PER_TOKEN,
+        error_rate: float = LLM_FAKE_ERROR_RATE,
+        seed: Optional[int] = int(LLM_FAKE_SEED) if LLM_FAKE_SEED else None,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeout: float = LLM_TIMEOUT,
+    ):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.ms_per_token = ms_per_token
+        self.error_rate = error_rate
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._random = random.Random(seed)
+        self._cache_ids = itertools.count(1)
+        self.calls = 0
+
+    # ---- 延遲與錯誤 ----
+
+    def _latency(self, output_tokens: int) -> float:
+        base = self.latency_ms / 1000
+        if self.latency_sigma > 0:
+            base *= self._random.lognormvariate(0, self.latency_sigma)
+        return base + output_tokens * self.ms_per_token / 1000
+
+    def _maybe_fail(self) -> None:
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise genai_errors.ServerError(503, {"error": {"code": 503, "message": "fake overloaded", "status": "UNAVAILABLE"}})
+
+    # ---- 內容 ----
+
+    def _respond(self, contents: Any, config: Optional[types.GenerateContentConfig]) -> str:
+        prompt = _text_of(contents)
+        if config is not None and config.system_instruction:
+            prompt = _text_of(config.system_instruction) + "\n" + prompt
+        schema = _schema_dict(config.response_schema) if config is not None else {}
+        if not schema:
+            if "摘要" in prompt:
+                return "玩家詢問了案發當晚的行蹤，NPC 透露曾在書房外聽見爭吵。"
+            return "雨夜的山中莊園，主人在書房離奇身亡，每位賓客都藏著不能說的秘密。"
+
+        props = schema.get("properties") or {}
+        item_props = (schema.get("items") or {}).get("properties") or {}
+        if "dialogue" in props:
+            return json.dumps({"dialogue": "那晚我一直待在廚房，什麼都沒聽見。", "hint": "留意廚房的後門", "evidence": None},
+                              ensure_ascii=False)
+        if "public_info" in item_props:
+            n = _number(r"請生成 (\d+) 位角色", prompt, 4)
+            return json.dumps([
+                {"name": f"角色{i + 1}", "role": "嫌疑人", "public_info": f"你是第 {i + 1} 位賓客，個性謹慎。",
+                 "secret": "案發當晚曾進過書房", "mission": "隱瞞自己的行蹤"}
+                for i in range(n)
+            ], ensure_ascii=False)
+        if "description" in item_props:
+            n = _number(r"請生成 (\d+) 位 NPC", prompt, 3)
+            return json.dumps([{"name": f"路人{i + 1}", "description": "在莊園工作多年"} for i in range(n)],
+                              ensure_ascii=False)
+        if "truth" in props:
+            n = _number(r"規劃 (\d+) 幕", prompt, 2)
+            return json.dumps({
+                "truth": "管家為了遺產在紅酒裡下毒",
+                "acts": [{"act_number": i + 1, "summary": f"第 {i + 1} 幕揭露新的線索"} for i in range(n)],
+                "ending": "真相大白，管家認罪",
+            }, ensure_ascii=False)
+        if "scripts" in props:
+            act = _number(r"只寫第 (\d+) 幕", prompt, 1)
+            character = (props["scripts"].get("items") or {}).get("properties", {}).get("character", {})
+            names = character.get("enum") or ["角色1"]
+            return json.dumps({
+                "act_number": act,
+                "scripts": [{"character": name, "dialogue": f"第 {act} 幕，{name}想起那晚的爭吵……"} for name in names],
+            }, ensure_ascii=False)
+        if "ending" in props:
+            return json.dumps({"ending": "管家在紅酒裡下毒，最後在眾人面前認罪。"}, ensure_ascii=False)
+        if "objects" in item_props:
+            return json.dumps(self._locations(prompt), ensure_ascii=False)
+        return json.dumps(self._fill(schema), ensure_ascii=False)
+
+    def _locations(self, prompt: str) -> List[Dict[str, Any]]:
+        # 補生成時只安排還沒放好的 NPC，id 從指定的數字開始
+        start = _number(r"id 從 (\d+) 開始", prompt, 1)
+        npcs = _json_list(r"必須安排這些 NPC：(\[.*?\])", prompt) or _json_list(r"NPC 列表：(\[.*?\])", prompt)
+        npc_ids = [n["id"] for n in npcs if isinstance(n, dict) and isinstance(n.get("id"), int)]
+        count = max(3 - (start - 1), 1)
+        locations = []
+        for i in range(count):
+            here = npc_ids[i::count]
+            # 物件由這個地點的 NPC 解鎖（沒有 NPC 就用第一個）
+            lock = here[0] if here else (npc_ids[0] if npc_ids else 1)
+            locations.append({
+                "id": start + i,
+                "name": f"地點{start + i}",
+                "npcs": here,
+                "objects": [{"id": 1, "name": f"物件{start + i}", "lock": lock, "clue": "一張撕掉一半的信", "owner_id": None}],
+            })
+        return locations
+
+    def _fill(self, schema: Dict[str, Any]) -> Any:
+        # 不認得的 schema：照型別填最小的合法值
+        kind = schema.get("type")
+        if schema.get("enum"):
+            return schema["enum"][0]
+        if kind == "object":
+            return {k: self._fill(v) for k, v in (schema.get("properties") or {}).items()}
+        if kind == "array":
+            return [self._fill(schema.get("items") or {})]
+        if kind == "integer":
+            return 1
+        if kind == "number":
+            return 1.0
+        if kind == "boolean":
+            return False
+        return "假資料"
+
+    def _response(self, text: str, prompt_tokens: int, output_tokens: Optional[int]) -> types.GenerateContentResponse:
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+            ),
+        )
+
+    # ---- LlmBackend ----
+
+    async def generate(
+        self,
+        model: str,
+        contents: Any,
+        config: Optional[types.GenerateContentConfig] = None,
+        timeout: Optional[float] = None,
+    ) -> types.GenerateContentResponse:
+        async with self._semaphore:
+            self.calls += 1
+            text = self._respond(contents, config)
+            output_tokens = estimate_tokens(text)
+            await asyncio.wait_for(asyncio.sleep(self._latency(output_tokens)), timeout=timeout or self.timeout)
+            self._maybe_fail()
+            return self._response(text, estimate_tokens(_text_of(contents)), output_tokens)
+
+    async def generate_stream(
+        self,
+        model: str,
+        contents: Any,
+        config: Optional[types.GenerateContentConfig] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[types.GenerateContentResponse]:
+        """
+        第一段等一個完整的延遲（time to first token），之後每段依 token 數等 ms_per_token
+        """
+        async with self._semaphore:
+            self.calls += 1
+            text = self._respond(contents, config)
+            await asyncio.wait_for(asyncio.sleep(self._latency(0)), timeout=timeout or self.timeout)
+            self._maybe_fail()
+            chunks = [text[i:i + 16] for i in range(0, len(text), 16)]
+            for i, chunk in enumerate(chunks):
+                await asyncio.sleep(estimate_tokens(chunk) * self.ms_per_token / 1000)
+                last = i == len(chunks) - 1
+                yield self._response(
+                    chunk, estimate_tokens(_text_of(contents)), estimate_tokens(text) if last else None
+                )
+
+    async def create_cache(self, model: str, system_instruction: str, ttl_seconds: int) -> str:
+        return f"cachedContents/fake-{next(self._cache_ids)}"
@@ -0,0 +1,151 @@
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional, Set
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# 每條連線最多積多少則還沒送出的訊息；超過代表 client 跟不上，直接斷線讓它重連後改拿 /state
+ROOM_SEND_QUEUE = int(os.getenv("ROOM_SEND_QUEUE", "256"))
+
+
+class RoomConnection:
+    """
+    房間裡的一條 WebSocket 連線。送出走自己的 queue + sender task，
+    廣播時只是 put_nowait，慢的 client 不會拖住其他人。
+    queue 滿了（不論是廣播還是只回給自己的 chat_delta 等）就交給 on_overflow 處理。
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        game_id: int,
+        player_id: Optional[int] = None,
+        on_overflow: Optional[Callable[["RoomConnection"], None]] = None,
+    ):
+        self.websocket = websocket
+        self.game_id = game_id
+        self.player_id = player_id
+        self.on_overflow = on_overflow
+        self.closed = False
+        self._queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(maxsize=ROOM_SEND_QUEUE)
+        self._sender: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._sender = asyncio.get_running_loop().create_task(self._send_loop())
+
+    def send_text(self, text: str) -> bool:
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            if self.on_overflow is not None:
+                self.on_overflow(self)
+            return False
+
+    def send(self, type: str, data: Dict[str, Any], request_id: Optional[str] = None) -> bool:
+        return self.send_text(encode(type, data, request_id))
+
+    async def _send_loop(self) -> None:
+        try:
+            while True:
+                text = await self._queue.get()
+                if text is None:
+                    break
+                await self.websocket.send_text(text)
+        except Exception:
+            # client 已經斷了；接收端會收到 disconnect 再清掉這條連線
+            self.closed = True
+
+    async def close(self, code: int = 1000) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self._sender is not None:
+            self._sender.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+def encode(type: str, data: Dict[str, Any], request_id: Optional[str] = None) -> str:
+    message: Dict[str, Any] = {"type": type, "data": data}
+    if request_id is not None:
+        message["request_id"] = request_id
+    return json.dumps(message, ensure_ascii=False)
+
+
+class GameRoomHub:
+    """
+    每場遊戲一個房間：玩家加入、物件解鎖等遊戲事件由 server 廣播給房間裡所有連線，
+    前端不用再輪詢 /state。事件只序列化一次再送給每條連線。
+    只在單一 process 內有效（跟 game_versions 一樣）。
+    """
+
+    def __init__(self):
+        self._rooms: Dict[int, Set[RoomConnection]] = {}
+        self.stats_counters = {"connected": 0, "published": 0, "delivered": 0, "dropped_slow": 0}
+
+    async def connect(self, websocket: WebSocket, game_id: int, player_id: Optional[int] = None) -> RoomConnection:
+        await websocket.accept()
+        conn = RoomConnection(websocket, game_id, player_id, on_overflow=self._drop_slow)
+        conn.start()
+        self._rooms.setdefault(game_id, set()).add(conn)
+        self.stats_counters["connected"] += 1
+        return conn
+
+    async def disconnect(self, conn: RoomConnection) -> None:
+        room = self._rooms.get(conn.game_id)
+        if room is not None:
+            room.discard(conn)
+            if not room:
+                del self._rooms[conn.game_id]
+        await conn.close()
+
+    def publish(self, game_id: int, type: str, data: Dict[str, Any], exclude: Optional[RoomConnection] = None) -> int:
+        """
+        廣播給房間裡所有連線（exclude 除外），回傳送進幾條連線的 queue
+        """
+        room = self._rooms.get(game_id)
+        self.stats_counters["published"] += 1
+        if not room:
+            return 0
+        text = encode(type, data)
+        delivered = 0
+        for conn in list(room):
+            if conn is exclude:
+                continue
+            if conn.send_text(text):
+                delivered += 1
+        self.stats_counters["delivered"] += delivered
+        return delivered
+
+    def _drop_slow(self, conn: RoomConnection) -> None:
+        """
+        連線的 queue 滿了：斷掉這條，別讓它無限積壓，也不要默默少送訊息
+        """
+        room = self._rooms.get(conn.game_id)
+        if conn.closed or room is None or conn not in room:
+            return   # 已經在斷線中
+        self.stats_counters["dropped_slow"] += 1
+        logger.warning("房間 %s 的連線跟不上，斷線 (player=%s)", conn.game_id, conn.player_id)
+        room.discard(conn)
+        asyncio.get_running_loop().create_task(conn.close(code=1013))
+
+    def players_online(self, game_id: int) -> list:
+        return sorted({c.player_id for c in self._rooms.get(game_id, ()) if c.player_id is not None})
+
+    def stats(self) -> Dict[str, Any]:
+        s: Dict[str, Any] = dict(self.stats_counters)
+        s["rooms"] = len(self._rooms)
+        s["connections"] = sum(len(r) for r in self._rooms.values())
+        return s
+
+
+game_rooms = GameRoomHub()
@@ -0,0 +1,54 @@
+import uuid
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class GameVersions:
+    """
+    每場遊戲一個遞增的版本號，遊戲狀態（背景、角色、NPC、地點、玩家）有變動就 +1，
+    拿來當 ETag：版本沒變就回 304，連 DB 都不用查。
+
+    MemoryService 改資料時呼叫 touch(session, game_id)，等 transaction commit 之後才 +1
+    （rollback 就不算）。讀取端要先拿版本再查 DB，這樣最壞只是多回一次 200，
+    不會把舊資料標成新版本。
+
+    版本只存在記憶體，重啟後 epoch 會變，舊的 ETag 自然失效（只適用單一 process）。
+    """
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._versions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, game_id: int) -> int:
+        return self._versions.get(game_id, 0)
+
+    def bump(self, game_id: int) -> int:
+        with self._lock:
+            self._versions[game_id] = self._versions.get(game_id, 0) + 1
+            return self._versions[game_id]
+
+    def etag(self, game_id: int, version: int, viewer: Optional[int] = None) -> str:
+        if viewer is not None:
+            return f'W/"{self.epoch}-{game_id}-{version}-p{viewer}"'
+        return f'W/"{self.epoch}-{game_id}-{version}"'
+
+    def touch(self, session: Session, game_id: int) -> None:
+        session.info.setdefault("touched_games", set()).add(game_id)
+
+
+game_versions = GameVersions()
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_after_commit(session: Session) -> None:
+    for game_id in session.info.pop("touched_games", ()):
+        game_versions.bump(game_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session: Session) -> None:
+    session.info.pop("touched_games", None)
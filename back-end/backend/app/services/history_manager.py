@@ -0,0 +1,147 @@
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlmodel import Session
+
+from ..database import engine
+from .context_cache import estimate_tokens
+from .conversation_store import ConversationStore, conversation_store
+from .memory_services import MemoryService
+from .llm_service import call_llm_for_summary
+from .llm_scheduler import Priority, llm_context
+
+logger = logging.getLogger(__name__)
+
+# 每回合送進 LLM 的歷史（含摘要）最多幾個 token，超過就把較早的對話折疊成摘要
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1200"))
+# 摘要時保留最近幾則訊息原文不折疊
+CHAT_HISTORY_KEEP_RECENT = int(os.getenv("CHAT_HISTORY_KEEP_RECENT", "6"))
+
+Summarizer = Callable[..., Awaitable[str]]
+# 摘要用自己的 role（summary），內容也標明不是玩家說的話，送進 LLM 時才不會被當成玩家發言
+SUMMARY_PREFIX = "【系統備註：以下是你與這位玩家先前對話的摘要，不是玩家這回合說的話】\n"
+
+
+def history_tokens(history: List[Dict[str, Any]]) -> int:
+    return sum(estimate_tokens(m.get("content", "")) for m in history)
+
+
+class HistoryManager:
+    """
+    控制每回合送進 LLM 的對話歷史長度：
+    摘要 + 摘要之後的訊息超過 token 預算時，在背景把較早的對話折疊進滾動摘要
+    （存在 ConversationSummary，和 Message 放在一起），每回合的 prompt 大小因此大致固定。
+    摘要還沒完成前，先丟掉最舊的訊息讓這回合維持在預算內。
+    """
+
+    def __init__(
+        self,
+        store: ConversationStore = conversation_store,
+        summarize: Summarizer = call_llm_for_summary,
+        token_budget: int = CHAT_HISTORY_TOKEN_BUDGET,
+        keep_recent: int = CHAT_HISTORY_KEEP_RECENT,
+        session_factory: Callable[[], Session] = lambda: Session(engine),
+    ):
+        self.store = store
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.session_factory = session_factory
+        self._running: Set[Tuple[int, int]] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def prepare(
+        self,
+        mem: MemoryService,
+        player_id: int,
+        npc_id: int,
+        npc_name: str = "NPC",
+    ) -> List[Dict[str, Any]]:
+        """
+        回傳這回合要送進 LLM 的歷史：[摘要] + 摘要之後的訊息，必要時排程背景摘要
+        """
+        history = self.store.history(mem, player_id, npc_id)
+        summary = self.store.summary(mem, player_id, npc_id)
+
+        prefix: List[Dict[str, Any]] = []
+        if summary:
+            history = [m for m in history if m["id"] > summary["covered_until"]]
+            prefix = [{"role": "summary", "content": SUMMARY_PREFIX + summary["content"]}]
+
+        over_budget = history_tokens(prefix + history) > self.token_budget
+        # buffer 滿了代表更早的訊息已經不在 prompt 裡，也要趁早摘要
+        if over_budget or len(history) >= self.store.max_messages:
+            self._schedule(player_id, npc_id, npc_name)
+        if over_budget:
+            # 摘要完成前，先從最舊的開始丟，至少保留最近 keep_recent 則
+            while len(history) > self.keep_recent and history_tokens(prefix + history) > self.token_budget:
+                history = history[1:]
+        return prefix + history
+
+    def _schedule(self, player_id: int, npc_id: int, npc_name: str) -> None:
+        key = (player_id, npc_id)
+        if key in self._running:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._running.add(key)
+        task = loop.create_task(self.compact(player_id, npc_id, npc_name))
+        self._tasks.add(task)
+
+        def done(t: asyncio.Task) -> None:
+            self._tasks.discard(t)
+            self._running.discard(key)
+            if not t.cancelled() and t.exception() is not None:
+                logger.warning("對話摘要失敗 player=%s npc=%s: %s", player_id, npc_id, t.exception())
+
+        task.add_done_callback(done)
+
+    async def compact(self, player_id: int, npc_id: int, npc_name: str = "NPC") -> bool:
+        """
+        把尚未摘要、且不在最近 keep_recent 則內的訊息折疊進滾動摘要。
+        直接從 Message 表讀，不受 ring buffer 長度限制。
+        同步的 DB 存取放到 thread 裡：在 event loop 上等寫鎖會卡住持有鎖的 async 連線，
+        兩邊一起等到 busy_timeout 才失敗。
+        """
+        def load() -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+            with self.session_factory() as session:
+                mem = MemoryService(session)
+                summary = self.store.summary(mem, player_id, npc_id)
+                covered = summary["covered_until"] if summary else 0
+                pending = mem.get_messages_after(player_id, npc_id, covered)
+                return summary, [
+                    {"id": m.id, "role": m.role, "content": m.content}
+                    for m in pending[:max(len(pending) - self.keep_recent, 0)]
+                ]
+
+        def save(text: str) -> None:
+            with self.session_factory() as session:
+                self.store.set_summary(MemoryService(session), player_id, npc_id, text, to_fold[-1]["id"])
+
+        summary, to_fold = await asyncio.to_thread(load)
+        if not to_fold:
+            return False
+
+        # 背景工作，不跟玩家的對話搶 LLM 名額
+        with llm_context(Priority.PREGEN):
+            text = await self.summarize(
+                previous_summary=summary["content"] if summary else None,
+                messages=to_fold,
+                npc_name=npc_name,
+            )
+        await asyncio.to_thread(save, text)
+        return True
+
+    async def drain(self) -> None:
+        """
+        等所有背景摘要做完（測試與關機時用）
+        """
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+
+history_manager = HistoryManager()
@@ -0,0 +1,267 @@
+import json
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+
+class JsonFieldStreamer:
+    """
+    逐段餵入 LLM 串流回來的 JSON 文字，把最外層物件中某個「字串欄位」的內容
+    一邊收一邊解碼吐出來（例如 NPC 回應的 dialogue）。
+
+        streamer = JsonFieldStreamer("dialogue")
+        for chunk in chunks:
+            delta = streamer.feed(chunk)   # 這次新增、已解碼的文字
+
+    只處理最外層 (depth 1) 的 key，巢狀物件裡同名的 key 不會被誤認。
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self.text = ""            # 到目前為止收到的完整原始文字
+        self.done = False         # 目標欄位的字串是否已經結束
+
+        self._pos = 0             # 下一個要掃描的字元位置
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0    # 目前字串內容的起點（不含引號）
+        self._expect_key = False  # depth 1 時，下一個字串是不是 key
+        self._last_key: Optional[str] = None
+        self._after_colon = False
+
+        self._value_start: Optional[int] = None   # 目標欄位字串內容的起點
+        self._value_end = 0
+        self._emitted = 0                         # 已經吐出去的解碼後字數
+
+    def feed(self, chunk: str) -> str:
+        self.text += chunk
+        text = self.text
+        while self._pos < len(text):
+            ch = text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._end_string(self._pos)
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = self._pos + 1
+                if self._depth == 1 and self._after_colon and self._last_key == self.field and not self.done:
+                    self._value_start = self._pos + 1
+            elif ch in "{[":
+                self._depth += 1
+                self._expect_key = self._depth == 1 and ch == "{"
+                self._after_colon = False
+            elif ch in "}]":
+                self._depth -= 1
+            elif self._depth == 1:
+                if ch == ":":
+                    self._after_colon = True
+                elif ch == ",":
+                    self._expect_key = True
+                    self._after_colon = False
+            self._pos += 1
+        return self._drain()
+
+    def _end_string(self, end: int) -> None:
+        if self._depth != 1:
+            return
+        if self._expect_key:
+            self._last_key = json.loads('"' + self.text[self._string_start:end] + '"')
+            self._expect_key = False
+        elif self._value_start is not None:
+            self._value_end = end
+            self.done = True
+        self._after_colon = False
+
+    def _drain(self) -> str:
+        if self._value_start is None:
+            return ""
+        end = self._value_end if self.done else self._pos
+        decoded = _decode_partial_string(self.text[self._value_start:end])
+        delta = decoded[self._emitted:]
+        self._emitted = len(decoded)
+        if self.done:
+            self._value_start = None
+        return delta
+
+
+def _decode_partial_string(raw: str) -> str:
+    """
+    解碼 JSON 字串內容的「安全前綴」：去掉尾端還沒收完的跳脫序列
+    （例如只收到一半的 \\u4e2），以及還沒配對到的高位代理字元。
+    """
+    cut = len(raw)
+    i = raw.rfind("\\")
+    if i != -1:
+        # 連續反斜線是偶數個的話，代表是跳脫過的反斜線本身，不是序列開頭
+        j = i
+        while j > 0 and raw[j - 1] == "\\":
+            j -= 1
+        if (i - j + 1) % 2 == 1:
+            remaining = len(raw) - i - 1
+            if remaining == 0 or (raw[i + 1] == "u" and remaining < 5):
+                cut = i
+    # strict=False：容許 LLM 直接在字串裡放換行等控制字元
+    decoded = json.loads('"' + raw[:cut] + '"', strict=False)
+    if decoded and "\ud800" <= decoded[-1] <= "\udbff":
+        decoded = decoded[:-1]
+    return decoded
+
+
+def parse_json_object(text: str) -> Optional[dict]:
+    """
+    解析完整的 JSON 物件，失敗時回傳 None
+    """
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+@dataclass
+class RepairedJson:
+    """
+    repair_json 的結果：
+    - value：能救回來的部分（被截斷的物件/陣列已補上結尾，只含完整的值）
+    - incomplete：被截斷的容器路徑，例如 ["$", "$.acts", "$.acts[2]"]
+    """
+    value: Any
+    incomplete: List[str] = field(default_factory=list)
+
+    @property
+    def complete(self) -> bool:
+        return self.value is not None and not self.incomplete
+
+    def is_complete(self, path: str) -> bool:
+        return path not in self.incomplete
+
+
+_MISSING = object()
+_decoder = json.JSONDecoder(strict=False)
+
+
+class _TolerantParser:
+    """
+    寬鬆的遞迴下降 parser：遇到文字結束或語法錯誤就停下，
+    保留已經解析完的值，並記錄所有還沒關閉的容器
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+        self.stopped = False
+        self.incomplete: List[str] = []
+
+    def parse(self) -> RepairedJson:
+        # 跳過 ```json 之類的前綴雜訊，從第一個 { 或 [ 開始
+        starts = [i for i in (self.text.find("{"), self.text.find("[")) if i != -1]
+        if not starts:
+            return RepairedJson(None)
+        self.pos = min(starts)
+        return RepairedJson(self._value("$"), self.incomplete)
+
+    def _ws(self) -> None:
+        while self.pos < len(self.text) and self.text[self.pos] in " \t\r\n":
+            self.pos += 1
+
+    def _value(self, path: str) -> Any:
+        self._ws()
+        if self.pos >= len(self.text):
+            self.stopped = True
+            return _MISSING
+        ch = self.text[self.pos]
+        if ch == "{":
+            return self._object(path)
+        if ch == "[":
+            return self._array(path)
+        return self._scalar()
+
+    def _scalar(self) -> Any:
+        try:
+            value, end = _decoder.raw_decode(self.text, self.pos)
+        except json.JSONDecodeError:
+            # 沒收完的字串、半個 true/null 或真的格式錯誤：這個值放棄
+            self.stopped = True
+            return _MISSING
+        if end >= len(self.text) and type(value) in (int, float):
+            # 數字剛好停在結尾，可能只收到一半（12 可能是 123）
+            self.stopped = True
+            return _MISSING
+        self.pos = end
+        return value
+
+    def _separator_ok(self, closer: str) -> bool:
+        self._ws()
+        return self.pos >= len(self.text) or self.text[self.pos] in "," + closer
+
+    def _array(self, path: str) -> List[Any]:
+        self.pos += 1
+        items: List[Any] = []
+        while True:
+            self._ws()
+            if self.pos >= len(self.text):
+                break
+            ch = self.text[self.pos]
+            if ch == "]":
+                self.pos += 1
+                return items
+            if ch == ",":       # 容許多餘的逗號
+                self.pos += 1
+                continue
+            value = self._value(f"{path}[{len(items)}]")
+            if value is not _MISSING:
+                items.append(value)
+            if self.stopped or not self._separator_ok("]"):
+                break
+        self.stopped = True
+        self.incomplete.append(path)
+        return items
+
+    def _object(self, path: str) -> dict:
+        self.pos += 1
+        obj: dict = {}
+        while True:
+            self._ws()
+            if self.pos >= len(self.text):
+                break
+            ch = self.text[self.pos]
+            if ch == "}":
+                self.pos += 1
+                return obj
+            if ch == ",":
+                self.pos += 1
+                continue
+            if ch != '"':
+                break
+            key = self._scalar()
+            if not isinstance(key, str):
+                break
+            self._ws()
+            if self.pos >= len(self.text) or self.text[self.pos] != ":":
+                break
+            self.pos += 1
+            value = self._value(f"{path}.{key}")
+            if value is not _MISSING:
+                obj[key] = value
+            if self.stopped or not self._separator_ok("}"):
+                break
+        self.stopped = True
+        self.incomplete.append(path)
+        return obj
+
+
+def repair_json(text: str) -> RepairedJson:
+    """
+    解析可能被截斷或夾雜雜訊的 LLM JSON 輸出，救回所有完整的部分。
+
+        parsed = repair_json(resp.text)
+        acts = [a for i, a in enumerate(parsed.value["acts"]) if parsed.is_complete(f"$.acts[{i}]")]
+
+    完整且合法的 JSON 得到的結果與 json.loads 相同，incomplete 為空。
+    """
+    return _TolerantParser(text).parse()
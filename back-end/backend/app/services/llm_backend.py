@@ -0,0 +1,175 @@
+import os
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Optional
+
+import httpx
+from google import genai                         # 官方 SDK
+from google.genai import types
+
+# 可用環境變數調整
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))     # 同時進行中的 LLM 呼叫上限
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))     # HTTP 連線池大小
+LLM_TIMEOUT         = float(os.getenv("LLM_TIMEOUT", "60"))           # 單次呼叫逾時（秒）
+LLM_BACKEND         = os.getenv("LLM_BACKEND", "gemini")              # gemini | fake（離線測試、壓測用）
+
+
+class LlmBackend(ABC):
+    """
+    llm_service 用到的 LLM 後端介面：generate / generate_stream 回傳 GenerateContentResponse
+    （至少要有 text 與 usage_metadata），一定要實作。
+    provider 端快取是選用能力：supports_provider_cache 為 True 的後端才需要提供
+    create_cache(model, system_instruction, ttl_seconds) -> 快取名稱。
+    """
+
+    supports_provider_cache = False
+
+    @abstractmethod
+    async def generate(
+        self,
+        model: str,
+        contents: Any,
+        config: Optional[types.GenerateContentConfig] = None,
+        timeout: Optional[float] = None,
+    ) -> types.GenerateContentResponse:
+        ...
+
+    @abstractmethod
+    def generate_stream(
+        self,
+        model: str,
+        contents: Any,
+        config: Optional[types.GenerateContentConfig] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[types.GenerateContentResponse]:
+        ...
+
+    async def delete_cache(self, name: str) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+
+class GeminiBackend(LlmBackend):
+    """
+    走 SDK async 介面 (client.aio) 的 Gemini 後端。
+    整個 process 共用一個 genai.Client，底下是一個有連線池的 httpx.AsyncClient，
+    不再每次呼叫都佔用一個 threadpool worker。
+    genai.Client 在第一次用到時才建立，沒有 GOOGLE_API_KEY 也能 import 整個 app。
+    """
+
+    supports_provider_cache = True
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_connections: int = LLM_MAX_CONNECTIONS,
+        timeout: float = LLM_TIMEOUT,
+    ):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[genai.Client] = None
+
+    @property
+    def client(self) -> genai.Client:
+        if self._client is None:
+            if not self.api_key:
+                raise RuntimeError("請先在 .env 設定 GOOGLE_API_KEY（或設 LLM_BACKEND=fake 離線執行）")
+            self._client = genai.Client(
+                api_key=self.api_key,
+                http_options=types.HttpOptions(
+                    timeout=int(self.timeout * 1000),   # SDK 的單位是毫秒
+                    async_client_args={
+                        "limits": httpx.Limits(
+                            max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_connections,
+                        ),
+                    },
+                ),
+            )
+        return self._client
+
+    async def generate(
+        self,
+        model: str,
+        contents: Any,
+        config: Optional[types.GenerateContentConfig] = None,
+        timeout: Optional[float] = None,
+    ) -> types.GenerateContentResponse:
+        async with self._semaphore:
+            return await asyncio.wait_for(
+                self.client.aio.models.generate_content(
+                    model=model,
+                    contents=contents,
+                    config=config,
+                ),
+                timeout=timeout or self.timeout,
+            )
+
+    async def generate_stream(
+        self,
+        model: str,
+        contents: Any,
+        config: Optional[types.GenerateContentConfig] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[types.GenerateContentResponse]:
+        """
+        串流生成；timeout 套用在「等下一段」上，避免長回應被整體逾時切斷
+        """
+        timeout = timeout or self.timeout
+        async with self._semaphore:
+            stream = await asyncio.wait_for(
+                self.client.aio.models.generate_content_stream(
+                    model=model,
+                    contents=contents,
+                    config=config,
+                ),
+                timeout=timeout,
+            )
+            iterator = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), timeout=timeout)
+                except StopAsyncIteration:
+                    break
+                yield chunk
+
+    async def create_cache(self, model: str, system_instruction: str, ttl_seconds: int) -> str:
+        """
+        把固定的 system instruction 註冊成 Gemini 端的 cached content，回傳名稱
+        """
+        cached = await asyncio.wait_for(
+            self.client.aio.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_instruction,
+                    ttl=f"{ttl_seconds}s",
+                ),
+            ),
+            timeout=self.timeout,
+        )
+        return cached.name
+
+    async def delete_cache(self, name: str) -> None:
+        await self.client.aio.caches.delete(name=name)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aio.aclose()
+
+
+def create_backend(name: str = LLM_BACKEND, api_key: Optional[str] = None) -> LlmBackend:
+    """
+    依 LLM_BACKEND 建立後端：gemini（預設）或 fake（不連網，見 fake_backend.py）
+    """
+    if name == "gemini":
+        return GeminiBackend(api_key=api_key)
+    if name == "fake":
+        from .fake_backend import FakeBackend
+        return FakeBackend()
+    raise ValueError(f"未知的 LLM_BACKEND：{name}")
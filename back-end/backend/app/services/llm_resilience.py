@@ -0,0 +1,286 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import httpx
+from fastapi import HTTPException
+from google.genai import errors as genai_errors
+
+logger = logging.getLogger(__name__)
+
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "3"))            # 含第一次
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))     # 秒
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "90"))                      # 每次呼叫（含重試）的總時限，秒
+# 超過 p95 還沒回來就再送一個一樣的請求，先回來的贏；會多花 token，預設關閉
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))         # 連續失敗幾次就斷路
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))            # 斷路多久後放一個請求試試，秒
+
+# 這些 HTTP 狀態代表暫時性問題，值得重試
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+Attempt = Callable[[float], Awaitable[T]]   # 參數是這次嘗試剩下的秒數
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(exc, genai_errors.APIError):
+        return exc.code in RETRYABLE_STATUS
+    # 其他（包含 scheduler 的 429）不重試，重試只會讓排隊更長
+    return False
+
+
+class CircuitOpen(HTTPException):
+    """
+    Gemini 連續失敗時直接回 503，不再讓每個請求都等到逾時
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail="LLM 服務暫時無法使用，請稍後再試",
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+        )
+
+
+class CircuitBreaker:
+    """
+    closed -> （連續 failure_threshold 次失敗）-> open -> （reset_timeout 後）-> half_open
+    half_open 只放一個試探請求，成功就回到 closed，失敗就再 open 一輪
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = LLM_BREAKER_FAILURES,
+        reset_timeout: float = LLM_BREAKER_RESET,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> None:
+        if self.state == "closed":
+            return
+        remaining = self.opened_at + self.reset_timeout - self.clock()
+        if self.state == "open" and remaining <= 0:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return
+        raise CircuitOpen(max(remaining, 1))
+
+    def release_probe(self) -> None:
+        """
+        試探請求沒有得到後端的結果（例如被 scheduler 擋下），讓下一個請求再試
+        """
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning("LLM circuit breaker 斷路（連續失敗 %s 次）", self.failures)
+            self.state = "open"
+            self.opened_at = self.clock()
+            self._probing = False
+
+
+class LatencyTracker:
+    """
+    最近 N 次成功呼叫的耗時，用來決定 hedge 的等待時間
+    """
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+class ResilientCaller:
+    """
+    包住每一次 LLM 呼叫：
+    - 可重試的錯誤（逾時、連線錯誤、408/429/5xx）用 full-jitter 指數退避重試
+    - 整個呼叫有總時限（deadline），每次嘗試只拿剩下的時間
+    - 開啟 hedge 時，超過 p95 還沒回來就再送一個，取先完成的
+    - 連續失敗太多次就斷路，之後的呼叫直接 503
+    """
+
+    def __init__(
+        self,
+        attempts: int = LLM_RETRY_ATTEMPTS,
+        base_delay: float = LLM_RETRY_BASE_DELAY,
+        max_delay: float = LLM_RETRY_MAX_DELAY,
+        deadline: float = LLM_DEADLINE,
+        hedge: bool = LLM_HEDGE,
+        hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.attempts = max(attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.stats_counters: Dict[str, int] = {
+            "calls": 0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "failures": 0,
+            "deadline_exceeded": 0,
+            "circuit_rejections": 0,
+        }
+
+    def backoff(self, attempt: int) -> float:
+        # full jitter：0 ~ min(max_delay, base * 2^attempt) 之間隨機
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _hedge_delay(self) -> Optional[float]:
+        if len(self.latency) < self.hedge_min_samples:
+            return None
+        return self.latency.percentile(0.95)
+
+    async def call(
+        self,
+        attempt: Attempt,
+        deadline: Optional[float] = None,
+        hedge: Optional[bool] = None,
+    ) -> Any:
+        loop = asyncio.get_running_loop()
+        until = loop.time() + (deadline or self.deadline)
+        hedge = self.hedge if hedge is None else hedge
+        self.stats_counters["calls"] += 1
+
+        for n in range(self.attempts):
+            try:
+                self.breaker.allow()
+            except CircuitOpen:
+                self.stats_counters["circuit_rejections"] += 1
+                raise
+            remaining = until - loop.time()
+            if remaining <= 0:
+                self.stats_counters["deadline_exceeded"] += 1
+                raise asyncio.TimeoutError("LLM 呼叫超過時限")
+            start = loop.time()
+            try:
+                if hedge:
+                    result = await asyncio.wait_for(self._hedged(attempt, until), remaining)
+                else:
+                    result = await asyncio.wait_for(attempt(remaining), remaining)
+            except Exception as e:
+                if not is_retryable(e):
+                    if isinstance(e, genai_errors.APIError):
+                        self.breaker.record_success()     # 後端有回應，只是這個請求本身有問題
+                    else:
+                        self.breaker.release_probe()
+                    raise
+                self.breaker.record_failure()
+                delay = self.backoff(n)
+                if n == self.attempts - 1 or loop.time() + delay >= until:
+                    self.stats_counters["failures"] += 1
+                    if isinstance(e, asyncio.TimeoutError) and loop.time() >= until:
+                        self.stats_counters["deadline_exceeded"] += 1
+                    raise
+                self.stats_counters["retries"] += 1
+                logger.info("LLM 呼叫失敗（%s），%.2fs 後重試第 %s 次", e, delay, n + 1)
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            self.latency.record(loop.time() - start)
+            return result
+
+    async def _hedged(self, attempt: Attempt, until: float) -> Any:
+        loop = asyncio.get_running_loop()
+        delay = self._hedge_delay()
+        primary = asyncio.ensure_future(attempt(until - loop.time()))
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self.stats_counters["hedges"] += 1
+        backup = asyncio.ensure_future(attempt(until - loop.time()))
+        pending = {primary, backup}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.stats_counters["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(
+        self,
+        open_stream: Callable[[float], AsyncIterator[T]],
+        deadline: Optional[float] = None,
+    ) -> AsyncIterator[T]:
+        """
+        串流版：第一段到達前的失敗會重試；已經開始送出之後就不重試（避免重複內容）
+        """
+        loop = asyncio.get_running_loop()
+        until = loop.time() + (deadline or self.deadline)
+
+        async def first_chunk(remaining: float):
+            iterator = open_stream(remaining).__aiter__()
+            try:
+                first = await iterator.__anext__()
+            except StopAsyncIteration:
+                return iterator, None, True
+            return iterator, first, False
+
+        iterator, first, empty = await self.call(first_chunk, deadline=until - loop.time(), hedge=False)
+        if empty:
+            return
+        yield first
+        async for chunk in iterator:
+            yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        s: Dict[str, Any] = dict(self.stats_counters)
+        s["breaker_state"] = self.breaker.state
+        p50, p95 = self.latency.percentile(0.5), self.latency.percentile(0.95)
+        s["latency_p50"] = round(p50, 3) if p50 is not None else None
+        s["latency_p95"] = round(p95, 3) if p95 is not None else None
+        s["hedge_enabled"] = self.hedge
+        return s
+
+
+resilient = ResilientCaller()
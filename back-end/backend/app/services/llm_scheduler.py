@@ -0,0 +1,236 @@
+import os
+import math
+import time
+import asyncio
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from enum import IntEnum
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, Optional
+
+from fastapi import HTTPException
+
+
+class Priority(IntEnum):
+    """
+    數字越小越優先
+    """
+    INTERACTIVE = 0   # 玩家正在等的 NPC 對話
+    WORLD_GEN = 1     # 背景、generate_full
+    PREGEN = 2        # world pool 之類的背景預先生成
+
+
+# 同時進行中的 LLM 呼叫總數（預設與 GeminiBackend 的上限相同）
+LLM_SCHED_CONCURRENCY = int(os.getenv("LLM_SCHED_CONCURRENCY", os.getenv("LLM_MAX_CONCURRENCY", "16")))
+# 保留給 NPC 對話的名額，世界生成再多也用不到
+LLM_SCHED_RESERVED_INTERACTIVE = int(os.getenv("LLM_SCHED_RESERVED_INTERACTIVE", "4"))
+# 背景預先生成最多同時佔用幾個名額
+LLM_SCHED_MAX_PREGEN = int(os.getenv("LLM_SCHED_MAX_PREGEN", "2"))
+# 各優先級最多排隊幾個，超過直接回 429
+LLM_SCHED_QUEUE_LIMITS = {
+    Priority.INTERACTIVE: int(os.getenv("LLM_SCHED_QUEUE_INTERACTIVE", "64")),
+    Priority.WORLD_GEN: int(os.getenv("LLM_SCHED_QUEUE_WORLD_GEN", "32")),
+    Priority.PREGEN: int(os.getenv("LLM_SCHED_QUEUE_PREGEN", "8")),
+}
+# 還沒有量測資料時，估計 Retry-After 用的單次呼叫秒數
+_INITIAL_SERVICE_SECONDS = {Priority.INTERACTIVE: 2.0, Priority.WORLD_GEN: 8.0, Priority.PREGEN: 8.0}
+
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar("llm_priority", default=Priority.WORLD_GEN)
+_user: contextvars.ContextVar[str] = contextvars.ContextVar("llm_user", default="anonymous")
+
+
+@contextmanager
+def llm_context(priority: Priority, user: Optional[str] = None) -> Iterator[None]:
+    """
+    設定這段程式（含其中建立的 task）發出的 LLM 呼叫的優先級與使用者，
+    call_llm_for_* 不用多帶參數
+    """
+    p_token = _priority.set(priority)
+    u_token = _user.set(user) if user is not None else None
+    try:
+        yield
+    finally:
+        _priority.reset(p_token)
+        if u_token is not None:
+            _user.reset(u_token)
+
+
+def current_priority() -> Priority:
+    return _priority.get()
+
+
+def client_key(request: Any) -> str:
+    """
+    沒有玩家 id 的 API 用來源 IP 當作公平排隊的使用者
+    """
+    client = getattr(request, "client", None)
+    return f"ip:{client.host}" if client else "anonymous"
+
+
+class LlmOverloaded(HTTPException):
+    """
+    排隊已滿：直接回 429 並附上 Retry-After，不讓請求無限等下去
+    """
+
+    def __init__(self, priority: Priority, retry_after: int):
+        super().__init__(
+            status_code=429,
+            detail="LLM 服務忙碌中，請稍後再試",
+            headers={"Retry-After": str(retry_after)},
+        )
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class LlmScheduler:
+    """
+    所有 LLM 呼叫的入口管制：
+    - 總並行數上限，且世界生成留名額給 NPC 對話、背景預先生成另有上限
+    - 有名額時依優先級放行，同一優先級內各使用者輪流（一個人大量請求不會餓死別人）
+    - 每個優先級的排隊長度有上限，滿了丟 LlmOverloaded（429 + Retry-After）
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_SCHED_CONCURRENCY,
+        reserved_interactive: int = LLM_SCHED_RESERVED_INTERACTIVE,
+        max_pregen: int = LLM_SCHED_MAX_PREGEN,
+        queue_limits: Optional[Dict[Priority, int]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        world_limit = max(max_concurrency - reserved_interactive, 1)
+        self.limits = {
+            Priority.INTERACTIVE: max_concurrency,
+            Priority.WORLD_GEN: world_limit,
+            Priority.PREGEN: max(min(max_pregen, world_limit), 1),
+        }
+        # 世界生成與預先生成加起來也不能超過 world_limit，保留的名額才真的留得住
+        self.background_limit = world_limit
+        self.queue_limits = dict(queue_limits or LLM_SCHED_QUEUE_LIMITS)
+        self._active_total = 0
+        self._active = {p: 0 for p in Priority}
+        # 每個優先級一個 user -> 等待中 future 的 OrderedDict，依序輪流
+        self._queues: Dict[Priority, "OrderedDict[str, Deque[asyncio.Future]]"] = {p: OrderedDict() for p in Priority}
+        self._depth = {p: 0 for p in Priority}
+        self._service = dict(_INITIAL_SERVICE_SECONDS)
+        self.stats_counters: Dict[str, Dict[str, float]] = {
+            p.name.lower(): {"admitted": 0, "queued": 0, "rejected": 0, "wait_seconds": 0.0} for p in Priority
+        }
+
+    def _can_run(self, priority: Priority) -> bool:
+        if self._active_total >= self.max_concurrency or self._active[priority] >= self.limits[priority]:
+            return False
+        if priority == Priority.INTERACTIVE:
+            return True
+        return self._active[Priority.WORLD_GEN] + self._active[Priority.PREGEN] < self.background_limit
+
+    def _waiting_at_or_above(self, priority: Priority) -> bool:
+        return any(self._depth[p] for p in Priority if p <= priority)
+
+    def retry_after(self, priority: Priority) -> int:
+        # 大概要等前面排隊的都做完
+        estimate = self._service[priority] * (self._depth[priority] + 1) / self.limits[priority]
+        return max(1, math.ceil(estimate))
+
+    def check_admission(self, priority: Optional[Priority] = None) -> None:
+        """
+        串流 API 在送出 response header 前先檢查，滿了就直接 429
+        """
+        priority = current_priority() if priority is None else priority
+        if self._can_run(priority) and not self._waiting_at_or_above(priority):
+            return
+        if self._depth[priority] >= self.queue_limits[priority]:
+            self.stats_counters[priority.name.lower()]["rejected"] += 1
+            raise LlmOverloaded(priority, self.retry_after(priority))
+
+    def _grant(self, priority: Priority) -> None:
+        self._active[priority] += 1
+        self._active_total += 1
+        self.stats_counters[priority.name.lower()]["admitted"] += 1
+
+    async def acquire(self, priority: Priority, user: str) -> None:
+        if self._can_run(priority) and not self._waiting_at_or_above(priority):
+            self._grant(priority)
+            return
+        self.check_admission(priority)
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[priority]
+        queue.setdefault(user, deque()).append(future)
+        self._depth[priority] += 1
+        self.stats_counters[priority.name.lower()]["queued"] += 1
+        start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已經分到名額才被取消，要還回去
+                self.release(priority)
+            else:
+                self._remove(priority, user, future)
+            raise
+        self.stats_counters[priority.name.lower()]["wait_seconds"] += time.perf_counter() - start
+
+    def _remove(self, priority: Priority, user: str, future: asyncio.Future) -> None:
+        waiters = self._queues[priority].get(user)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            self._depth[priority] -= 1
+            if not waiters:
+                del self._queues[priority][user]
+
+    def release(self, priority: Priority) -> None:
+        self._active[priority] -= 1
+        self._active_total -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and self._can_run(priority):
+                user, waiters = next(iter(queue.items()))
+                future = waiters.popleft()
+                self._depth[priority] -= 1
+                if waiters:
+                    queue.move_to_end(user)     # 輪到下一位使用者
+                else:
+                    del queue[user]
+                if future.done():
+                    continue
+                self._grant(priority)
+                future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[Priority] = None, user: Optional[str] = None) -> AsyncIterator[None]:
+        priority = current_priority() if priority is None else priority
+        user = _user.get() if user is None else user
+        await self.acquire(priority, user)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # 用指數移動平均記錄每次呼叫的時間，估計 Retry-After
+            self._service[priority] = 0.8 * self._service[priority] + 0.2 * (time.perf_counter() - start)
+            self.release(priority)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "background_limit": self.background_limit,
+            "active": self._active_total,
+            "classes": {
+                p.name.lower(): {
+                    **self.stats_counters[p.name.lower()],
+                    "active": self._active[p],
+                    "limit": self.limits[p],
+                    "queued_now": self._depth[p],
+                    "queue_limit": self.queue_limits[p],
+                    "users_waiting": len(self._queues[p]),
+                    "avg_service_seconds": round(self._service[p], 2),
+                }
+                for p in Priority
+            },
+        }
+
+
+llm_scheduler = LlmScheduler()
@@ -1,33 +1,130 @@
 import os
 import json,asyncio
-import re
-from typing import Any, Dict, List, Tuple
-from google import genai                         # 官方 SDK
+import time
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from google.genai import types
 from fastapi import HTTPException
 
+from .llm_backend import create_backend
+from .json_stream import JsonFieldStreamer, RepairedJson, parse_json_object, repair_json
+from .context_cache import ContextKey, chat_context_cache
+from .response_cache import cache_key, response_cache
+from .llm_scheduler import llm_scheduler
+from .llm_resilience import resilient
+from .model_router import model_router
+from .single_flight import llm_single_flight
+from .metrics import llm_calls_total, observe_stage, record_usage, stage_timer
+from .structured_log import log_event
+
 from dotenv import load_dotenv
 # 載入 .env
 basedir = os.path.dirname(os.path.dirname(__file__))
 load_dotenv(os.path.join(basedir, '..', '.env'))
 
-# 讀取金鑰
-api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    raise RuntimeError("請先在 .env 設定 GOOGLE_API_KEY")
-# 建立 Gemini 客戶端
-client = genai.Client(api_key=api_key)
+logger = logging.getLogger(__name__)
+
+# 建立共用的 LLM 後端（預設 Gemini，async + 連線池）；
+# 金鑰到第一次呼叫才檢查，LLM_BACKEND=fake 時完全不需要
+backend = create_backend(api_key=os.getenv("GOOGLE_API_KEY"))
+
+class CachedResponse:
+    """
+    從回應快取取出的結果，只有 text（呼叫端也只用到 text）
+    """
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = None
+
+def _cacheable(text: Optional[str], config: Optional[types.GenerateContentConfig]) -> bool:
+    # 要求 JSON 卻解析不了的回應不要存，免得之後每次都拿到壞掉的結果
+    if not text:
+        return False
+    if config is not None and config.response_mime_type == "application/json":
+        try:
+            json.loads(text)
+        except json.JSONDecodeError:
+            return False
+    return True
+
+async def _call_backend(
+    model: str,
+    contents: Any,
+    config: Optional[types.GenerateContentConfig] = None,
+    task: Optional[str] = None,
+) -> types.GenerateContentResponse:
+    """
+    真的打 Gemini：每次嘗試（含重試、hedge）都各自經過 scheduler 排隊，
+    重試的等待期間不佔名額；成功的耗時（不含排隊）回報給 model_router，
+    排隊時間、LLM 時間與 token 數記到 /metrics
+    """
+    async def attempt(timeout: float):
+        queued = time.perf_counter()
+        async with llm_scheduler.slot():
+            start = time.perf_counter()
+            observe_stage(task, "queue", start - queued)
+            try:
+                resp = await backend.generate(model=model, contents=contents, config=config, timeout=timeout)
+            except Exception:
+                llm_calls_total.inc(stage=task or "other", model=model, outcome="error")
+                raise
+            elapsed = time.perf_counter() - start
+            model_router.record(task, model, elapsed)
+            observe_stage(task, "llm", elapsed)
+            llm_calls_total.inc(stage=task or "other", model=model, outcome="ok")
+            record_usage(task, model, getattr(resp, "usage_metadata", None))
+            return resp
+
+    return await resilient.call(attempt)
 
-def call_llm_for_background(
+async def _generate(
+    model: str,
+    contents: Any,
+    config: Optional[types.GenerateContentConfig] = None,
+    cache: bool = False,
+    fresh: bool = False,
+    task: Optional[str] = None,
+) -> types.GenerateContentResponse:
+    """
+    所有 call_llm_for_* 共用的呼叫路徑。
+    cache=True 時先查回應快取；fresh=True 跳過查詢、一定重新生成（結果仍會寫回快取）。
+    真的要打 Gemini 時先經過 llm_scheduler 排隊（優先級由 llm_context 決定）。
+    task 是 model_router 的任務名稱，用來統計各任務的延遲。
+    非 fresh 的呼叫會經過 single-flight：同樣的請求正在進行中就一起等那一次的結果。
+    """
+    use_cache = cache and response_cache.enabled
+    key = cache_key(model, contents, config)
+    if use_cache:
+        if fresh:
+            response_cache.record_bypass()
+        else:
+            text = await response_cache.aget(key)
+            if text is not None:
+                return CachedResponse(text)
+
+    async def call() -> types.GenerateContentResponse:
+        resp = await _call_backend(model, contents, config, task)
+        if use_cache and _cacheable(resp.text, config):
+            await response_cache.aset(key, resp.text)
+        return resp
+
+    if fresh:
+        # fresh 就是要一份新的（例如 world pool 同主題補貨），不能跟別人共用
+        return await call()
+    return await llm_single_flight.do(f"{task}:{key}", call)
+
+async def call_llm_for_background(
     prompt: str,
-    model: str = "gemini-2.0-flash",
-    temperature: float = 0.7,
-    max_tokens: int = 300
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    fresh: bool = False
 ) -> str:
     """
     根據前端傳入的 prompt（關鍵字或場景），呼叫 Google GenAI 生成
     劇本殺的故事背景文字，並且不做任何澄清問題。
     """
+    model, temperature, max_tokens = model_router.resolve("background", model, temperature, max_tokens)
     # 完全用中文提示更貼合你的使用習慣，或依喜好切換中／英
     system_prompt = (
         "你是一個專業的劇本殺編劇，"
@@ -46,14 +143,17 @@ def call_llm_for_background(
         "不要使用任何換行符號。"
     )
 
-    resp = client.models.generate_content(
+    resp = await _generate(
         model=model,
         contents=[system_prompt, user_instruction],
         config=types.GenerateContentConfig(
             temperature=temperature,
             max_output_tokens=max_tokens,
             candidate_count=1
-        )
+        ),
+        cache=True,
+        fresh=fresh,
+        task="background"
     )
 
     # resp.text 裡就是單純的回應文字
@@ -62,9 +162,12 @@ def call_llm_for_background(
 async def call_llm_for_characters(
     background: str,
     num_characters: int,
-    model: str = "gemini-2.0-flash",
-    temperature: float = 0.7
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    fresh: bool = False
 ) -> list[dict]:
+    model, temperature, max_tokens = model_router.resolve("characters", model, temperature, max_tokens)
     system = (
         "你是一個專業的劇本殺編劇，"
         "請根據以下故事背景，生成指定數量的角色。"
@@ -96,162 +199,320 @@ async def call_llm_for_characters(
         response_mime_type="application/json",
         response_schema=schema,
         temperature=temperature,
+        max_output_tokens=max_tokens,
     )
 
-    def _sync_call():
-        return client.models.generate_content(
-            model    = model,
-            contents = [system, user],
-            config   = cfg,
-        )
-
-    resp = await asyncio.to_thread(_sync_call)
+    resp = await _generate(
+        model    = model,
+        contents = [system, user],
+        config   = cfg,
+        cache    = True,
+        fresh    = fresh,
+        task     = "characters",
+    )
     try:
-        return json.loads(resp.text)
+        with stage_timer("characters", "parse"):
+            return json.loads(resp.text)
     except json.JSONDecodeError as e:
         raise RuntimeError(f"解析 LLM 回傳的 JSON 失敗：{e}")
     
     
+def _build_chat_config(
+    background: str,
+    player_character: Dict[str, Any],
+    npc_character: Dict[str, Any],
+    temperature: float,
+    max_tokens: int,
+) -> Tuple[str, types.GenerateContentConfig]:
+    """
+    組出 NPC 對話的 system instruction 與 config；
+    同一組 (game, npc, player) 不會變，由 chat_context_cache 快取
+    """
+    # 獲取玩家角色資訊
+    player_name = player_character.get("name", "玩家")
+    player_role = player_character.get("role", "調查者")
+    player_public_info = player_character.get("public_info", "一個調查者")
+    player_secret = player_character.get("secret", "想要找出真相")
+    player_mission = player_character.get("mission", "解開謎團")
+
+    # 獲取 NPC 角色資訊
+    npc_name = npc_character.get("name", "未知角色")
+    npc_description = npc_character.get("description", "一個神秘的角色")  # 修正：使用 description
+
+    # 角色秘密等內容不寫進 log
+    log_event(logger, logging.DEBUG, "chat_config_built", player=player_name, npc=npc_name,
+              background_chars=len(background or ""))
+
+    # 自動為 NPC 生成背景設定
+    # npc_secret = f"{npc_name}知道一些關於這個案件的重要線索"
+    # npc_mission = f"作為{npc_name}，要在保護自己的同時適當地協助或誤導調查"
+
+    # 系統指令
+    system_instruction_text = (
+        f"你現在扮演劇本殺遊戲中的 NPC 角色：{npc_name}。\n"
+        f"遊戲背景如下：\n{background}\n\n"
+        f"你的角色描述：{npc_description}。\n\n"           
+        f"正在與你對話的玩家是：{player_name} ({player_role})。\n"
+        f"玩家的背景：{player_public_info}。\n"
+        f"玩家的目標：{player_mission}。\n"
+        f"玩家的秘密：{player_secret}。\n"
+        f"玩家的任務：{player_mission}。\n\n"
+        "所有輸出只能用繁體中文\n"
+        "請完全以 NPC 的身份和口吻回應玩家。\n"
+        "請嚴格以 JSON 物件格式回傳，只包含欄位 dialogue, hint, evidence。\n"
+        "dialogue 是你作為 NPC 的對話回應\n"
+        "hint 是給玩家的線索提示（可為 null）\n"
+        "evidence 是新發現的證據描述（可為 null）"
+    )
+
+    # 定義回傳的 JSON schema
+    response_schema = types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            'dialogue': types.Schema(type=types.Type.STRING, description="NPC 對話"),
+            'hint': types.Schema(type=types.Type.STRING, nullable=True, description="提示，可為 null"),
+            'evidence': types.Schema(type=types.Type.STRING, nullable=True, description="證據，可為 null"),
+        },
+        required=['dialogue']
+    )
+
+    # 配置生成參數
+    gen_config = types.GenerateContentConfig(
+        temperature=temperature,
+        max_output_tokens=max_tokens,
+        response_mime_type="application/json",
+        response_schema=response_schema,
+        candidate_count=1,
+        system_instruction=system_instruction_text
+    )
+    return system_instruction_text, gen_config
+
+def _gemini_role(role: Optional[str]) -> str:
+    # Gemini 只有 user / model 兩種角色；history_manager 的摘要（summary）內容已標明是系統備註，放在 user 端
+    return 'user' if role in ('user', 'summary') else 'model'
+
+def _build_chat_contents(history: List[Any], user_text: str) -> List[types.Content]:
+    # 構建對話內容
+    gemini_contents: List[types.Content] = []
+    for msg in history:
+        if hasattr(msg, 'role') and hasattr(msg, 'content'):
+            role = _gemini_role(msg.role)
+            gemini_contents.append(
+                types.Content(parts=[types.Part(text=msg.content)], role=role)
+            )
+        elif isinstance(msg, dict):
+            role = _gemini_role(msg.get('role'))
+            content = msg.get('content', '')
+            gemini_contents.append(
+                types.Content(parts=[types.Part(text=content)], role=role)
+            )
+    
+    gemini_contents.append(
+        types.Content(parts=[types.Part(text=user_text)], role='user')
+    )
+    return gemini_contents
+
+async def _prepare_chat(
+    background: str,
+    player_character: Dict[str, Any],
+    npc_character: Dict[str, Any],
+    history: List[Any],
+    user_text: str,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    context_key: Optional[ContextKey],
+) -> Tuple[List[types.Content], types.GenerateContentConfig]:
+    """
+    組出 NPC 對話要送給 Gemini 的 contents 與 config（一般呼叫與串流共用）。
+    有 context_key 時 system instruction 走快取，不用每回合重建。
+    """
+    build = lambda: _build_chat_config(
+        background, player_character, npc_character, temperature, max_tokens
+    )
+    if context_key is None:
+        _, gen_config = build()
+    else:
+        ctx = chat_context_cache.get_or_build(context_key, build)
+        await chat_context_cache.ensure_provider_cache(ctx, model, backend)
+        gen_config = ctx.config_for(model, temperature, max_tokens)
+    return _build_chat_contents(history, user_text), gen_config
+
+def _chat_fallback(npc_character: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "dialogue": f"抱歉，{npc_character.get('name', '我')}暫時無法回應。",
+        "hint": None,
+        "evidence": None
+    }
+
 async def call_llm_for_chat(
     background: str,
     player_character: Dict[str, Any],  # 新增：玩家角色資訊
     npc_character: Dict[str, Any],     # 修正：NPC 角色資訊
     history: List[Any],
     user_text: str,
-    model: str = "gemini-2.0-flash",
-    temperature: float = 0.7,
-    max_tokens: int = 500,
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    context_key: Optional[ContextKey] = None,
 ) -> Dict[str, Any]:
     """
     根據遊戲背景、玩家角色、NPC 角色設定、對話歷史，呼叫 Gemini 生成 NPC 回應。
     回傳包含 dialogue, hint, evidence 三個欄位。
+    context_key = (game_id, npc_id, player_id)，有給的話重用快取的 system instruction。
     """
+    model, temperature, max_tokens = model_router.resolve("chat", model, temperature, max_tokens)
     
     try:
-        # 獲取玩家角色資訊
-        player_name = player_character.get("name", "玩家")
-        player_role = player_character.get("role", "調查者")
-        player_public_info = player_character.get("public_info", "一個調查者")
-        player_secret = player_character.get("secret", "想要找出真相")
-        player_mission = player_character.get("mission", "解開謎團")
-
-        # 獲取 NPC 角色資訊
-        npc_name = npc_character.get("name", "未知角色")
-        npc_description = npc_character.get("description", "一個神秘的角色")  # 修正：使用 description
-
-        print(f"處理角色資訊:")
-        print(f"玩家角色:")
-        print(f"  名稱: {player_name}")
-        print(f"  角色: {player_role}")
-        print(f"  公開資訊: {player_public_info}")
-        print(f"  秘密: {player_secret}")
-        print(f"  任務: {player_mission}")
-        print(f"NPC 角色:")
-        print(f"  名稱: {npc_name}")
-        print(f"  描述: {npc_description}")  # 修正：顯示 description
-
-        # 自動為 NPC 生成背景設定
-        # npc_secret = f"{npc_name}知道一些關於這個案件的重要線索"
-        # npc_mission = f"作為{npc_name}，要在保護自己的同時適當地協助或誤導調查"
-
-        # 系統指令
-        system_instruction_text = (
-            f"你現在扮演劇本殺遊戲中的 NPC 角色：{npc_name}。\n"
-            f"遊戲背景如下：\n{background}\n\n"
-            f"你的角色描述：{npc_description}。\n\n"           
-            f"正在與你對話的玩家是：{player_name} ({player_role})。\n"
-            f"玩家的背景：{player_public_info}。\n"
-            f"玩家的目標：{player_mission}。\n"
-            f"玩家的秘密：{player_secret}。\n"
-            f"玩家的任務：{player_mission}。\n\n"
-            "所有輸出只能用繁體中文\n"
-            "請完全以 NPC 的身份和口吻回應玩家。\n"
-            "請嚴格以 JSON 物件格式回傳，只包含欄位 dialogue, hint, evidence。\n"
-            "dialogue 是你作為 NPC 的對話回應\n"
-            "hint 是給玩家的線索提示（可為 null）\n"
-            "evidence 是新發現的證據描述（可為 null）"
-        )
-
-        # 構建對話內容
-        gemini_contents: List[types.Content] = []
-        for msg in history:
-            if hasattr(msg, 'role') and hasattr(msg, 'content'):
-                role = 'user' if msg.role == 'user' else 'model'
-                gemini_contents.append(
-                    types.Content(parts=[types.Part(text=msg.content)], role=role)
-                )
-            elif isinstance(msg, dict):
-                role = 'user' if msg.get('role') == 'user' else 'model'
-                content = msg.get('content', '')
-                gemini_contents.append(
-                    types.Content(parts=[types.Part(text=content)], role=role)
-                )
-        
-        gemini_contents.append(
-            types.Content(parts=[types.Part(text=user_text)], role='user')
-        )
-
-        # 定義回傳的 JSON schema
-        response_schema = types.Schema(
-            type=types.Type.OBJECT,
-            properties={
-                'dialogue': types.Schema(type=types.Type.STRING, description="NPC 對話"),
-                'hint': types.Schema(type=types.Type.STRING, nullable=True, description="提示，可為 null"),
-                'evidence': types.Schema(type=types.Type.STRING, nullable=True, description="證據，可為 null"),
-            },
-            required=['dialogue']
+        gemini_contents, gen_config = await _prepare_chat(
+            background, player_character, npc_character, history, user_text,
+            model, temperature, max_tokens, context_key,
         )
+        npc_name = npc_character.get("name", "未知角色")
 
-        # 配置生成參數
-        gen_config = types.GenerateContentConfig(
-            temperature=temperature,
-            max_output_tokens=max_tokens,
-            response_mime_type="application/json",
-            response_schema=response_schema,
-            candidate_count=1,
-            system_instruction=system_instruction_text
+        # 呼叫 Gemini
+        resp = await _generate(
+            model=model,
+            contents=gemini_contents,
+            config=gen_config,
+            task="chat"
         )
-
-        # 同步呼叫 Gemini
-        def _sync_call():
-            return client.models.generate_content(
-                model=model,
-                contents=gemini_contents,
-                config=gen_config
-            )
-
-        resp = await asyncio.to_thread(_sync_call)
+        chat_context_cache.record_usage(getattr(resp, "usage_metadata", None))
 
         # 解析回傳
         try:
-            result = json.loads(resp.text)
-            print(f"LLM 原始回應: {result}")
+            with stage_timer("chat", "parse"):
+                result = json.loads(resp.text)
+            log_event(logger, logging.INFO, "chat_reply", npc=npc_name, chars=len(resp.text))
             return result
         except json.JSONDecodeError as e:
-            print(f"JSON 解析失敗: {e}, 原始回傳: {resp.text}")
+            log_event(logger, logging.WARNING, "chat_json_invalid", npc=npc_name, error=str(e),
+                      raw=resp.text[:200])
             return {
                 "dialogue": f"{npc_name}說：抱歉，我現在無法正常回應。",
                 "hint": None,
                 "evidence": None
             }
             
-    except Exception as e:
-        print(f"LLM 呼叫失敗: {e}")
-        import traceback
-        traceback.print_exc()
-        return {
-            "dialogue": f"抱歉，{npc_character.get('name', '我')}暫時無法回應。",
-            "hint": None,
-            "evidence": None
-        }
+    except HTTPException:
+        # 排隊已滿 (429) 要讓前端知道，不能吞成預設回覆
+        raise
+    except Exception:
+        logger.exception("NPC 對話的 LLM 呼叫失敗，改用預設回覆")
+        return _chat_fallback(npc_character)
+
+async def stream_llm_for_chat(
+    background: str,
+    player_character: Dict[str, Any],
+    npc_character: Dict[str, Any],
+    history: List[Any],
+    user_text: str,
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    context_key: Optional[ContextKey] = None,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    串流版的 NPC 對話：一邊收 Gemini 的串流一邊解析 JSON，
+    先逐段 yield ("dialogue", 新增的文字)，最後 yield ("done", {dialogue, hint, evidence})。
+    """
+    model, temperature, max_tokens = model_router.resolve("chat", model, temperature, max_tokens)
+    gemini_contents, gen_config = await _prepare_chat(
+        background, player_character, npc_character, history, user_text,
+        model, temperature, max_tokens, context_key,
+    )
+    streamer = JsonFieldStreamer("dialogue")
+    dialogue = ""
+    usage = None
+
+    async def open_stream(timeout: float):
+        queued = time.perf_counter()
+        async with llm_scheduler.slot():
+            start = time.perf_counter()
+            observe_stage("chat", "queue", start - queued)
+            async for chunk in backend.generate_stream(
+                model=model,
+                contents=gemini_contents,
+                config=gen_config,
+                timeout=timeout
+            ):
+                yield chunk
+            elapsed = time.perf_counter() - start
+            model_router.record("chat", model, elapsed)
+            observe_stage("chat", "llm", elapsed)
+
+    async for chunk in resilient.stream(open_stream):
+        # usage_metadata 在最後一段才是完整的
+        usage = getattr(chunk, "usage_metadata", None) or usage
+        if not chunk.text:
+            continue
+        delta = streamer.feed(chunk.text)
+        if delta:
+            dialogue += delta
+            yield "dialogue", delta
+
+    chat_context_cache.record_usage(usage)
+    record_usage("chat", model, usage)
+    llm_calls_total.inc(stage="chat", model=model, outcome="ok")
+    with stage_timer("chat", "parse"):
+        result = parse_json_object(streamer.text)
+    if result is None:
+        # JSON 沒收完整：已經送出去的 dialogue 就當作回應
+        log_event(logger, logging.WARNING, "chat_stream_json_invalid", chars=len(streamer.text),
+                  raw=streamer.text[:200])
+        result = {"dialogue": dialogue, "hint": None, "evidence": None} if dialogue \
+            else _chat_fallback(npc_character)
+    yield "done", result
                
+async def call_llm_for_summary(
+    previous_summary: Optional[str],
+    messages: List[Dict[str, Any]],
+    npc_name: str = "NPC",
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+) -> str:
+    """
+    把玩家與 NPC 較早的對話折疊成滾動摘要（接在舊摘要後面重新整理）
+    """
+    model, temperature, max_tokens = model_router.resolve("summary", model, temperature, max_tokens)
+    system = (
+        "你是劇本殺遊戲的紀錄員，"
+        f"請把玩家與 NPC「{npc_name}」的對話整理成精簡摘要，"
+        "保留玩家問過的關鍵問題、NPC 透露的線索、證據、承諾與態度變化，"
+        "刪去寒暄與重複內容。"
+        "只能用繁體中文，直接輸出摘要文字，不要標題或格式標籤。"
+    )
+    transcript = "\n".join(
+        f"{'玩家' if m['role'] == 'user' else npc_name}：{m['content']}" for m in messages
+    )
+    user = (
+        f"先前的摘要：{previous_summary or '（無）'}\n"
+        f"新的對話：\n{transcript}\n"
+        "請輸出合併後的新摘要，300字以內。"
+    )
+    resp = await _generate(
+        model=model,
+        contents=[system, user],
+        config=types.GenerateContentConfig(
+            temperature=temperature,
+            max_output_tokens=max_tokens,
+            candidate_count=1
+        ),
+        task="summary"
+    )
+    return resp.text.strip()
+
 async def call_llm_for_npcs(
     background: str,
     characters: Dict[str, Any],
     num_npcs: int,
-    model: str = "gemini-2.0-flash",
-    temperature: float = 0.7
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    fresh: bool = False
 ) -> List[dict]:
+    model, temperature, max_tokens = model_router.resolve("npcs", model, temperature, max_tokens)
     system = (
         "你是一名劇本殺編劇，根據以下故事背景生成指定數量的 NPC 角色。"
         "請以純 JSON 陣列回傳，每個元素包含 name, description 兩個欄位。"
@@ -274,16 +535,19 @@ async def call_llm_for_npcs(
     cfg = types.GenerateContentConfig(
         response_mime_type="application/json",
         response_schema=schema,
-        temperature=temperature
+        temperature=temperature,
+        max_output_tokens=max_tokens
     )
-    def _sync_call():
-        return client.models.generate_content(
-            model=model,
-            contents=[system, user],
-            config=cfg
-        )
-    resp = await asyncio.to_thread(_sync_call)
-    return json.loads(resp.text)
+    resp = await _generate(
+        model=model,
+        contents=[system, user],
+        config=cfg,
+        cache=True,
+        fresh=fresh,
+        task="npcs"
+    )
+    with stage_timer("npcs", "parse"):
+        return json.loads(resp.text)
 
 async def call_llm_for_scenes_and_ending(
     background: str,
@@ -291,10 +555,17 @@ async def call_llm_for_scenes_and_ending(
     locations: List[Dict[str, Any]],
     npcs: List[Dict[str, Any]],
     num_acts: int,
-    model: str = "gemini-2.0-flash",
-    temperature: float = 0.7,
-    max_tokens: int = 3000,
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    fresh: bool = False,
 ) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    先產生一份共用的劇情大綱，再依大綱「同時」生成每一幕與結局，
+    總耗時約等於大綱 + 最慢的一幕，不會隨幕數線性增加。
+    max_tokens 是每一次呼叫（每一幕、結局）的上限
+    """
+    model, temperature, max_tokens = model_router.resolve("scenes", model, temperature, max_tokens)
     # 强调纯 JSON 输出的 system prompt
     names = [ch["name"] for ch in characters]
     names_str = "、".join(names)
@@ -306,7 +577,7 @@ async def call_llm_for_scenes_and_ending(
         "只能用繁體中文"
        " 你是一個專業的劇本殺編劇："
         """
-        1. 劇本結構：輸出一個 JSON 物件 {"acts":[...],"ending":string}，嚴格遵守格式，不要多餘文字或標記。
+        1. 劇本結構：嚴格遵守指定的 JSON 格式，不要多餘文字或標記。
             -**所有 JSON 鍵和字串值都必須使用**雙引號 `"`** 括起來。
             -**請確保所有字串內容中的特殊字元（例如雙引號本身、換行符等）都進行** **JSON 逸出 (escaped)**。例如：`"This is a \"quote\"."` 或 `"Line1\nLine2"`。
             -**所有逗號 `,` 和括號 `[]` `{}` 都必須正確配對。**
@@ -325,87 +596,216 @@ async def call_llm_for_scenes_and_ending(
         - 部分線索請以「謎題」形式出現（例如：『密碼是屋頂牌匾上的三個字母』），讓玩家必須解題才能進入下一步。
         """
     )
-    #  user prompt 描述任务
-    user = (
+    names_json = json.dumps(names, ensure_ascii=False)
+    base = (
         f"故事背景：{background}\n"
-        f"角色清單（必須依此順序輸出）：{json.dumps([c['name'] for c in characters], ensure_ascii=False)}\n"
-        f"請生成 {num_acts} 幕，每幕物件需包含 act_number (整數) 及 scripts (陣列)，"
-        "每個 script 包含 character (字串) 及 dialogue (字串)。"
-        "最後再給一個 ending (字串)。"
+        f"角色清單（必須依此順序輸出）：{names_json}\n"
     )
+    call = dict(model=model, temperature=temperature, fresh=fresh)
 
-    #  定義 JSON schema
+    outline = await _generate_scene_outline(system, base, num_acts, **call)
+    outline_json = json.dumps(outline, ensure_ascii=False)
+    results = await asyncio.gather(
+        *[_generate_act(system, base, outline_json, n, num_acts, names, max_tokens=max_tokens, **call)
+          for n in range(1, num_acts + 1)],
+        _generate_ending(system, base, outline_json, max_tokens=max_tokens, **call),
+    )
+    return list(results[:-1]), results[-1]
+
+async def _generate_scene_outline(
+    system: str, base: str, num_acts: int, model: str, temperature: float, fresh: bool
+) -> Dict[str, Any]:
+    """
+    所有幕共用的大綱：真相、每幕揭露的重點，讓各幕分開生成也能前後連貫
+    """
+    user = (
+        base
+        + f"先不要寫劇本，請規劃 {num_acts} 幕的劇情大綱：truth 寫出兇手、動機與手法，"
+        "acts 每幕用 2–3 句寫出發生的事、揭露的關鍵線索與迷惑線索，"
+        "ending 用 1–2 句寫出結局走向。"
+    )
     schema = {
         "type": "object",
         "properties": {
+            "truth": {"type": "string"},
             "acts": {
                 "type": "array",
                 "items": {
                     "type": "object",
                     "properties": {
                         "act_number": {"type": "integer"},
-                        "scripts": {
-                            "type": "array",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "character": {
-                                        "type":"string",
-                                        "enum": [ c["name"] for c in characters ]   # 只允許角色清單裡的名字
-                                    },
-                                    "dialogue":  {"type": "string"}
-                                },
-                                "required": ["character", "dialogue"]
-                            }
-                        }
+                        "summary": {"type": "string"},
                     },
-                    "required": ["act_number", "scripts"]
+                    "required": ["act_number", "summary"]
                 }
             },
             "ending": {"type": "string"}
         },
-        "required": ["acts", "ending"]
+        "required": ["truth", "acts", "ending"]
     }
     cfg = types.GenerateContentConfig(
         response_mime_type="application/json",
         response_schema=schema,
         temperature=temperature,
-        max_output_tokens=max_tokens
+        max_output_tokens=200 * num_acts + 400
     )
+    resp = await _generate(model=model, contents=[system, user], config=cfg, cache=True, fresh=fresh, task="scenes")
+    # 大綱被截斷也能用：缺的幕由該幕依前後文自行發揮
+    with stage_timer("scenes", "parse"):
+        parsed = repair_json(resp.text)
+    if not isinstance(parsed.value, dict) or not parsed.value:
+        raise RuntimeError(f"解析劇情大綱失敗，原始回傳：\n{resp.text}")
+    return parsed.value
 
-    #  同步调用 Gemini
-    def _sync_call():
-        return client.models.generate_content(
-            model=model,
-            contents=[system, user],
-            config=cfg
-        )
-    resp = await asyncio.to_thread(_sync_call)
+async def _generate_act(
+    system: str,
+    base: str,
+    outline_json: str,
+    act_number: int,
+    num_acts: int,
+    names: List[str],
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    fresh: bool,
+) -> Dict[str, Any]:
+    user = (
+        base
+        + f"劇情大綱（共 {num_acts} 幕）：{outline_json}\n"
+        f"請依大綱只寫第 {act_number} 幕：act_number 為 {act_number}，"
+        "scripts 陣列中每個角色一個 script，包含 character (字串) 及 dialogue (字串)。"
+    )
+    schema = {
+        "type": "object",
+        "properties": {
+            "act_number": {"type": "integer"},
+            "scripts": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "character": {
+                            "type": "string",
+                            "enum": names   # 只允許角色清單裡的名字
+                        },
+                        "dialogue": {"type": "string"}
+                    },
+                    "required": ["character", "dialogue"]
+                }
+            }
+        },
+        "required": ["act_number", "scripts"]
+    }
+    cfg = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=schema,
+        temperature=temperature,
+        max_output_tokens=max_tokens
+    )
+    for attempt in range(2):
+        resp = await _generate(model=model, contents=[system, user], config=cfg, cache=True, fresh=fresh or attempt > 0, task="scenes")
+        with stage_timer("scenes", "parse"):
+            scripts = _complete_scripts(repair_json(resp.text), names)
+        # 被截斷時保留完整的 script，只補生成缺少的角色；一個都沒有才重新生成這一幕
+        if scripts:
+            missing = [n for n in names if n not in scripts]
+            if missing:
+                logger.warning("第 %s 幕缺少 %s 的劇本，補生成", act_number, "、".join(missing))
+                scripts.update(await _generate_missing_scripts(
+                    system, user, schema, scripts, missing, act_number, model, temperature, max_tokens, fresh
+                ))
+            # 依角色清單的順序輸出
+            return {"act_number": act_number, "scripts": [scripts[n] for n in names if n in scripts]}
+        logger.warning("第 %s 幕 JSON 無法解析，重新生成", act_number)
+    raise RuntimeError(f"第 {act_number} 幕生成失敗，原始回傳：\n{resp.text}")
 
-    #print("LLM 原始回傳：", resp.text)
+def _complete_scripts(parsed: RepairedJson, names: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    角色名稱 -> 完整的 script；被截斷或不在角色清單裡的略過
+    """
+    act = parsed.value if isinstance(parsed.value, dict) else {}
+    scripts: Dict[str, Dict[str, Any]] = {}
+    for i, sc in enumerate(act.get("scripts") or []):
+        if not parsed.is_complete(f"$.scripts[{i}]") or not isinstance(sc, dict):
+            continue
+        if sc.get("character") in names and isinstance(sc.get("dialogue"), str):
+            scripts.setdefault(sc["character"], sc)
+    return scripts
 
-    raw = resp.text.strip()
-    # 直接嘗試解析整段 JSON
-    try:
-        data = json.loads(raw)
-    except json.JSONDecodeError as e:
-        # 如果真的還有多餘文字，可以做最小化的 fallback
-        import re
-        m = re.search(r"(\{.*\})", raw, re.S)
-        if not m:
-            raise RuntimeError(f"解析 JSON 失敗，原始回傳：\n{raw}") from e
-        data = json.loads(m.group(1))
+async def _generate_missing_scripts(
+    system: str,
+    user: str,
+    schema: Dict[str, Any],
+    done: Dict[str, Dict[str, Any]],
+    missing: List[str],
+    act_number: int,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    fresh: bool,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    只請 LLM 寫缺少的角色，已完成的劇本當作前文；補不齊就用已有的部分
+    """
+    repair_schema = json.loads(json.dumps(schema))
+    repair_schema["properties"]["scripts"]["items"]["properties"]["character"]["enum"] = missing
+    repair_user = (
+        f"{user}\n"
+        f"以下角色的劇本已經完成，不要重複：{json.dumps(list(done.values()), ensure_ascii=False)}\n"
+        f"請只輸出這些角色的 script：{json.dumps(missing, ensure_ascii=False)}"
+    )
+    cfg = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=repair_schema,
+        temperature=temperature,
+        max_output_tokens=max_tokens
+    )
+    resp = await _generate(model=model, contents=[system, repair_user], config=cfg, cache=True, fresh=fresh, task="scenes")
+    with stage_timer("scenes", "parse"):
+        more = _complete_scripts(repair_json(resp.text), missing)
+    still_missing = [n for n in missing if n not in more]
+    if still_missing:
+        logger.warning("第 %s 幕補生成後仍缺少 %s 的劇本", act_number, "、".join(still_missing))
+    return more
 
-    # 取出 acts 與 ending 回傳
-    return data["acts"], data["ending"]
+async def _generate_ending(
+    system: str,
+    base: str,
+    outline_json: str,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    fresh: bool,
+) -> str:
+    user = base + f"劇情大綱：{outline_json}\n請依大綱寫出完整的結局 ending (字串)，揭曉真相。"
+    schema = {
+        "type": "object",
+        "properties": {"ending": {"type": "string"}},
+        "required": ["ending"]
+    }
+    cfg = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=schema,
+        temperature=temperature,
+        max_output_tokens=max_tokens
+    )
+    for attempt in range(2):
+        resp = await _generate(model=model, contents=[system, user], config=cfg, cache=True, fresh=fresh or attempt > 0, task="scenes")
+        with stage_timer("scenes", "parse"):
+            ending = repair_json(resp.text).value
+        if isinstance(ending, dict) and isinstance(ending.get("ending"), str) and ending["ending"].strip():
+            return ending["ending"]
+        logger.warning("結局 JSON 無法解析，重新生成")
+    raise RuntimeError(f"結局生成失敗，原始回傳：\n{resp.text}")
 
 async def call_llm_for_locations(
     background: str,
     characters: List[Dict[str, Any]],
     npcs: List[Dict[str, Any]],
-    model: str = "gemini-2.0-flash",
-    temperature: float = 0.7,
-    max_tokens: int = 2000,
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    fresh: bool = False,
 ) -> List[Dict[str, Any]]:
     """
     產生遊戲裡的地點列表，每個地點包含：
@@ -414,6 +814,7 @@ async def call_llm_for_locations(
     - npcs: 該地點的 NPC id 清單
     - objects: 該地點可互動的物件 (name, lock, clue)
     """
+    model, temperature, max_tokens = model_router.resolve("locations", model, temperature, max_tokens)
     system = (
         "你是一個專業的劇本殺編劇，"
         "請根據故事背景、角色列表和 NPC 列表，生成遊戲中所有的「地點」。"
@@ -466,19 +867,74 @@ async def call_llm_for_locations(
         max_output_tokens=max_tokens
     )
 
-    def _sync_call():
-        return client.models.generate_content(
-            model=model,
-            contents=[system, user],
-            config=cfg
-        )
+    resp = await _generate(
+        model=model,
+        contents=[system, user],
+        config=cfg,
+        cache=True,
+        fresh=fresh,
+        task="locations"
+    )
+    with stage_timer("locations", "parse"):
+        parsed = repair_json(resp.text)
+        locations = _complete_locations(parsed)
+    if parsed.complete and isinstance(parsed.value, list):
+        return locations
 
-    resp = await asyncio.to_thread(_sync_call)
-    try:
-        return json.loads(resp.text)
-    except json.JSONDecodeError as e:
-        # 如果 LLM 偶爾多出雜訊，再用最簡正則擷取
-        m = re.search(r"(\[.*\])", resp.text, re.S)
-        if not m:
-            raise RuntimeError(f"解析地點 JSON 失敗\n原始回傳：{resp.text}") from e
-        return json.loads(m.group(1))
+    # 回傳被截斷：保留完整的地點，只補生成還沒安排到的 NPC 所在地點
+    placed = {n for loc in locations for n in loc["npcs"]}
+    unplaced = [n for n in npcs if n.get("id") not in placed]
+    if locations and not unplaced and len(locations) >= 3:
+        return locations
+    logger.warning("地點 JSON 不完整，已救回 %s 個地點，補生成其餘地點", len(locations))
+    next_id = max((loc["id"] for loc in locations), default=0) + 1
+    repair_user = (
+        f"{user}\n"
+        f"以下地點已經完成，不要重複：{json.dumps(locations, ensure_ascii=False)}\n"
+        f"請只輸出其餘的地點（id 從 {next_id} 開始），"
+        f"必須安排這些 NPC：{json.dumps(unplaced, ensure_ascii=False)}，"
+        f"地點總數至少 3 個。"
+    )
+    resp = await _generate(
+        model=model,
+        contents=[system, repair_user],
+        config=cfg,
+        cache=True,
+        fresh=fresh,
+        task="locations"
+    )
+    used = {loc["id"] for loc in locations}
+    with stage_timer("locations", "parse"):
+        more = _complete_locations(repair_json(resp.text))
+    for loc in more:
+        if loc["id"] in used:
+            loc["id"] = next_id
+        used.add(loc["id"])
+        next_id = max(used) + 1
+        locations.append(loc)
+    if not locations:
+        raise RuntimeError(f"解析地點 JSON 失敗\n原始回傳：{resp.text}")
+    return locations
+
+def _complete_locations(parsed: RepairedJson) -> List[Dict[str, Any]]:
+    """
+    只留下欄位齊全的地點；地點在物件中途被截斷時（id、name、npcs 都已完整）
+    仍保留這個地點，物件只留完整的那幾個
+    """
+    if not isinstance(parsed.value, list):
+        return []
+    locations = []
+    for i, loc in enumerate(parsed.value):
+        if not isinstance(loc, dict):
+            continue
+        if not isinstance(loc.get("id"), int) or not isinstance(loc.get("name"), str):
+            continue
+        if not isinstance(loc.get("npcs"), list) or not parsed.is_complete(f"$[{i}].npcs"):
+            continue
+        loc["npcs"] = [n for n in loc["npcs"] if isinstance(n, int)]
+        loc["objects"] = [
+            o for j, o in enumerate(loc.get("objects") or [])
+            if parsed.is_complete(f"$[{i}].objects[{j}]") and isinstance(o, dict) and "name" in o and "lock" in o
+        ]
+        locations.append(loc)
+    return locations
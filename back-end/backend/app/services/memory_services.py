@@ -1,8 +1,31 @@
 from typing import List, Dict, Any, Optional
-from sqlmodel import Session, select, delete
+from sqlmodel import Session, select, delete, update
+from sqlalchemy import case, event, exists, or_
 import datetime
+import logging
 
-from ..models import Game, Character, Npc, Player, Message, Location, GameObj
+from ..models import Game, Character, Npc, Player, Message, Location, GameObj, ConversationSummary, IdempotencyRecord
+from .conversation_store import conversation_store
+from .context_cache import chat_context_cache
+from .game_versions import game_versions
+
+logger = logging.getLogger(__name__)
+
+class GameHasPlayers(Exception):
+    """
+    已經有玩家加入的遊戲不能覆蓋世界：角色換掉後玩家與對話紀錄會對不上
+    """
+
+    def __init__(self, game_id: int):
+        super().__init__(f"遊戲 {game_id} 已經有玩家加入，不能重新生成世界")
+        self.game_id = game_id
+
+# session.info 的 key：commit 之後要作廢快取的遊戲
+_PENDING_INVALIDATIONS = "chat_context_invalidations"
+
+def _invalidate_pending(session: Session) -> None:
+    for game_id in session.info.pop(_PENDING_INVALIDATIONS, ()):
+        chat_context_cache.invalidate_game(game_id)
 
 class MemoryService:
     def __init__(self, db: Session):
@@ -18,33 +41,52 @@ class MemoryService:
     def get_game(self, game_id: int) -> Optional[Game]:
         return self.db.get(Game, game_id)
 
-    def save_background(self, game_id: int, background: Optional[str]) -> None:
+    def _invalidate_game_cache(self, game_id: int, commit: bool) -> None:
+        # 快取要在 commit 之後才作廢：commit=False 時等呼叫端 commit，
+        # 不然同時進來的對話會把 commit 前的舊資料又放回快取
+        if commit:
+            chat_context_cache.invalidate_game(game_id)
+            return
+        pending = self.db.info.setdefault(_PENDING_INVALIDATIONS, set())
+        if not pending:
+            event.listen(self.db, "after_commit", _invalidate_pending, once=True)
+        pending.add(game_id)
+
+    def save_background(self, game_id: int, background: Optional[str], commit: bool = True) -> None:
         game = self.get_game(game_id)
         if game:
             game.background = background
             self.db.add(game)
-            self.db.commit()
+            game_versions.touch(self.db, game_id)
+            if commit:
+                self.db.commit()
+        # 背景變了，快取的 NPC system instruction 也要作廢
+        self._invalidate_game_cache(game_id, commit)
 
-    def _clear_characters(self, game_id: int) -> None:
+    def _clear_characters(self, game_id: int, commit: bool = True) -> None:
         self.db.exec(delete(Character).where(Character.game_id == game_id))
-        self.db.commit()
+        game_versions.touch(self.db, game_id)
+        if commit:
+            self.db.commit()
+        self._invalidate_game_cache(game_id, commit)
 
     def save_characters(self, game_id: int, characters: List[Dict[str, Any]]) -> None:
-        # 清除並儲存角色
-        self._clear_characters(game_id)
-        for ch in characters:
-            self.db.add(Character(game_id=game_id, **ch))
+        # 清除並儲存角色，同一個 transaction
+        self._clear_characters(game_id, commit=False)
+        self.db.add_all([Character(game_id=game_id, **ch) for ch in characters])
         self.db.commit()
 
-    def _clear_npcs(self, game_id: int) -> None:
+    def _clear_npcs(self, game_id: int, commit: bool = True) -> None:
         self.db.exec(delete(Npc).where(Npc.game_id == game_id))
-        self.db.commit()
+        game_versions.touch(self.db, game_id)
+        if commit:
+            self.db.commit()
+        self._invalidate_game_cache(game_id, commit)
 
     def save_npcs(self, game_id: int, npcs: List[Dict[str, Any]]) -> None:
-        # 清除並儲存 NPC
-        self._clear_npcs(game_id)
-        for npc_data in npcs:
-            self.db.add(Npc(game_id=game_id, **npc_data))
+        # 清除並儲存 NPC，同一個 transaction
+        self._clear_npcs(game_id, commit=False)
+        self.db.add_all([Npc(game_id=game_id, **npc_data) for npc_data in npcs])
         self.db.commit()
     def get_npcs(self, game_id: int) -> List[Npc]:
         """
@@ -59,10 +101,11 @@ class MemoryService:
         """
         同時清除本遊戲的角色 (Character) 與 NPC
         """
-        self._clear_characters(game_id)
-        self._clear_npcs(game_id)
+        self._clear_characters(game_id, commit=False)
+        self._clear_npcs(game_id, commit=False)
+        self.db.commit()
 
-    def _clear_players_and_messages(self, game_id: int) -> None:
+    def _clear_players_and_messages(self, game_id: int, commit: bool = True) -> None:
         # 刪除所有玩家的訊息
         result = self.db.exec(
             select(Player.id).where(Player.game_id == game_id)
@@ -70,44 +113,187 @@ class MemoryService:
         player_ids = result.all()
         if player_ids:
             self.db.exec(delete(Message).where(Message.player_id.in_(player_ids)))
+            self.db.exec(delete(ConversationSummary).where(ConversationSummary.player_id.in_(player_ids)))
+            conversation_store.forget_players(player_ids)
         # 刪除玩家
         self.db.exec(delete(Player).where(Player.game_id == game_id))
-        self.db.commit()
+        game_versions.touch(self.db, game_id)
+        if commit:
+            self.db.commit()
+
+    def clear_game(self, game_id: int, commit: bool = True) -> None:
+        """
+        完整清空一場遊戲：背景、角色、NPC、玩家及對話（一個 transaction）
+        """
+        self.save_background(game_id, None, commit=False)
+        self._clear_characters(game_id, commit=False)
+        self._clear_npcs(game_id, commit=False)
+        self._clear_players_and_messages(game_id, commit=False)
+        self._clear_locations(game_id, commit=False)
+        if commit:
+            self.db.commit()
+
+    def has_players(self, game_id: int) -> bool:
+        return self.db.exec(select(Player.id).where(Player.game_id == game_id).limit(1)).first() is not None
+
+    def save_world(self, game_id: int, world: Dict[str, Any], commit: bool = True) -> Dict[str, Dict[Any, int]]:
+        """
+        把 generate_full 生成的整個世界（background, characters, npcs, acts, ending, locations）
+        一次寫進 DB：先清空舊的世界內容，批次 insert，NPC 所在地用一個 UPDATE 設定，最後只 commit 一次。
+        commit=False 時由呼叫端 commit（例如同一個 transaction 還要寫冪等紀錄）。
+        已經有玩家加入的遊戲會丟 GameHasPlayers，不會動到玩家與對話紀錄。
+
+        world 裡的 id 是 LLM 端從 1 開始編的，地點的 npcs 與物件的 lock 也是指這些 id，
+        這裡會換成 DB 的 id（lock 指向不存在的 NPC 時改成 None）。回傳 {"characters": {...}, "npcs": {...}, "locations": {...}, "objects": {...}}
+        (生成時的 id -> DB id)；物件的 id 只在所在地點內唯一，key 是 (地點 id, 物件 id)。
+        """
+        game = self.get_game(game_id)
+        if game is None:
+            raise ValueError(f"Game {game_id} not found")
+        if self.has_players(game_id):
+            raise GameHasPlayers(game_id)
+        try:
+            self._clear_characters(game_id, commit=False)
+            self._clear_npcs(game_id, commit=False)
+            self._clear_locations(game_id, commit=False)
+            game.background = world.get("background", game.background)
+            game.acts = list(world.get("acts") or [])
+            game.ending = world.get("ending")
+            self.db.add(game)
+
+            def rows(model, items, fields):
+                local_ids = [item.get("id", i + 1) for i, item in enumerate(items)]
+                objs = [model(game_id=game_id, **{f: item[f] for f in fields if f in item}) for item in items]
+                return local_ids, objs
+
+            char_local, chars = rows(Character, world.get("characters") or [],
+                                     ("name", "role", "public_info", "secret", "mission"))
+            npc_local, npcs = rows(Npc, world.get("npcs") or [], ("name", "description"))
+            loc_local, locations = rows(Location, world.get("locations") or [], ("name",))
+            self.db.add_all(chars + npcs + locations)
+            # flush 一次拿到所有自動編號的 id（SQLite 用 INSERT ... RETURNING 批次寫入）
+            self.db.flush()
+
+            ids = {
+                "characters": {l: c.id for l, c in zip(char_local, chars)},
+                "npcs": {l: n.id for l, n in zip(npc_local, npcs)},
+                "locations": {l: loc.id for l, loc in zip(loc_local, locations)},
+            }
+            npc_ids = ids["npcs"]
+
+            objects = []
+            object_local = []
+            npc_location: Dict[int, int] = {}
+            for loc_ref, loc, location in zip(loc_local, world.get("locations") or [], locations):
+                for npc_ref in loc.get("npcs", []):
+                    if npc_ref in npc_ids:
+                        npc_location[npc_ids[npc_ref]] = location.id
+                for j, obj in enumerate(loc.get("objects", [])):
+                    lock = obj.get("lock")
+                    if lock is not None and lock not in npc_ids:
+                        # 原樣存下來可能剛好是別場遊戲的 NPC，或根本沒有這列，物件就永遠解不開
+                        logger.warning("遊戲 %s 的物件「%s」指向不存在的 NPC %s，改成不上鎖", game_id, obj.get("name"), lock)
+                    object_local.append((loc_ref, obj.get("id", j + 1)))
+                    objects.append(GameObj(
+                        location_id=location.id,
+                        name=obj.get("name"),
+                        lock=npc_ids.get(lock),
+                        clue=obj.get("clue"),
+                    ))
+            self.db.add_all(objects)
+            self.db.flush()
+            ids["objects"] = {l: o.id for l, o in zip(object_local, objects)}
+
+            if npc_location:
+                # set-based：一個 UPDATE 設定所有 NPC 的所在地
+                self.db.exec(
+                    update(Npc)
+                    .where(Npc.id.in_(list(npc_location)))
+                    .values(location_id=case(npc_location, value=Npc.id))
+                )
+            if commit:
+                self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        self._invalidate_game_cache(game_id, commit)
+        return ids
+
+    def get_idempotency(self, key: str) -> Optional[IdempotencyRecord]:
+        return self.db.get(IdempotencyRecord, key)
 
-    def clear_game(self, game_id: int) -> None:
+    def add_idempotency(self, key: str, game_id: int, request_hash: str, response: Dict[str, Any]) -> None:
         """
-        完整清空一場遊戲：背景、角色、NPC、玩家及對話
+        只 add 不 commit，跟 save_world(commit=False) 放在同一個 transaction
         """
-        self.save_background(game_id, None)
-        self._clear_characters(game_id)
-        self._clear_npcs(game_id)
-        self._clear_players_and_messages(game_id)
-        self._clear_locations(game_id)
+        self.db.add(IdempotencyRecord(key=key, game_id=game_id, request_hash=request_hash, response=response))
 
     def assign_player(self, game_id: int, user_id: str, character_id: int) -> Player:
         player = Player(game_id=game_id, user_id=user_id, character_id=character_id)
         self.db.add(player)
+        game_versions.touch(self.db, game_id)
         self.db.commit()
         self.db.refresh(player)
+        # 同一個 player id 之前可能用別的角色（或還沒有角色）建過 instruction
+        chat_context_cache.invalidate_player(game_id, player.id)
         return player
 
-    def append_message(self, player_id: int, role: str, content: str) -> None:
-        msg = Message(player_id=player_id, role=role, content=content)
+    def append_message(self, player_id: int, role: str, content: str, npc_id: Optional[int] = None) -> Message:
+        msg = Message(player_id=player_id, npc_id=npc_id, role=role, content=content)
         self.db.add(msg)
         self.db.commit()
+        self.db.refresh(msg)
+        return msg
 
-    def get_conversation_context(self, player_id: int, limit: int = 20) -> List[Message]:
+    def get_conversation_context(
+        self, player_id: int, limit: int = 20, npc_id: Optional[int] = None
+    ) -> List[Message]:
+        """
+        玩家最後 limit 則訊息（舊到新），有給 npc_id 時只取和該 NPC 的對話
+        """
+        query = select(Message).where(Message.player_id == player_id)
+        if npc_id is not None:
+            query = query.where(Message.npc_id == npc_id)
         result = self.db.exec(
-            select(Message)
-            .where(Message.player_id == player_id)
-            .order_by(Message.timestamp.desc())
+            query
+            .order_by(Message.timestamp.desc(), Message.id.desc())
             .limit(limit)
         )
         return result.all()[::-1]
+
+    def get_messages_after(self, player_id: int, npc_id: Optional[int], after_id: int) -> List[Message]:
+        """
+        id 大於 after_id 的訊息（舊到新），給滾動摘要用
+        """
+        result = self.db.exec(
+            select(Message)
+            .where(Message.player_id == player_id, Message.npc_id == npc_id, Message.id > after_id)
+            .order_by(Message.id)
+        )
+        return result.all()
+
+    def get_summary(self, player_id: int, npc_id: Optional[int]) -> Optional[ConversationSummary]:
+        return self.db.exec(
+            select(ConversationSummary)
+            .where(ConversationSummary.player_id == player_id, ConversationSummary.npc_id == npc_id)
+        ).first()
+
+    def save_summary(self, player_id: int, npc_id: Optional[int], content: str, covered_until: int) -> ConversationSummary:
+        summary = self.get_summary(player_id, npc_id)
+        if summary is None:
+            summary = ConversationSummary(player_id=player_id, npc_id=npc_id, content=content, covered_until=covered_until)
+        else:
+            summary.content = content
+            summary.covered_until = covered_until
+            summary.updated_at = datetime.datetime.now()
+        self.db.add(summary)
+        self.db.commit()
+        self.db.refresh(summary)
+        return summary
     
     # 以下為地點與物件的處理
 
-    def _clear_locations(self, game_id: int) -> None:
+    def _clear_locations(self, game_id: int, commit: bool = True) -> None:
         # 先刪除所有物件，再刪除地點
         self.db.exec(delete(GameObj).where(
             GameObj.location_id.in_(
@@ -115,32 +301,39 @@ class MemoryService:
             )
         ))
         self.db.exec(delete(Location).where(Location.game_id == game_id))
-        self.db.commit()
+        game_versions.touch(self.db, game_id)
+        if commit:
+            self.db.commit()
 
     def save_locations(self, game_id: int, locations: List[Dict[str, Any]]) -> None:
-        self._clear_locations(game_id)
-        for loc in locations:
-            # 建立地點
-            location = Location(game_id=game_id, name=loc["name"])
-            self.db.add(location)
-            self.db.commit()
-            self.db.refresh(location)
-            # 更新 NPC 所在地
+        # 地點裡的 npcs 是 DB 的 NPC id；整批在同一個 transaction 裡寫入
+        self._clear_locations(game_id, commit=False)
+        rows = [Location(game_id=game_id, name=loc["name"]) for loc in locations]
+        self.db.add_all(rows)
+        self.db.flush()
+
+        npc_location: Dict[int, int] = {}
+        objects = []
+        for loc, location in zip(locations, rows):
             for npc_id in loc.get("npcs", []):
-                npc = self.db.get(Npc, npc_id)
-                if npc:
-                    npc.location_id = location.id
-                    self.db.add(npc)
+                npc_location[npc_id] = location.id
             # 建立該地點物件
             for obj in loc.get("objects", []):
-                game_obj = GameObj(
+                objects.append(GameObj(
                     location_id=location.id,
                     name=obj.get("name"),
                     lock=obj.get("lock"),
                     clue=obj.get("clue"),
                     owner_id=obj.get("owner_id"),
-                )
-                self.db.add(game_obj)
+                ))
+        self.db.add_all(objects)
+        # 更新 NPC 所在地：一個 UPDATE，不存在或不屬於這場遊戲的 NPC 自然不會被改到
+        if npc_location:
+            self.db.exec(
+                update(Npc)
+                .where(Npc.game_id == game_id, Npc.id.in_(list(npc_location)))
+                .values(location_id=case(npc_location, value=Npc.id))
+            )
         self.db.commit()
 
     def get_locations(self, game_id: int) -> List[Location]:
@@ -148,3 +341,66 @@ class MemoryService:
             select(Location).where(Location.game_id == game_id)
         )
         return result.all()
+
+    def unlock_objects(self, game_id: int, player_id: int, object_ids: List[int]) -> Dict[int, str]:
+        """
+        玩家解鎖物件（可一次多個）。一個條件式 UPDATE 做 compare-and-set：
+        只有 owner_id 還是 NULL、屬於這場遊戲、且玩家跟 lock 的 NPC 說過話的物件才會寫入，
+        很多人同時搶同一個物件時只有一個人的 UPDATE 會改到那一列。
+
+        UPDATE 必須是 transaction 的第一個語句：先讀再寫的 transaction 在 SQLite WAL 下
+        升級成寫入時會直接失敗，不會等 busy_timeout。
+        回傳 object_id -> "unlocked" | "already_owned" | "taken" | "locked" | "not_found"
+        """
+        ids = list(dict.fromkeys(object_ids))
+        in_game = select(Location.id).where(Location.game_id == game_id)
+        is_member = exists().where(Player.id == player_id, Player.game_id == game_id)
+        talked = exists().where(
+            Message.player_id == player_id,
+            Message.npc_id == GameObj.lock,
+            Message.role == "user",
+        )
+        try:
+            won = set(self.db.exec(
+                update(GameObj)
+                .where(
+                    GameObj.id.in_(ids),
+                    GameObj.owner_id.is_(None),
+                    GameObj.location_id.in_(in_game),
+                    or_(GameObj.lock.is_(None), talked),
+                    is_member,
+                )
+                .values(owner_id=player_id)
+                .returning(GameObj.id)
+            ).scalars().all())
+            if not won:
+                # 有搶到代表 is_member 成立；一個都沒有時才需要分辨是不是玩家不對
+                player = self.db.get(Player, player_id)
+                if player is None or player.game_id != game_id:
+                    raise ValueError(f"Player {player_id} not found in game {game_id}")
+
+            # 沒搶到的再查一次原因（已經拿著寫入鎖，不會再被改）
+            owners = dict(self.db.exec(
+                select(GameObj.id, GameObj.owner_id)
+                .where(GameObj.id.in_([i for i in ids if i not in won]), GameObj.location_id.in_(in_game))
+            ).all())
+            if won:
+                game_versions.touch(self.db, game_id)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        result: Dict[int, str] = {}
+        for object_id in ids:
+            if object_id in won:
+                result[object_id] = "unlocked"
+            elif object_id not in owners:
+                result[object_id] = "not_found"
+            elif owners[object_id] == player_id:
+                result[object_id] = "already_owned"
+            elif owners[object_id] is not None:
+                result[object_id] = "taken"
+            else:
+                result[object_id] = "locked"
+        return result
@@ -0,0 +1,234 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 不另外裝 prometheus_client：這裡只需要 counter 與 histogram，
+# 自己輸出 Prometheus text format (0.0.4) 就夠了
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [各 bucket 的次數（非累積）..., +Inf, sum, count]
+        self._series: Dict[Labels, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 3)
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels: Any) -> int:
+        series = self._series.get(tuple(str(labels.get(n, "")) for n in self.labelnames))
+        return int(series[-1]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0.0
+                for bound, n in zip(list(self.buckets) + [float("inf")], series):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else _format_value(bound)
+                    labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                    lines.append(f"{self.name}_bucket{labels} {_format_value(cumulative)}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+                lines.append(f"{self.name}_count{labels} {_format_value(series[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP 請求耗時（串流算到最後一段送出）", ["method", "route", "status"])
+http_request_db_seconds = registry.histogram(
+    "http_request_db_seconds", "單一 HTTP 請求裡所有 DB query 的總耗時", ["route"])
+db_query_seconds = registry.histogram(
+    "db_query_duration_seconds", "單一 DB query 耗時", ["operation"])
+llm_stage_seconds = registry.histogram(
+    "llm_stage_duration_seconds", "各 LLM 任務的 queue / llm / parse 耗時", ["stage", "phase"])
+llm_tokens = registry.histogram(
+    "llm_tokens", "每次 LLM 呼叫的 token 數", ["stage", "model", "kind"], buckets=TOKEN_BUCKETS)
+llm_tokens_total = registry.counter(
+    "llm_tokens_total", "LLM token 累計", ["stage", "model", "kind"])
+llm_calls_total = registry.counter(
+    "llm_calls_total", "LLM 呼叫次數", ["stage", "model", "outcome"])
+
+
+def observe_stage(stage: Optional[str], phase: str, seconds: float) -> None:
+    if METRICS_ENABLED:
+        llm_stage_seconds.observe(seconds, stage=stage or "other", phase=phase)
+
+
+@contextmanager
+def stage_timer(stage: Optional[str], phase: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, phase, time.perf_counter() - start)
+
+
+def record_usage(stage: Optional[str], model: str, usage: Any) -> None:
+    """
+    從 Gemini 回應的 usage_metadata 記錄 prompt / output / cached token 數
+    """
+    if not METRICS_ENABLED or usage is None:
+        return
+    for kind, attr in (("prompt", "prompt_token_count"),
+                       ("output", "candidates_token_count"),
+                       ("cached", "cached_content_token_count")):
+        count = getattr(usage, attr, None)
+        if count:
+            llm_tokens.observe(count, stage=stage or "other", model=model, kind=kind)
+            llm_tokens_total.inc(count, stage=stage or "other", model=model, kind=kind)
+
+
+# 目前這個 HTTP 請求累計的 DB 時間（middleware 設定，DB event 累加）
+_request_db_time: contextvars.ContextVar[Optional[List[float]]] = contextvars.ContextVar("request_db_time", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if METRICS_ENABLED:
+        db_query_seconds.observe(elapsed, operation=(statement.lstrip().split(None, 1) or ["?"])[0].upper())
+    total = _request_db_time.get()
+    if total is not None:
+        total[0] += elapsed
+
+
+def instrument_engine(engine: Any) -> None:
+    """
+    給 sync engine（或 async engine 的 sync_engine）掛上 DB 計時
+    """
+    from sqlalchemy import event
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _route_template(scope) -> str:
+    # 較新的 FastAPI 在 scope["route"] 放的是 include 前的 route（沒有 /api 前綴），
+    # 完整樣板在 effective_route_context 裡
+    context = (scope.get("fastapi") or {}).get("effective_route_context")
+    path = getattr(context, "path", None) or getattr(scope.get("route"), "path", None)
+    return path or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    純 ASGI middleware（不用 BaseHTTPMiddleware，串流不會被緩衝）：
+    記錄每個 route 的耗時與其中的 DB 時間，route 用路徑樣板（/api/games/{game_id}/npcs）避免標籤爆量
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        db_time = [0.0]
+        token = _request_db_time.set(db_time)
+        status = {"code": 500}
+
+        async def send_wrapper(message) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_db_time.reset(token)
+            path = _route_template(scope)
+            http_request_seconds.observe(
+                time.perf_counter() - start, method=scope["method"], route=path, status=status["code"])
+            http_request_db_seconds.observe(db_time[0], route=path)
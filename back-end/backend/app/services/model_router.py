@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .llm_resilience import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+LLM_MODEL_PRIMARY = os.getenv("LLM_MODEL_PRIMARY", "gemini-2.0-flash")
+LLM_MODEL_FALLBACK = os.getenv("LLM_MODEL_FALLBACK", "gemini-2.0-flash-lite")
+# p95 至少要有幾筆樣本才判斷是否超過 SLO
+LLM_ROUTE_MIN_SAMPLES = int(os.getenv("LLM_ROUTE_MIN_SAMPLES", "10"))
+# 超過 SLO 後改走較快的模型多久（秒），之後再回主模型重新量測
+LLM_ROUTE_COOLDOWN = float(os.getenv("LLM_ROUTE_COOLDOWN", "120"))
+
+
+@dataclass(frozen=True)
+class Route:
+    primary: str
+    fallback: str              # 較快（通常較便宜）的模型
+    temperature: float
+    max_tokens: Optional[int]  # None 表示不限制
+    slo_seconds: float         # 單次呼叫 p95 的目標
+
+
+def _route(task: str, temperature: float, max_tokens: Optional[int], slo_seconds: float) -> Route:
+    """
+    每個任務都可以用 LLM_ROUTE_<TASK>_PRIMARY / _FALLBACK / _SLO 覆寫
+    """
+    prefix = f"LLM_ROUTE_{task.upper()}_"
+    return Route(
+        primary=os.getenv(prefix + "PRIMARY", LLM_MODEL_PRIMARY),
+        fallback=os.getenv(prefix + "FALLBACK", LLM_MODEL_FALLBACK),
+        temperature=temperature,
+        max_tokens=max_tokens,
+        slo_seconds=float(os.getenv(prefix + "SLO", str(slo_seconds))),
+    )
+
+
+DEFAULT_ROUTES: Dict[str, Route] = {
+    "background": _route("background", 0.7, 300, 8),
+    "characters": _route("characters", 0.7, None, 15),
+    "npcs":       _route("npcs", 0.7, None, 15),
+    "scenes":     _route("scenes", 0.7, 3000, 20),      # 每一幕各自一次呼叫
+    "locations":  _route("locations", 0.7, 2000, 20),
+    "chat":       _route("chat", 0.7, 500, 5),
+    "summary":    _route("summary", 0.3, 400, 10),
+}
+
+
+class ModelRouter:
+    """
+    依任務決定模型與預設參數，並根據實際延遲調整：
+    主模型的 p95 超過該任務的 SLO，就在 cooldown 期間改用 fallback；
+    cooldown 結束後回到主模型、重新累積樣本。呼叫端明確指定 model 時照用。
+    """
+
+    def __init__(
+        self,
+        routes: Optional[Dict[str, Route]] = None,
+        min_samples: int = LLM_ROUTE_MIN_SAMPLES,
+        cooldown: float = LLM_ROUTE_COOLDOWN,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.routes = dict(routes or DEFAULT_ROUTES)
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self.clock = clock
+        self._latency: Dict[Tuple[str, str], LatencyTracker] = {}
+        self._degraded_until = {task: 0.0 for task in self.routes}
+        self.stats_counters: Dict[str, Dict[str, int]] = {
+            task: {"primary": 0, "fallback": 0, "explicit": 0, "switches": 0} for task in self.routes
+        }
+
+    def degraded(self, task: str) -> bool:
+        return self.clock() < self._degraded_until.get(task, 0.0)
+
+    def current_model(self, task: str) -> str:
+        route = self.routes[task]
+        return route.fallback if self.degraded(task) else route.primary
+
+    def resolve(
+        self,
+        task: str,
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> Tuple[str, float, Optional[int]]:
+        """
+        補上沒指定的 model / temperature / max_tokens
+        """
+        route = self.routes[task]
+        if model is None:
+            model = self.current_model(task)
+            self.stats_counters[task]["fallback" if model != route.primary else "primary"] += 1
+        else:
+            self.stats_counters[task]["explicit"] += 1
+        return (
+            model,
+            route.temperature if temperature is None else temperature,
+            route.max_tokens if max_tokens is None else max_tokens,
+        )
+
+    def _tracker(self, task: str, model: str) -> LatencyTracker:
+        return self._latency.setdefault((task, model), LatencyTracker(size=50))
+
+    def record(self, task: Optional[str], model: str, seconds: float) -> None:
+        if task not in self.routes:
+            return
+        tracker = self._tracker(task, model)
+        tracker.record(seconds)
+        route = self.routes[task]
+        if model != route.primary or route.fallback == route.primary or self.degraded(task):
+            return
+        p95 = tracker.percentile(0.95)
+        if len(tracker) >= self.min_samples and p95 > route.slo_seconds:
+            logger.warning(
+                "%s 的 p95 %.1fs 超過 SLO %.1fs，%.0f 秒內改用 %s",
+                task, p95, route.slo_seconds, self.cooldown, route.fallback,
+            )
+            self._degraded_until[task] = self.clock() + self.cooldown
+            self.stats_counters[task]["switches"] += 1
+            # 回到主模型時重新量測，不被這段慢的樣本影響
+            self._latency[(task, model)] = LatencyTracker(size=50)
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for task, route in self.routes.items():
+            latency = {}
+            for model in {route.primary, route.fallback}:
+                tracker = self._latency.get((task, model))
+                p95 = tracker.percentile(0.95) if tracker else None
+                latency[model] = {
+                    "samples": len(tracker) if tracker else 0,
+                    "p95": round(p95, 3) if p95 is not None else None,
+                }
+            out[task] = {
+                **self.stats_counters[task],
+                "primary_model": route.primary,
+                "fallback_model": route.fallback,
+                "active_model": self.current_model(task),
+                "slo_seconds": route.slo_seconds,
+                "degraded_seconds_left": round(max(self._degraded_until[task] - self.clock(), 0), 1),
+                "latency": latency,
+            }
+        return out
+
+
+model_router = ModelRouter()
@@ -0,0 +1,102 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from .game_versions import game_versions
+
+# 最多快取幾份序列化好的 response body
+READ_CACHE_SIZE = int(os.getenv("READ_CACHE_SIZE", "512"))
+
+Key = Tuple[str, int, int]   # (route, game_id, version)
+
+
+def if_none_match(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [t.strip() for t in header.split(",")]
+
+
+class ReadCache:
+    """
+    遊戲相關 GET API 的讀取快取：以 (route, game_id, 版本) 為 key 存序列化好的 JSON bytes。
+    版本由 game_versions 提供（MemoryService 寫入 commit 後 +1），所以不需要主動作廢，
+    舊版本的 entry 會被 LRU 擠掉。
+
+    - If-None-Match 符合 -> 304，不查 DB、不序列化
+    - 快取命中 -> 直接回 bytes，不查 DB
+    - 沒命中 -> 呼叫 load() 查 DB，序列化後存起來
+    """
+
+    def __init__(self, max_entries: int = READ_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Key, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counters = {"hits": 0, "misses": 0, "not_modified": 0}
+
+    def get(self, key: Key) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def set(self, key: Key, body: bytes) -> None:
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    async def respond(
+        self,
+        request: Request,
+        route: str,
+        game_id: int,
+        load: Callable[[int], Awaitable[Any]],
+        viewer: Optional[int] = None,
+    ) -> Response:
+        """
+        load(version) 回傳要序列化的資料；找不到資源時直接 raise HTTPException（不會被快取）。
+        回應內容依玩家而不同時帶 viewer（玩家 id），每個玩家的快取與 ETag 分開。
+        """
+        # 先拿版本再查資料：查詢途中有寫入，最多是下次多回一次 200
+        version = game_versions.get(game_id)
+        etag = game_versions.etag(game_id, version, viewer)
+        if viewer is not None:
+            route = f"{route}:p{viewer}"
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if if_none_match(request, etag):
+            self.stats_counters["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+
+        key = (route, game_id, version)
+        body = self.get(key)
+        if body is not None:
+            self.stats_counters["hits"] += 1
+            return Response(body, media_type="application/json", headers=headers)
+
+        self.stats_counters["misses"] += 1
+        response = JSONResponse(jsonable_encoder(await load(version)), headers=headers)
+        self.set(key, response.body)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        s: Dict[str, Any] = dict(self.stats_counters)
+        s["entries"] = len(self._entries)
+        s["max_entries"] = self.max_entries
+        total = s["hits"] + s["misses"] + s["not_modified"]
+        s["db_free_ratio"] = round((s["hits"] + s["not_modified"]) / total, 3) if total else None
+        return s
+
+
+read_cache = ReadCache()
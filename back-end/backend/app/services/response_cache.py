@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Protocol, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 背景與世界生成的 LLM 回應快取
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))      # 秒
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "256"))   # 記憶體 LRU 最多幾筆
+LLM_CACHE_DISK_SIZE = int(os.getenv("LLM_CACHE_DISK_SIZE", "5000"))      # SQLite 最多幾筆
+# 預設放在 back-end/data/（和 .env 同一層），不跟著啟動時的工作目錄跑；空字串代表不開磁碟層
+basedir = os.path.dirname(os.path.dirname(__file__))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(basedir, "..", "data", "llm_cache.db"))
+
+Entry = Tuple[str, float]   # (回應文字, 到期時間)
+
+
+def cache_key(model: str, contents: Any, config: Any = None) -> str:
+    """
+    由模型、prompt 與取樣參數（整個 GenerateContentConfig）算出快取 key
+    """
+    def plain(value: Any) -> Any:
+        if hasattr(value, "model_dump"):
+            return value.model_dump(mode="json", exclude_none=True)
+        if isinstance(value, (list, tuple)):
+            return [plain(v) for v in value]
+        return value
+
+    raw = json.dumps(
+        {"model": model, "contents": plain(contents), "config": plain(config)},
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CacheTier(Protocol):
+    name: str
+
+    def get(self, key: str) -> Optional[Entry]: ...
+    def set(self, key: str, value: str, expires_at: float) -> int: ...   # 回傳被淘汰的筆數
+    def delete(self, key: str) -> None: ...
+    def clear(self) -> None: ...
+    def size(self) -> int: ...
+
+
+class MemoryTier:
+    """
+    行程內的 LRU
+    """
+    name = "memory"
+
+    def __init__(self, max_entries: int = LLM_CACHE_MEMORY_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, value: str, expires_at: float) -> int:
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class SqliteTier:
+    """
+    存在獨立 SQLite 檔案的磁碟層，重啟後仍然有效；超過上限時淘汰最久沒用到的。
+    每次讀寫都會 commit，所以 ResponseCache 在 event loop 上一律透過 aget/aset 丟到 thread 執行
+    """
+    name = "disk"
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_DISK_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # 第一次用到才開檔，import 時不會在磁碟上建任何東西
+        if self._db is None:
+            self._db = self._open()
+        return self._db
+
+    def _open(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        # 和主資料庫一樣用 WAL，commit 不必每次都 fsync
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_response_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_llm_response_cache_last_used ON llm_response_cache (last_used)"
+        )
+        conn.commit()
+        return conn
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE llm_response_cache SET last_used = ? WHERE key = ?", (time.time(), key)
+                )
+                self._conn.commit()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, value: str, expires_at: float) -> int:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_response_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, time.time()),
+            )
+            # 先清過期的，還是超過上限再依 last_used 淘汰
+            cur = self._conn.execute("DELETE FROM llm_response_cache WHERE expires_at <= ?", (time.time(),))
+            evicted = cur.rowcount
+            cur = self._conn.execute(
+                "DELETE FROM llm_response_cache WHERE key IN ("
+                " SELECT key FROM llm_response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            evicted += cur.rowcount
+            self._conn.commit()
+        return evicted
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_response_cache")
+            self._conn.commit()
+
+    def size(self) -> int:
+        with self._lock:
+            if self._db is None and not os.path.exists(self.path):
+                return 0
+            return self._conn.execute("SELECT COUNT(*) FROM llm_response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """
+    LLM 回應快取：依序查各層（記憶體 -> 磁碟），下層命中時回填上層。
+    只存回應文字，給背景與世界生成這類「同樣輸入、同樣結果也沒關係」的呼叫用；
+    NPC 對話不走這裡。
+    """
+
+    def __init__(self, tiers: List[CacheTier], ttl: int = LLM_CACHE_TTL, enabled: bool = True):
+        self.tiers = tiers
+        self.ttl = ttl
+        self.enabled = enabled and bool(tiers)
+        self._lock = threading.Lock()
+        self.stats_counters: Dict[str, int] = {
+            "hits": 0,
+            "misses": 0,
+            "bypass": 0,
+            "stores": 0,
+            "expired": 0,
+            "evictions": 0,
+            **{f"{t.name}_hits": 0 for t in tiers},
+        }
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats_counters[name] += n
+
+    def record_bypass(self) -> None:
+        self._count("bypass")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        for i, tier in enumerate(self.tiers):
+            try:
+                entry = tier.get(key)
+            except Exception as e:
+                logger.warning("LLM 回應快取 %s 讀取失敗: %s", tier.name, e)
+                continue
+            if entry is None:
+                continue
+            value, expires_at = entry
+            if expires_at <= now:
+                tier.delete(key)
+                self._count("expired")
+                continue
+            for upper in self.tiers[:i]:
+                self._count("evictions", upper.set(key, value, expires_at))
+            self._count("hits")
+            self._count(f"{tier.name}_hits")
+            return value
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        for tier in self.tiers:
+            try:
+                self._count("evictions", tier.set(key, value, expires_at))
+            except Exception as e:
+                logger.warning("LLM 回應快取 %s 寫入失敗: %s", tier.name, e)
+        self._count("stores")
+
+    async def aget(self, key: str) -> Optional[str]:
+        """
+        給 async 呼叫端用的 get：磁碟層的讀取與 commit 丟到 thread 裡做，不卡住 event loop
+        """
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    def clear(self) -> None:
+        for tier in self.tiers:
+            tier.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self.stats_counters)
+        lookups = (s["hits"] + s["misses"]) or 1
+        s["hit_ratio"] = round(s["hits"] / lookups, 3)
+        s["enabled"] = self.enabled
+        s["entries"] = {t.name: t.size() for t in self.tiers}
+        return s
+
+
+def _default_tiers() -> List[CacheTier]:
+    tiers: List[CacheTier] = [MemoryTier(LLM_CACHE_MEMORY_SIZE)]
+    if LLM_CACHE_PATH:
+        try:
+            tiers.append(SqliteTier(LLM_CACHE_PATH, LLM_CACHE_DISK_SIZE))
+        except sqlite3.Error as e:
+            logger.warning("無法開啟 LLM 回應快取檔 %s，只用記憶體快取: %s", LLM_CACHE_PATH, e)
+    return tiers
+
+
+response_cache = ResponseCache(_default_tiers(), enabled=LLM_CACHE_ENABLED)
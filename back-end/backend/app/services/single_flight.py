@@ -0,0 +1,49 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    相同的請求同時只真的執行一次：第一個呼叫的人啟動，之後同一個 key 的呼叫
+    在它完成前都等同一份結果（成功或例外都一樣）。
+
+    實際的呼叫放在獨立的 task 裡，發起的那個請求被取消（例如前端斷線）
+    也不會連帶取消其他還在等的人。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, "asyncio.Task[Any]"] = {}
+        self._waiters: Dict[str, int] = {}
+        self.stats_counters = {"executed": 0, "coalesced": 0, "errors": 0, "max_waiters": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            # 建 task 時會複製目前的 contextvars（llm_context 的優先級跟著走）
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self._waiters[key] = 0
+            self.stats_counters["executed"] += 1
+            task.add_done_callback(lambda t, key=key: self._finish(key, t))
+        else:
+            self.stats_counters["coalesced"] += 1
+        self._waiters[key] += 1
+        self.stats_counters["max_waiters"] = max(self.stats_counters["max_waiters"], self._waiters[key])
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: "asyncio.Task[Any]") -> None:
+        self._calls.pop(key, None)
+        self._waiters.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.stats_counters["errors"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        s: Dict[str, Any] = dict(self.stats_counters)
+        s["in_flight"] = len(self._calls)
+        s["waiting_now"] = sum(self._waiters.values())
+        total = s["executed"] + s["coalesced"]
+        s["coalescing_ratio"] = round(s["coalesced"] / total, 3) if total else None
+        return s
+
+
+llm_single_flight = SingleFlight()
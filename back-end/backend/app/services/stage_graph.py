@@ -0,0 +1,155 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+# 每個 stage 是一個 async 函式，參數名稱 = 它依賴的 stage 名稱
+StageFunc = Callable[..., Awaitable[Any]]
+
+
+@dataclass
+class Stage:
+    name: str
+    func: StageFunc
+    deps: List[str] = field(default_factory=list)
+
+
+@dataclass
+class StageTiming:
+    name: str
+    started_at: float   # 相對於整張圖開始執行的秒數
+    finished_at: float
+
+    @property
+    def duration(self) -> float:
+        return self.finished_at - self.started_at
+
+
+@dataclass
+class StageRun:
+    results: Dict[str, Any]
+    timings: Dict[str, StageTiming]
+    total: float        # 整張圖的 wall-clock 秒數
+
+    def server_timing(self) -> str:
+        """
+        轉成 HTTP Server-Timing header 的格式（毫秒）
+        """
+        parts = [f"{t.name};dur={t.duration * 1000:.1f}" for t in self.timings.values()]
+        parts.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+class StageGraph:
+    """
+    小型的 stage 依賴圖執行器：
+    每個 stage 在它的依賴都完成後立刻開始，互不相依的 stage 會同時執行，
+    整體耗時 = 最長的依賴鏈，而不是所有 stage 相加。
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, Stage] = {}
+
+    def add(self, name: str, func: StageFunc, deps: Sequence[str] = ()) -> "StageGraph":
+        if name in self._stages:
+            raise ValueError(f"stage 名稱重複：{name}")
+        self._stages[name] = Stage(name=name, func=func, deps=list(deps))
+        return self
+
+    @property
+    def stages(self) -> List[str]:
+        return list(self._stages)
+
+    def _topological_order(self) -> List[str]:
+        order: List[str] = []
+        state: Dict[str, int] = {}   # 1 = 走訪中, 2 = 完成
+
+        def visit(name: str, path: List[str]) -> None:
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                raise ValueError(f"stage 依賴出現循環：{' -> '.join(path + [name])}")
+            stage = self._stages.get(name)
+            if stage is None:
+                raise ValueError(f"未知的 stage 依賴：{path[-1]} -> {name}")
+            state[name] = 1
+            for dep in stage.deps:
+                visit(dep, path + [name])
+            state[name] = 2
+            order.append(name)
+
+        for name in self._stages:
+            visit(name, [])
+        return order
+
+    async def run(
+        self,
+        on_complete: Optional[Callable[[str, Any, StageTiming], None]] = None,
+    ) -> StageRun:
+        """
+        執行整張圖。任一 stage 失敗時取消其他還在跑的 stage，並把例外往外丟。
+        on_complete(name, result, timing) 會在每個 stage 完成時被呼叫。
+        """
+        order = self._topological_order()
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        results: Dict[str, Any] = {}
+        timings: Dict[str, StageTiming] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage) -> Any:
+            if stage.deps:
+                await asyncio.gather(*(tasks[d] for d in stage.deps))
+            started = loop.time() - t0
+            result = await stage.func(**{d: results[d] for d in stage.deps})
+            timing = StageTiming(stage.name, started, loop.time() - t0)
+            timings[stage.name] = timing
+            results[stage.name] = result
+            if on_complete is not None:
+                on_complete(stage.name, result, timing)
+            return result
+
+        # 依拓撲順序建立 task，確保依賴的 task 一定先存在
+        for name in order:
+            tasks[name] = asyncio.create_task(run_stage(self._stages[name]), name=f"stage:{name}")
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        # 依加入順序排好 timings，方便閱讀
+        ordered = {name: timings[name] for name in self._stages}
+        return StageRun(results=results, timings=ordered, total=loop.time() - t0)
+
+    async def iter_completed(self) -> AsyncIterator[Tuple[str, Any, StageTiming]]:
+        """
+        邊跑邊吐結果：每個 stage 一完成就 yield (name, result, timing)。
+        呼叫端中途停止迭代（例如 client 斷線）時，會取消還在跑的 stage。
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+
+        async def drive():
+            try:
+                await self.run(on_complete=lambda *event: queue.put_nowait(event))
+            except BaseException as e:
+                queue.put_nowait((finished, e))
+                raise
+            queue.put_nowait((finished, None))
+
+        runner = asyncio.create_task(drive())
+        try:
+            while True:
+                event = await queue.get()
+                if event[0] is finished:
+                    if event[1] is not None:
+                        raise event[1]
+                    return
+                yield event
+        finally:
+            if not runner.done():
+                runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
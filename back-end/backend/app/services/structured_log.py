@@ -0,0 +1,21 @@
+import os
+import json
+import random
+import logging
+from typing import Any, Optional
+
+# DEBUG / INFO 的結構化 log 只記一部分，避免熱路徑每次都寫；WARNING 以上一定記
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+
+def log_event(logger: logging.Logger, level: int, event: str, sample: Optional[float] = None, **fields: Any) -> None:
+    """
+    一行一個事件：`event {"欄位": 值, ...}`，方便用 grep / jq 分析。
+    只放 id、長度、耗時之類的欄位，不要放整段對話或角色秘密。
+    """
+    if not logger.isEnabledFor(level):
+        return
+    rate = LOG_SAMPLE_RATE if sample is None else sample
+    if level < logging.WARNING and rate < 1 and random.random() >= rate:
+        return
+    logger.log(level, "%s %s", event, json.dumps(fields, ensure_ascii=False, default=str))
@@ -0,0 +1,169 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 要預先生成的熱門主題，逗號分隔；空字串代表不開 pool
+WORLD_POOL_THEMES = [t.strip() for t in os.getenv("WORLD_POOL_THEMES", "").split(",") if t.strip()]
+WORLD_POOL_SIZE = int(os.getenv("WORLD_POOL_SIZE", "2"))                    # 每個主題保留幾個現成世界
+WORLD_POOL_CONCURRENCY = int(os.getenv("WORLD_POOL_CONCURRENCY", "2"))      # 同時補貨幾個世界
+WORLD_POOL_MAX_AGE = int(os.getenv("WORLD_POOL_MAX_AGE", str(24 * 3600)))   # 秒，超過就丟掉重生
+WORLD_POOL_REFILL_INTERVAL = float(os.getenv("WORLD_POOL_REFILL_INTERVAL", "30"))   # 秒，定期檢查的間隔
+
+WorldGenerator = Callable[[str], Awaitable[Dict[str, Any]]]
+
+
+@dataclass
+class PooledWorld:
+    theme: str
+    world: Dict[str, Any]
+    created_at: float
+
+
+class WorldPool:
+    """
+    預先生成好的完整世界（背景、角色、NPC、幕、結局、地點），依主題分池。
+    背景 worker 會把每個主題補到 target_size；新房間 claim 時直接拿走一個，
+    不用等五次 LLM 呼叫。被拿走或過期時會叫醒 worker 補貨。
+    """
+
+    def __init__(
+        self,
+        themes: List[str] = WORLD_POOL_THEMES,
+        target_size: int = WORLD_POOL_SIZE,
+        refill_concurrency: int = WORLD_POOL_CONCURRENCY,
+        max_age: float = WORLD_POOL_MAX_AGE,
+        refill_interval: float = WORLD_POOL_REFILL_INTERVAL,
+    ):
+        self.themes = list(themes)
+        self.target_size = target_size
+        self.refill_concurrency = refill_concurrency
+        self.max_age = max_age
+        self.refill_interval = refill_interval
+        self._ready: Dict[str, Deque[PooledWorld]] = {t: deque() for t in self.themes}
+        self._in_flight: Dict[str, int] = {t: 0 for t in self.themes}
+        self._generate: Optional[WorldGenerator] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._stopping = False
+        self.stats_counters: Dict[str, float] = {
+            "claims": 0,
+            "hits": 0,
+            "misses": 0,
+            "generated": 0,
+            "failures": 0,
+            "expired": 0,
+            "generation_seconds": 0.0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def start(self, generate: WorldGenerator) -> None:
+        """
+        啟動補貨 worker（需在 event loop 裡呼叫）；沒有設定主題時什麼都不做
+        """
+        if not self.themes or self.target_size <= 0 or self.running:
+            return
+        self._generate = generate
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._sem = asyncio.Semaphore(max(self.refill_concurrency, 1))
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        # wait_for 剛好完成時可能吞掉 cancel，所以另外用旗標讓 worker 結束
+        self._stopping = True
+        tasks = list(self._tasks)
+        if self._worker is not None:
+            tasks.append(self._worker)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker = None
+
+    def claim(self, theme: str) -> Optional[Dict[str, Any]]:
+        """
+        拿走一個現成的世界；這個主題沒有可用的就回傳 None
+        """
+        theme = theme.strip()
+        self.stats_counters["claims"] += 1
+        self._drop_stale()
+        ready = self._ready.get(theme)
+        world = ready.popleft().world if ready else None
+        self.stats_counters["hits" if world is not None else "misses"] += 1
+        if theme in self._ready:
+            self._kick()
+        return world
+
+    def _kick(self) -> None:
+        if self._wake is not None:
+            self._wake.set()
+
+    def _drop_stale(self) -> None:
+        cutoff = time.time() - self.max_age
+        for ready in self._ready.values():
+            while ready and ready[0].created_at < cutoff:
+                ready.popleft()
+                self.stats_counters["expired"] += 1
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            self._drop_stale()
+            self._refill()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _refill(self) -> None:
+        loop = asyncio.get_running_loop()
+        for theme in self.themes:
+            missing = self.target_size - len(self._ready[theme]) - self._in_flight[theme]
+            for _ in range(max(missing, 0)):
+                self._in_flight[theme] += 1
+                task = loop.create_task(self._fill_one(theme))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _fill_one(self, theme: str) -> None:
+        try:
+            async with self._sem:
+                start = time.perf_counter()
+                world = await self._generate(theme)
+                self.stats_counters["generation_seconds"] += time.perf_counter() - start
+            self._ready[theme].append(PooledWorld(theme=theme, world=world, created_at=time.time()))
+            self.stats_counters["generated"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 失敗就等下一輪定期檢查再補，不立刻重試
+            self.stats_counters["failures"] += 1
+            logger.warning("預先生成世界失敗 theme=%s: %s", theme, e)
+        finally:
+            self._in_flight[theme] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        s: Dict[str, Any] = dict(self.stats_counters)
+        generated = s["generated"] or 1
+        s["avg_generation_seconds"] = round(s.pop("generation_seconds") / generated, 2)
+        s["hit_ratio"] = round(s["hits"] / (s["claims"] or 1), 3)
+        s["running"] = self.running
+        s["target_size"] = self.target_size
+        s["themes"] = {
+            t: {"ready": len(self._ready[t]), "generating": self._in_flight[t]}
+            for t in self.themes
+        }
+        return s
+
+
+world_pool = WorldPool()
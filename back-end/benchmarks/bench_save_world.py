@@ -0,0 +1,132 @@
+"""
+比較「逐筆 commit」與 MemoryService.save_world（單一 transaction）存一整個世界的 commit 數與耗時。
+
+    cd back-end
+    python -m benchmarks.bench_save_world --rounds 20 --locations 6 --npcs 5
+
+用暫存的 SQLite 檔（不是 :memory:），才量得到每次 commit 的 fsync 成本。
+"""
+import os
+import time
+import argparse
+import tempfile
+import statistics
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+from sqlalchemy import event
+from sqlmodel import Session, delete, select
+
+from backend.app.database import engine, init_db
+from backend.app.models import Character, Game, GameObj, Location, Npc
+from backend.app.services.memory_services import MemoryService
+
+
+def make_world(num_characters: int, num_npcs: int, num_locations: int, objects_per_location: int) -> dict:
+    return {
+        "background": "雨夜的莊園，" * 20,
+        "characters": [
+            {"id": i + 1, "name": f"角色{i}", "role": "嫌疑人", "public_info": "你是…" * 10,
+             "secret": "秘密" * 10, "mission": "任務" * 10}
+            for i in range(num_characters)
+        ],
+        "npcs": [{"id": i + 1, "name": f"NPC{i}", "description": "路人" * 10} for i in range(num_npcs)],
+        "acts": [{"act_number": 1, "scripts": [{"character": "角色0", "dialogue": "……"}]}],
+        "ending": "兇手是管家",
+        "locations": [
+            {
+                "id": i + 1,
+                "name": f"地點{i}",
+                "npcs": [n + 1 for n in range(num_npcs) if n % num_locations == i],
+                "objects": [
+                    {"id": j + 1, "name": f"物件{i}-{j}", "lock": (j % num_npcs) + 1, "clue": "線索"}
+                    for j in range(objects_per_location)
+                ],
+            }
+            for i in range(num_locations)
+        ],
+    }
+
+
+def legacy_save(session: Session, game_id: int, world: dict) -> None:
+    """
+    舊的寫法：每個步驟各自 commit，地點逐筆 commit + refresh，NPC 逐個 db.get
+    """
+    game = session.get(Game, game_id)
+    game.background = world["background"]
+    session.add(game)
+    session.commit()
+    session.exec(delete(Character).where(Character.game_id == game_id))
+    session.commit()
+    for ch in world["characters"]:
+        session.add(Character(game_id=game_id, **{k: v for k, v in ch.items() if k != "id"}))
+    session.commit()
+    session.exec(delete(Npc).where(Npc.game_id == game_id))
+    session.commit()
+    for n in world["npcs"]:
+        session.add(Npc(game_id=game_id, name=n["name"], description=n["description"]))
+    session.commit()
+    session.exec(delete(GameObj).where(
+        GameObj.location_id.in_(select(Location.id).where(Location.game_id == game_id))
+    ))
+    session.exec(delete(Location).where(Location.game_id == game_id))
+    session.commit()
+    npc_ids = [n.id for n in session.exec(select(Npc).where(Npc.game_id == game_id)).all()]
+    for loc in world["locations"]:
+        location = Location(game_id=game_id, name=loc["name"])
+        session.add(location)
+        session.commit()
+        session.refresh(location)
+        for ref in loc["npcs"]:
+            npc = session.get(Npc, npc_ids[ref - 1])
+            if npc:
+                npc.location_id = location.id
+                session.add(npc)
+        for obj in loc["objects"]:
+            session.add(GameObj(location_id=location.id, name=obj["name"], lock=obj["lock"], clue=obj["clue"]))
+    session.commit()
+
+
+def measure(label: str, save, rounds: int, world: dict) -> None:
+    commits = []
+    listener = lambda conn: commits.append(1)
+    event.listen(engine, "commit", listener)
+    durations = []
+    try:
+        for _ in range(rounds):
+            with Session(engine) as session:
+                game_id = MemoryService(session).create_game().id
+            commits.clear()
+            with Session(engine) as session:
+                start = time.perf_counter()
+                save(session, game_id, world)
+                durations.append((time.perf_counter() - start) * 1000)
+            per_round = len(commits)
+    finally:
+        event.remove(engine, "commit", listener)
+    durations.sort()
+    print(
+        f"{label:<12} commits/world={per_round:<4} "
+        f"median={statistics.median(durations):7.2f}ms "
+        f"p95={durations[int(len(durations) * 0.95) - 1]:7.2f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--characters", type=int, default=4)
+    parser.add_argument("--npcs", type=int, default=5)
+    parser.add_argument("--locations", type=int, default=6)
+    parser.add_argument("--objects", type=int, default=3, help="每個地點的物件數")
+    args = parser.parse_args()
+
+    init_db()
+    world = make_world(args.characters, args.npcs, args.locations, args.objects)
+    print(f"DB: {engine.url}")
+    measure("legacy", legacy_save, args.rounds, world)
+    measure("save_world", lambda s, gid, w: MemoryService(s).save_world(gid, w), args.rounds, world)
+
+
+if __name__ == "__main__":
+    main()
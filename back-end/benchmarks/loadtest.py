@@ -0,0 +1,168 @@
+"""
+HTTP 壓測：用固定併發量打 /api/chat/npc、背景生成與 generate_full，回報 p50/p95/p99 與 throughput。
+
+    cd back-end
+    python -m benchmarks.loadtest --scenario chat --concurrency 32 --requests 500
+    python -m benchmarks.loadtest --scenario all --concurrency 8 --requests 100 --latency-ms 800 --error-rate 0.02
+
+預設在同一個 process 裡用 ASGITransport 打 app，LLM 換成 FakeBackend（LLM_BACKEND=fake），
+不需要 GOOGLE_API_KEY，也不會花錢；延遲與錯誤率用參數模擬 Gemini。
+給 --base-url 時改打一個已經在跑的 server（LLM 後端由那邊的 LLM_BACKEND 決定）。
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Result:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.elapsed = 0.0
+
+    def report(self) -> str:
+        ok = sorted(self.latencies)
+        total = len(ok) + sum(self.errors.values())
+        ms = lambda p: percentile(ok, p) * 1000
+        errors = ", ".join(f"{k}×{v}" for k, v in sorted(self.errors.items())) or "-"
+        return (
+            f"{self.name:<14} n={total:<5} ok={len(ok):<5} "
+            f"p50={ms(50):8.1f}ms p95={ms(95):8.1f}ms p99={ms(99):8.1f}ms "
+            f"throughput={len(ok) / self.elapsed if self.elapsed else 0:7.1f} req/s errors={errors}"
+        )
+
+
+async def run(
+    name: str,
+    concurrency: int,
+    requests: int,
+    send: Callable[[int], Awaitable[httpx.Response]],
+) -> Result:
+    """
+    concurrency 個 worker 一直送，直到總共送出 requests 個請求（closed loop）
+    """
+    result = Result(name)
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                r = await send(i)
+                if r.status_code >= 400:
+                    result.errors[str(r.status_code)] = result.errors.get(str(r.status_code), 0) + 1
+                    continue
+            except httpx.HTTPError as e:
+                result.errors[type(e).__name__] = result.errors.get(type(e).__name__, 0) + 1
+                continue
+            result.latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+async def setup_game(client: httpx.AsyncClient, num_characters: int) -> Dict[str, Any]:
+    """
+    建一場有世界、玩家的遊戲，回傳 chat 要用的 game_id / player_id / npc_ids
+    """
+    r = await client.post("/api/world/games/0/background", json={"prompt": "壓測用的雨夜莊園"})
+    r.raise_for_status()
+    game_id = r.json()["game_id"]
+    r = await client.post("/api/world/world/games/generate_full", json={
+        "background": r.json()["background"], "num_characters": num_characters, "game_id": game_id,
+    })
+    r.raise_for_status()
+    world = r.json()
+    r = await client.post(f"/api/games/{game_id}/players", json={
+        "user_id": "loadtest", "character_id": world["characters"][0]["id"],
+    })
+    r.raise_for_status()
+    return {"game_id": game_id, "player_id": r.json()["player_id"], "npc_ids": [n["id"] for n in world["npcs"]]}
+
+
+def scenarios(args, game: Dict[str, Any]) -> Dict[str, Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]]:
+    fresh = not args.cached
+
+    def chat(client: httpx.AsyncClient, i: int):
+        return client.post("/api/chat/npc", json={
+            "game_id": game["game_id"], "player_id": game["player_id"],
+            "npc_id": game["npc_ids"][i % len(game["npc_ids"])], "text": f"第 {i} 個問題：昨晚你在哪裡？",
+        })
+
+    def background(client: httpx.AsyncClient, i: int):
+        # game 0 不存在，每次都會新建一場，不會清掉 chat 用的那場
+        return client.post("/api/world/games/0/background",
+                           json={"prompt": f"壓測主題 {i if fresh else 0}", "fresh": fresh})
+
+    def generate_full(client: httpx.AsyncClient, i: int):
+        return client.post("/api/world/world/games/generate_full", json={
+            "background": f"壓測背景 {i if fresh else 0}", "num_characters": args.characters, "fresh": fresh,
+        })
+
+    return {"chat": chat, "background": background, "generate_full": generate_full}
+
+
+async def main_async(args) -> None:
+    if args.base_url:
+        transport, base_url = None, args.base_url
+    else:
+        from backend.app.main import app
+        from backend.app.database import init_db
+        init_db()
+        transport, base_url = httpx.ASGITransport(app=app), "http://loadtest"
+
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+        game = await setup_game(client, args.characters)
+        available = scenarios(args, game)
+        names = list(available) if args.scenario == "all" else [args.scenario]
+        print(f"target={base_url} concurrency={args.concurrency} requests={args.requests} cached={args.cached}")
+        for name in names:
+            send = available[name]
+            result = await run(name, args.concurrency, args.requests, lambda i, send=send: send(client, i))
+            print(result.report())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=["chat", "background", "generate_full", "all"], default="all")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="每個情境送出的請求數")
+    parser.add_argument("--characters", type=int, default=4)
+    parser.add_argument("--cached", action="store_true", help="重複同樣的請求（量快取命中的情況）")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--base-url", help="打已經在跑的 server，例如 http://127.0.0.1:8000")
+    # 以下只影響 in-process 的 FakeBackend
+    parser.add_argument("--latency-ms", type=float, help="假 LLM 延遲中位數")
+    parser.add_argument("--latency-sigma", type=float, help="lognormal 分散程度，0 = 固定延遲")
+    parser.add_argument("--error-rate", type=float, help="假 LLM 回 503 的機率")
+    args = parser.parse_args()
+
+    if not args.base_url:
+        # 要在 import app 之前設定
+        os.environ.setdefault("LLM_BACKEND", "fake")
+        os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "loadtest.db"))
+        os.environ.setdefault("LLM_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "llm_cache.db"))
+        for flag, env in (("latency_ms", "LLM_FAKE_LATENCY_MS"), ("latency_sigma", "LLM_FAKE_LATENCY_SIGMA"),
+                          ("error_rate", "LLM_FAKE_ERROR_RATE")):
+            if getattr(args, flag) is not None:
+                os.environ[env] = str(getattr(args, flag))
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,76 @@
 # backend/tests/conftest.py
 
+import os
+import asyncio
+import tempfile
 import pytest
-from backend.app.database import init_db
+
+# 測試用獨立的 DB 與假的金鑰，不碰 repo 裡的 session.db，也不需要真的 API key
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+os.environ.setdefault("LLM_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "llm_cache.db"))
+
+from sqlmodel import Session
+from backend.app.database import init_db, engine
+from backend.app.models import Character, Npc
+from backend.app.services.memory_services import MemoryService
+from backend.app.services.response_cache import response_cache
+from backend.app.routers import world_gen
 
 @pytest.fixture(autouse=True, scope="session")
 def prepare_database():
     # 測試一開始就建好所有 table
     init_db()
+
+@pytest.fixture(autouse=True)
+def empty_response_cache():
+    # 各測試的假 LLM 回應不同，不能互相命中快取
+    response_cache.clear()
+
+@pytest.fixture
+def chat_game():
+    """
+    建一場有角色、NPC、玩家的遊戲，回傳 (game_id, player_id, npc_id)
+    """
+    with Session(engine) as session:
+        mem = MemoryService(session)
+        game = mem.create_game()
+        mem.save_background(game.id, "雨夜的莊園")
+        char = Character(game_id=game.id, name="王偵探", role="偵探", public_info="你是偵探",
+                         secret="無", mission="找出兇手")
+        npc = Npc(game_id=game.id, name="林管家", description="服侍莊園三十年")
+        session.add(char)
+        session.add(npc)
+        session.commit()
+        player = mem.assign_player(game.id, "user-1", char.id)
+        return game.id, player.id, npc.id
+
+@pytest.fixture
+def fake_world_llm(monkeypatch):
+    """
+    generate_full 用的假 LLM：固定內容，不打 Gemini
+    """
+    async def characters(background, num_characters, model, temperature, fresh=False):
+        return [
+            {"name": f"角色{i}", "role": "嫌疑人", "public_info": "你是…", "secret": "秘密", "mission": "任務"}
+            for i in range(num_characters)
+        ]
+
+    async def npcs(background, characters, num_npcs, model, temperature, fresh=False):
+        return [{"name": f"NPC{i}", "description": "路人"} for i in range(num_npcs)]
+
+    async def scenes(background, characters, locations, npcs, num_acts, model, temperature, fresh=False):
+        await asyncio.sleep(0.05)   # 比 locations 慢，確認 locations 先送出
+        acts = [
+            {"act_number": n + 1, "scripts": [{"character": c["name"], "dialogue": "……"} for c in characters]}
+            for n in range(num_acts)
+        ]
+        return acts, "兇手是管家"
+
+    async def locations(background, characters, npcs, model, temperature, fresh=False):
+        return [{"id": 1, "name": "書房", "npcs": [1], "objects": [{"id": 1, "name": "日記", "lock": 1, "clue": "撕掉的一頁"}]}]
+
+    monkeypatch.setattr(world_gen, "call_llm_for_characters", characters)
+    monkeypatch.setattr(world_gen, "call_llm_for_npcs", npcs)
+    monkeypatch.setattr(world_gen, "call_llm_for_scenes_and_ending", scenes)
+    monkeypatch.setattr(world_gen, "call_llm_for_locations", locations)
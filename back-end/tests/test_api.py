@@ -2,6 +2,8 @@
 import pytest
 from httpx import AsyncClient, ASGITransport
 from backend.app.main import app
+from backend.app.services import llm_service
+from backend.app.services.fake_backend import FakeBackend
 from jsonschema import validate
 
 
@@ -9,41 +11,51 @@ CHAT_SCHEMA = {
     "type": "object",
     "properties": {
         "dialogue": {"type": "string"},
-        "hint":     {"type": "string"},
-        "evidence": {"oneOf": [{"type": "null"}, {"type": "object"}]}
+        "hint":     {"type": ["string", "null"]},
+        "evidence": {"type": ["string", "null"]}
     },
     "required": ["dialogue", "hint", "evidence"]
 }
 
-@pytest.mark.asyncio
-async def test_get_world():
-    transport = ASGITransport(app=app)
-    async with AsyncClient(transport=transport, base_url="http://test") as ac:
-        r = await ac.get("/api/world/")
-        assert r.status_code == 200
-        data = r.json()
-        assert "characters" in data and "locations" in data
+@pytest.fixture
+def fake_backend(monkeypatch):
+    # 離線的假 Gemini：每個 call_llm_for_* 都拿得到合法的輸出
+    backend = FakeBackend(latency_ms=1, latency_sigma=0)
+    monkeypatch.setattr(llm_service, "backend", backend)
+    return backend
 
 @pytest.mark.asyncio
-async def test_session_move_and_chat(monkeypatch):
+async def test_background_world_player_and_chat(fake_backend):
     transport = ASGITransport(app=app)
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
-        # 建 session
-        r1 = await ac.post("/api/session/", json={})
-        sid = r1.json()['session_id']
+        # 背景：path 裡的遊戲不存在時會新建一場
+        r1 = await ac.post("/api/world/games/0/background", json={"prompt": "雨夜莊園"})
+        assert r1.status_code == 200
+        game_id = r1.json()["game_id"]
 
-        # 移動位置
-        r2 = await ac.post(f"/api/session/{sid}/move", json={"location":"loc01"})
-        assert r2.json()['player_position'] == 'loc01'
+        # 生成整個世界並存進這場遊戲
+        r2 = await ac.post("/api/world/world/games/generate_full", json={
+            "background": r1.json()["background"], "num_characters": 4, "num_npcs": 3, "num_acts": 2,
+            "game_id": game_id,
+        })
+        assert r2.status_code == 200
+        world = r2.json()
+        assert len(world["characters"]) == 4 and len(world["acts"]) == 2
+        placed = {n for loc in world["locations"] for n in loc["npcs"]}
+        assert placed == {n["id"] for n in world["npcs"]}
 
-        # Patch LLM 服務為固定回傳
-        fake = {"dialogue":"你好","hint":"提示","evidence":None}
-        monkeypatch.setattr(
-            'backend.app.services.llm_service.call_llm_for_chat',
-            lambda *args, **kwargs: fake
-        )
+        # 認領角色
+        r3 = await ac.post(f"/api/games/{game_id}/players", json={
+            "user_id": "u1", "character_id": world["characters"][0]["id"],
+        })
+        assert r3.status_code == 200
 
         # 發起聊天
-        r3 = await ac.post(f"/api/chat/{sid}", json={"npc":"char01","text":"你好"})
-        assert r3.status_code == 200
-        validate(instance=r3.json(), schema=CHAT_SCHEMA)
+        r4 = await ac.post("/api/chat/npc", json={
+            "game_id": game_id, "player_id": r3.json()["player_id"],
+            "npc_id": world["npcs"][0]["id"], "text": "你好",
+        })
+        assert r4.status_code == 200
+        validate(instance=r4.json(), schema=CHAT_SCHEMA)
+
+    assert fake_backend.calls >= 8
@@ -0,0 +1,81 @@
+# backend/tests/test_chat_memory.py
+import json
+import pytest
+from types import SimpleNamespace
+from httpx import AsyncClient, ASGITransport
+from sqlmodel import Session
+
+from backend.app.main import app
+from backend.app.database import engine
+from backend.app.services import llm_service
+from backend.app.services.conversation_store import conversation_store
+from backend.app.services.memory_services import MemoryService
+
+
+@pytest.mark.asyncio
+async def test_history_is_kept_on_the_server(monkeypatch, chat_game):
+    seen = []
+    instructions = []
+
+    async def fake_generate(model, contents, config=None, timeout=None):
+        seen.append([c.parts[0].text for c in contents])
+        instructions.append(config.system_instruction)
+        return SimpleNamespace(text=json.dumps({"dialogue": f"回覆{len(seen)}", "hint": None, "evidence": None}))
+
+    monkeypatch.setattr(llm_service.backend, "generate", fake_generate)
+    game_id, player_id, npc_id = chat_game
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        sizes = []
+        for text in ("第一句", "第二句", "第三句"):
+            body = {"game_id": game_id, "player_id": player_id, "npc_id": npc_id, "text": text}
+            sizes.append(len(json.dumps(body)))
+            r = await ac.post("/api/chat/npc", json=body)
+            assert r.status_code == 200
+
+        bad = await ac.post("/api/chat/npc", json={**body, "npc_id": 999999})
+        assert bad.status_code == 404
+
+    assert len(set(sizes)) == 1
+    assert seen[-1] == ["第一句", "回覆1", "第二句", "回覆2", "第三句"]
+    # system instruction 由 server 端從 DB 組出來
+    assert "林管家" in instructions[0] and "雨夜的莊園" in instructions[0] and "王偵探" in instructions[0]
+
+    # 清掉 ring buffer 後，從 Message 表載回來的歷史要一樣
+    conversation_store.clear()
+    with Session(engine) as session:
+        history = conversation_store.history(MemoryService(session), player_id, npc_id)
+    assert [m["content"] for m in history] == ["第一句", "回覆1", "第二句", "回覆2", "第三句", "回覆3"]
+
+
+
+@pytest.mark.asyncio
+async def test_client_supplied_context_still_works(monkeypatch):
+    # 世界只存在 Supabase 的舊版前端：id 不是後端的 id，上下文與歷史由 client 帶
+    seen = []
+
+    async def fake_generate(model, contents, config=None, timeout=None):
+        seen.append(([c.parts[0].text for c in contents], config.system_instruction))
+        return SimpleNamespace(text=json.dumps({"dialogue": "我在廚房", "hint": None, "evidence": None}))
+
+    monkeypatch.setattr(llm_service.backend, "generate", fake_generate)
+    body = {
+        "game_id": "script-uuid", "player_id": "player-uuid", "npc_id": "npc-uuid", "text": "你昨晚在哪？",
+        "background": "雪山小屋", "npc_info": {"name": "張廚師", "description": "沉默寡言"},
+        "player_info": {"name": "李記者", "role": "記者", "public_info": "…", "secret": "…", "mission": "…"},
+        "chat_history": [{"role": "user", "content": "你好"}, {"role": "assistant", "content": "嗯"}],
+    }
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.post("/api/chat/npc", json=body)
+        assert r.status_code == 200
+        assert r.json()["dialogue"] == "我在廚房"
+
+        # 沒有附上下文時，id 必須是後端的 id
+        bare = {k: body[k] for k in ("game_id", "player_id", "npc_id", "text")}
+        assert (await ac.post("/api/chat/npc", json=bare)).status_code == 422
+
+    contents, instruction = seen[0]
+    assert contents == ["你好", "嗯", "你昨晚在哪？"]
+    assert "張廚師" in instruction and "雪山小屋" in instruction and "李記者" in instruction
@@ -0,0 +1,50 @@
+# backend/tests/test_chat_stream.py
+import json
+import pytest
+from types import SimpleNamespace
+from httpx import AsyncClient, ASGITransport
+
+from backend.app.main import app
+from backend.app.services import llm_service
+from backend.app.services.json_stream import JsonFieldStreamer
+
+
+REPLY = {"dialogue": "那天晚上我聽到\"腳步聲\"，\n就在書房外。", "hint": "去書房看看", "evidence": None}
+
+
+def test_field_streamer_decodes_across_chunk_boundaries():
+    raw = json.dumps({"hint": {"dialogue": "巢狀"}, **REPLY})
+    for size in (1, 2, 3, 7):
+        streamer = JsonFieldStreamer("dialogue")
+        out = "".join(streamer.feed(raw[i:i + size]) for i in range(0, len(raw), size))
+        assert out == REPLY["dialogue"]
+        assert streamer.done
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_sends_dialogue_then_done(monkeypatch, chat_game):
+    raw = json.dumps(REPLY, ensure_ascii=False)
+
+    async def fake_stream(model, contents, config=None, timeout=None):
+        for i in range(0, len(raw), 4):
+            yield SimpleNamespace(text=raw[i:i + 4])
+
+    monkeypatch.setattr(llm_service.backend, "generate_stream", fake_stream)
+
+    game_id, player_id, npc_id = chat_game
+    body = {"game_id": game_id, "player_id": player_id, "npc_id": npc_id, "text": "你那晚在哪？"}
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.post("/api/chat/npc/stream", json=body)
+
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    events = []
+    for block in r.text.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+
+    deltas = [d["delta"] for e, d in events if e == "dialogue"]
+    assert len(deltas) > 1
+    assert "".join(deltas) == REPLY["dialogue"]
+    assert events[-1] == ("done", REPLY)
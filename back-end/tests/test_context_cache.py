@@ -0,0 +1,117 @@
+# backend/tests/test_context_cache.py
+import pytest
+from types import SimpleNamespace
+from google.genai import types
+
+from backend.app.services.context_cache import ChatContextCache, estimate_tokens
+from backend.app.services.llm_backend import LlmBackend
+
+
+def _builder(calls, text="你現在扮演 NPC"):
+    def build():
+        calls.append(1)
+        return text, types.GenerateContentConfig(temperature=0.7, max_output_tokens=500, system_instruction=text)
+    return build
+
+
+def test_estimate_tokens_counts_cjk_per_character():
+    assert estimate_tokens("你好，偵探") == 5
+    assert estimate_tokens("abcdefgh") == 2
+
+
+def test_context_is_built_once_per_triple_and_evicted_lru():
+    cache = ChatContextCache(max_entries=2, provider_cache=False)
+    calls = []
+    first = cache.get_or_build((1, 1, 1), _builder(calls))
+    assert cache.get_or_build((1, 1, 1), _builder(calls)) is first
+    cache.get_or_build((1, 2, 1), _builder(calls))
+    cache.get_or_build((1, 3, 1), _builder(calls))      # 淘汰最久沒用的 (1, 1, 1)
+    cache.get_or_build((1, 1, 1), _builder(calls))
+    assert len(calls) == 4
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["evictions"] == 2 and stats["entries"] == 2
+
+    cache.invalidate_game(1)
+    assert cache.stats()["entries"] == 0
+
+
+def test_invalidate_player_only_drops_that_players_contexts():
+    cache = ChatContextCache(provider_cache=False)
+    for key in ((1, 1, 1), (1, 2, 1), (1, 1, 2), (2, 1, 1)):
+        cache.get_or_build(key, _builder([]))
+    cache.invalidate_player(1, 1)
+    assert set(cache._entries) == {(1, 1, 2), (2, 1, 1)}
+
+
+def test_config_for_overrides_sampling_params():
+    cache = ChatContextCache(provider_cache=False)
+    ctx = cache.get_or_build((1, 1, 1), _builder([]))
+    assert ctx.config_for("m") is ctx.config
+    hot = ctx.config_for("m", temperature=0.2)
+    assert hot.temperature == 0.2 and hot.system_instruction == ctx.system_instruction
+
+
+@pytest.mark.asyncio
+async def test_provider_cache_replaces_system_instruction_and_tracks_savings():
+    created = []
+
+    class FakeBackend:
+        supports_provider_cache = True
+
+        async def create_cache(self, model, system_instruction, ttl_seconds):
+            created.append(model)
+            return f"cachedContents/{model}"
+
+    cache = ChatContextCache(provider_cache=True, provider_min_tokens=1)
+    ctx = cache.get_or_build((1, 1, 1), _builder([]))
+    await cache.ensure_provider_cache(ctx, "gemini-2.0-flash", FakeBackend())
+    await cache.ensure_provider_cache(ctx, "gemini-2.0-flash", FakeBackend())
+    assert created == ["gemini-2.0-flash"]
+
+    cfg = ctx.config_for("gemini-2.0-flash")
+    assert cfg.cached_content == "cachedContents/gemini-2.0-flash"
+    assert cfg.system_instruction is None
+    # 其他模型沒有快取，照常送 system instruction
+    assert ctx.config_for("gemini-1.5-pro").system_instruction == ctx.system_instruction
+
+    cache.record_usage(SimpleNamespace(prompt_token_count=1200, cached_content_token_count=1000))
+    cache.record_usage(SimpleNamespace(prompt_token_count=1300, cached_content_token_count=1000))
+    assert cache.stats()["avg_saved_tokens_per_turn"] == 1000
+
+
+@pytest.mark.asyncio
+async def test_provider_cache_failure_falls_back_once():
+    class BrokenBackend:
+        supports_provider_cache = True
+        calls = 0
+
+        async def create_cache(self, model, system_instruction, ttl_seconds):
+            BrokenBackend.calls += 1
+            raise RuntimeError("Cached content is too small")
+
+    cache = ChatContextCache(provider_cache=True, provider_min_tokens=1)
+    ctx = cache.get_or_build((1, 1, 1), _builder([]))
+    for _ in range(3):
+        await cache.ensure_provider_cache(ctx, "m", BrokenBackend())
+    assert BrokenBackend.calls == 1
+    assert ctx.config_for("m").system_instruction == ctx.system_instruction
+
+
+@pytest.mark.asyncio
+async def test_backend_without_provider_cache_is_skipped():
+    class PlainBackend(LlmBackend):
+        async def generate(self, model, contents, config=None, timeout=None):
+            raise AssertionError
+
+        async def generate_stream(self, model, contents, config=None, timeout=None):
+            yield
+
+    # 沒實作 generate / generate_stream 的後端不能建立
+    with pytest.raises(TypeError):
+        type("HalfBackend", (LlmBackend,), {})()
+
+    cache = ChatContextCache(provider_cache=True, provider_min_tokens=1)
+    ctx = cache.get_or_build((1, 1, 1), _builder([]))
+    await cache.ensure_provider_cache(ctx, "m", PlainBackend())
+    assert ctx.cached_content == {} and cache.stats()["provider_failures"] == 0
+    assert ctx.config_for("m").system_instruction == ctx.system_instruction
@@ -0,0 +1,81 @@
+# backend/tests/test_database.py
+import asyncio
+import json
+import pytest
+from types import SimpleNamespace
+from httpx import AsyncClient, ASGITransport
+from sqlmodel import Session, select
+
+from backend.app.main import app
+from backend.app.database import DB_BUSY_TIMEOUT_MS, async_engine, engine
+from backend.app.models import Message
+from backend.app.routers import world_gen
+from backend.app.services import llm_service
+from backend.app.services.memory_services import MemoryService
+
+
+def test_sqlite_pragmas_are_set_on_every_connection():
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1      # NORMAL
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == DB_BUSY_TIMEOUT_MS
+
+
+@pytest.mark.asyncio
+async def test_async_engine_uses_wal():
+    async with async_engine.connect() as conn:
+        assert (await conn.exec_driver_sql("PRAGMA journal_mode")).scalar() == "wal"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_chats_do_not_hit_database_locked(monkeypatch, chat_game):
+    async def fake_generate(model, contents, config=None, timeout=None):
+        await asyncio.sleep(0.01)
+        return SimpleNamespace(text=json.dumps({"dialogue": "嗯", "hint": None, "evidence": None}))
+
+    monkeypatch.setattr(llm_service.backend, "generate", fake_generate)
+    game_id, player_id, npc_id = chat_game
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        body = {"game_id": game_id, "player_id": player_id, "npc_id": npc_id}
+        results = await asyncio.gather(*[
+            ac.post("/api/chat/npc", json={**body, "text": f"問題{i}"}) for i in range(20)
+        ])
+    assert [r.status_code for r in results] == [200] * 20
+
+    with Session(engine) as session:
+        saved = session.exec(select(Message).where(Message.player_id == player_id)).all()
+    assert len(saved) == 40
+
+
+@pytest.mark.asyncio
+async def test_llm_calls_do_not_hold_a_db_connection(monkeypatch, chat_game, fake_world_llm):
+    # 等 LLM 的時候不能佔著連線池，不然同時進行的對話 / 生成數會被池子大小卡住
+    held = []
+
+    async def fake_generate(model, contents, config=None, timeout=None):
+        held.append(("chat", async_engine.pool.checkedout()))
+        return SimpleNamespace(text=json.dumps({"dialogue": "嗯", "hint": None, "evidence": None}))
+
+    characters = world_gen.call_llm_for_characters
+
+    async def checked_characters(*args, **kwargs):
+        held.append(("generate_full", async_engine.pool.checkedout()))
+        return await characters(*args, **kwargs)
+
+    monkeypatch.setattr(llm_service.backend, "generate", fake_generate)
+    monkeypatch.setattr(world_gen, "call_llm_for_characters", checked_characters)
+    game_id, player_id, npc_id = chat_game
+    with Session(engine) as session:
+        empty_game = MemoryService(session).create_game().id
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.post("/api/chat/npc", json={"game_id": game_id, "player_id": player_id,
+                                                 "npc_id": npc_id, "text": "昨晚你在哪裡？"})
+        assert r.status_code == 200
+        r = await ac.post("/api/world/world/games/generate_full", json={"background": "雨夜的莊園", "game_id": empty_game},
+                          headers={"Idempotency-Key": f"pool-{empty_game}"})
+        assert r.status_code == 200
+    assert held == [("chat", 0), ("generate_full", 0)]
@@ -0,0 +1,179 @@
+# backend/tests/test_game_rooms.py
+import asyncio
+import threading
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+from starlette.websockets import WebSocketDisconnect
+
+from backend.app.main import app
+from backend.app.database import engine
+from backend.app.models import Character
+from backend.app.services.memory_services import MemoryService
+from backend.app.services import game_rooms as rooms_module
+from backend.app.services import llm_service
+from backend.app.services.fake_backend import FakeBackend
+from backend.app.services.game_rooms import GameRoomHub
+from backend.app.services.llm_scheduler import llm_scheduler
+
+
+def _add_character(game_id: int) -> int:
+    with Session(engine) as session:
+        char = Character(game_id=game_id, name="李醫生", role="醫生", public_info="你是醫生",
+                         secret="無", mission="自保")
+        session.add(char)
+        session.commit()
+        return char.id
+
+
+def test_room_broadcasts_joins_and_streams_chat(monkeypatch, chat_game):
+    monkeypatch.setattr(llm_service, "backend", FakeBackend(latency_ms=1, latency_sigma=0))
+    game_id, player_id, npc_id = chat_game
+    char_id = _add_character(game_id)
+    client = TestClient(app)
+
+    with client.websocket_connect(f"/api/games/{game_id}/ws?player_id={player_id}") as ws1:
+        assert ws1.receive_json()["type"] == "welcome"
+        assert ws1.receive_json()["data"]["players_online"] == [player_id]
+
+        with client.websocket_connect(f"/api/games/{game_id}/ws") as ws2:
+            assert ws2.receive_json()["type"] == "welcome"
+            ws2.send_json({"type": "claim", "request_id": "c1", "user_id": "user-2", "character_id": char_id})
+            joined = ws2.receive_json()
+            claimed = ws2.receive_json()
+            assert claimed["type"] == "claimed" and claimed["request_id"] == "c1"
+            assert joined["type"] == "player_joined" and joined["data"] == claimed["data"] | {"user_id": "user-2"}
+            new_player = claimed["data"]["player_id"]
+
+            # 其他人不用輪詢就收到加入與上線
+            assert ws1.receive_json()["data"]["player_id"] == new_player
+            presence = ws1.receive_json()
+            assert presence["type"] == "presence" and presence["data"]["players_online"] == sorted([player_id, new_player])
+
+            # NPC 對話走同一條連線串流回來，只送給發問的人
+            ws1.send_json({"type": "chat", "request_id": "t1", "npc_id": npc_id, "text": "昨晚你在哪裡？"})
+            deltas = []
+            while True:
+                msg = ws1.receive_json()
+                assert msg["request_id"] == "t1"
+                if msg["type"] == "chat_done":
+                    break
+                deltas.append(msg["data"]["delta"])
+            assert "".join(deltas) == msg["data"]["dialogue"]
+            ws2.send_json({"type": "ping", "request_id": "p"})
+            assert ws2.receive_json()["type"] == "presence"   # ws2 自己的上線通知
+            assert ws2.receive_json() == {"type": "pong", "data": {}, "request_id": "p"}
+
+        # HTTP 認領一樣會廣播
+        r = client.post(f"/api/games/{game_id}/players", json={"user_id": "user-3", "character_id": char_id})
+        assert r.status_code == 200
+        events = [ws1.receive_json()["type"] for _ in range(2)]
+        assert sorted(events) == ["player_joined", "presence"]
+
+
+def test_room_rejects_unknown_game_and_foreign_player(chat_game):
+    client = TestClient(app)
+    with client.websocket_connect("/api/games/999999/ws") as ws:
+        with pytest.raises(WebSocketDisconnect) as exc:
+            ws.receive_json()
+    assert exc.value.code == 4404
+
+    # 別場遊戲的玩家不能進這個房間
+    game_id, player_id, _ = chat_game
+    with Session(engine) as session:
+        other_game = MemoryService(session).create_game().id
+    with client.websocket_connect(f"/api/games/{other_game}/ws?player_id={player_id}") as ws:
+        with pytest.raises(WebSocketDisconnect) as exc:
+            ws.receive_json()
+    assert exc.value.code == 4404
+
+
+class _HangingBackend(FakeBackend):
+    def __init__(self):
+        super().__init__(latency_ms=1, latency_sigma=0)
+        self.started = threading.Event()
+        self.cancelled = threading.Event()
+
+    async def generate_stream(self, model, contents, config=None, timeout=None):
+        self.started.set()
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+        yield   # pragma: no cover
+
+
+def test_disconnect_cancels_running_chat(monkeypatch, chat_game):
+    backend = _HangingBackend()
+    monkeypatch.setattr(llm_service, "backend", backend)
+    game_id, player_id, npc_id = chat_game
+
+    # with TestClient：event loop 在斷線後繼續跑，才看得出 task 有沒有被取消
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/api/games/{game_id}/ws?player_id={player_id}") as ws:
+            ws.receive_json()
+            ws.receive_json()
+            ws.send_json({"type": "chat", "request_id": "t1", "npc_id": npc_id, "text": "昨晚你在哪裡？"})
+            assert backend.started.wait(5)
+
+        assert backend.cancelled.wait(5)
+        assert llm_scheduler.stats()["classes"]["interactive"]["active"] == 0
+
+
+class _StuckWebSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        await asyncio.Event().wait()   # 永遠送不出去
+
+    async def close(self, code=1000):
+        pass
+
+
+class _FastWebSocket(_StuckWebSocket):
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+@pytest.mark.asyncio
+async def test_slow_connection_is_dropped_without_blocking_others(monkeypatch):
+    monkeypatch.setattr(rooms_module, "ROOM_SEND_QUEUE", 4)
+    hub = GameRoomHub()
+    fast_ws = _FastWebSocket()
+    fast = await hub.connect(fast_ws, 1)
+    slow = await hub.connect(_StuckWebSocket(), 1)
+    for i in range(10):
+        hub.publish(1, "tick", {"i": i})
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.01)
+    assert len(fast_ws.sent) == 10
+    assert slow.closed and hub.stats()["dropped_slow"] == 1 and hub.stats()["connections"] == 1
+    await hub.disconnect(fast)
+
+
+class _ClosingStuckWebSocket(_StuckWebSocket):
+    def __init__(self):
+        self.close_code = None
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+@pytest.mark.asyncio
+async def test_direct_send_overflow_closes_the_connection(monkeypatch):
+    monkeypatch.setattr(rooms_module, "ROOM_SEND_QUEUE", 4)
+    hub = GameRoomHub()
+    ws = _ClosingStuckWebSocket()
+    conn = await hub.connect(ws, 1, player_id=7)
+    # 只回給自己的 chat_delta 送不出去時，也要斷線而不是默默丟掉
+    sent = [conn.send("chat_delta", {"npc_id": 1, "delta": "字"}, "t1") for _ in range(10)]
+    await asyncio.sleep(0.01)
+    assert sent.count(False) >= 1
+    assert conn.closed and ws.close_code == 1013
+    assert hub.stats()["dropped_slow"] == 1 and hub.stats()["connections"] == 0
+    await hub.disconnect(conn)
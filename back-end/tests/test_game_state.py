@@ -0,0 +1,110 @@
+# backend/tests/test_game_state.py
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from backend.app.main import app
+from backend.app.database import async_engine, engine
+from backend.app.models import Character, GameObj
+from backend.app.services.memory_services import MemoryService
+
+
+def _world():
+    return {
+        "background": "雨夜的莊園",
+        "characters": [{"id": 1, "name": "王偵探", "role": "偵探", "public_info": "你是偵探", "secret": "無", "mission": "破案"}],
+        "npcs": [{"id": 1, "name": "林管家", "description": "老管家"}, {"id": 2, "name": "陳園丁", "description": "園丁"}],
+        "acts": [{"act_number": 1, "scripts": [{"character": "王偵探", "dialogue": "開始調查"}]}],
+        "ending": "兇手是園丁",
+        "locations": [
+            {"id": 1, "name": "書房", "npcs": [1], "objects": [{"id": 1, "name": "日記", "lock": 1, "clue": "撕掉的一頁"}]},
+            {"id": 2, "name": "花園", "npcs": [2], "objects": []},
+        ],
+    }
+
+
+@pytest.mark.asyncio
+async def test_state_is_loaded_in_fixed_queries_and_supports_etag():
+    with Session(engine) as session:
+        mem = MemoryService(session)
+        game_id = mem.create_game().id
+        mem.save_world(game_id, _world())
+
+    statements = []
+    listener = lambda conn, cursor, sql, params, context, many: statements.append(sql)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", listener)
+    transport = ASGITransport(app=app)
+    try:
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            r = await ac.get(f"/api/games/{game_id}/state")
+            assert r.status_code == 200
+            assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 6
+
+            state = r.json()
+            assert [c["name"] for c in state["characters"]] == ["王偵探"]
+            study = next(l for l in state["locations"] if l["name"] == "書房")
+            assert study["objects"][0]["name"] == "日記"
+            assert study["npcs"] == [n["id"] for n in state["npcs"] if n["name"] == "林管家"]
+
+            etag = r.headers["etag"]
+            statements.clear()
+            r = await ac.get(f"/api/games/{game_id}/state", headers={"If-None-Match": etag})
+            assert r.status_code == 304 and r.content == b""
+            assert statements == []         # 沒變就不查 DB
+
+            # 有玩家加入後版本改變
+            with Session(engine) as session:
+                char = session.exec(select(Character).where(Character.game_id == game_id)).first()
+                MemoryService(session).assign_player(game_id, "user-1", char.id)
+            r = await ac.get(f"/api/games/{game_id}/state", headers={"If-None-Match": etag})
+            assert r.status_code == 200
+            assert r.headers["etag"] != etag
+            assert [p["user_id"] for p in r.json()["players"]] == ["user-1"]
+
+            assert (await ac.get("/api/games/999999/state")).status_code == 404
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", listener)
+
+
+@pytest.mark.asyncio
+async def test_state_only_shows_a_players_own_clues_and_secrets():
+    world = _world()
+    world["characters"].append({"id": 2, "name": "陳小姐", "role": "繼承人", "public_info": "你是繼承人",
+                                "secret": "欠了一大筆債", "mission": "拿到遺產"})
+    with Session(engine) as session:
+        mem = MemoryService(session)
+        game_id = mem.create_game().id
+        ids = mem.save_world(game_id, world)
+        owner = mem.assign_player(game_id, "user-1", ids["characters"][1]).id
+        other = mem.assign_player(game_id, "user-2", ids["characters"][2]).id
+        diary = session.get(GameObj, ids["objects"][(1, 1)])
+        diary.owner_id = owner
+        session.add(diary)
+        session.commit()
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        states = {}
+        for name, params in (("anonymous", {}), ("owner", {"player_id": owner}), ("other", {"player_id": other})):
+            r = await ac.get(f"/api/games/{game_id}/state", params=params)
+            assert r.status_code == 200
+            states[name] = r.json()
+        assert (await ac.get(f"/api/games/{game_id}/state", params={"player_id": 999999})).status_code == 404
+        # 每個玩家的 ETag 不同，不會拿別人的快取版本回 304
+        r = await ac.get(f"/api/games/{game_id}/state", params={"player_id": other},
+                         headers={"If-None-Match": (await ac.get(f"/api/games/{game_id}/state",
+                                                                 params={"player_id": owner})).headers["etag"]})
+        assert r.status_code == 200
+
+    def clue(state):
+        return next(l for l in state["locations"] if l["name"] == "書房")["objects"][0]["clue"]
+
+    def secrets(state):
+        return {c["name"]: c["secret"] for c in state["characters"]}
+
+    assert clue(states["owner"]) == "撕掉的一頁"
+    assert clue(states["other"]) is None and clue(states["anonymous"]) is None
+    assert secrets(states["owner"]) == {"王偵探": "無", "陳小姐": None}
+    assert secrets(states["other"]) == {"王偵探": None, "陳小姐": "欠了一大筆債"}
+    assert secrets(states["anonymous"]) == {"王偵探": None, "陳小姐": None}
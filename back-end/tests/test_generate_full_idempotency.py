@@ -0,0 +1,115 @@
+# backend/tests/test_generate_full_idempotency.py
+import asyncio
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlmodel import Session, select
+
+from backend.app.main import app
+from backend.app.database import engine
+from backend.app.models import Character, Game, GameObj, Location, Npc
+from backend.app.routers import world_gen
+from backend.app.services.memory_services import MemoryService
+
+BODY = {"background": "雨夜的莊園", "num_characters": 3, "num_npcs": 2, "num_acts": 2}
+
+
+@pytest.fixture
+def game_id():
+    with Session(engine) as session:
+        return MemoryService(session).create_game().id
+
+
+@pytest.fixture
+def count_generations(monkeypatch, fake_world_llm):
+    calls = []
+    characters = world_gen.call_llm_for_characters
+
+    async def counted(*args, **kwargs):
+        calls.append(1)
+        await asyncio.sleep(0.05)      # 讓重複的請求在生成途中抵達
+        return await characters(*args, **kwargs)
+
+    monkeypatch.setattr(world_gen, "call_llm_for_characters", counted)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_duplicate_and_inflight_keys_generate_once(game_id, count_generations):
+    body = {**BODY, "game_id": game_id}
+    headers = {"Idempotency-Key": f"world-{game_id}"}
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        first, inflight = await asyncio.gather(
+            ac.post("/api/world/world/games/generate_full", json=body, headers=headers),
+            ac.post("/api/world/world/games/generate_full", json=body, headers=headers),
+        )
+        replay = await ac.post("/api/world/world/games/generate_full", json=body, headers=headers)
+        conflict = await ac.post("/api/world/world/games/generate_full",
+                                 json={**body, "num_acts": 3}, headers=headers)
+
+    assert len(count_generations) == 1
+    assert first.status_code == inflight.status_code == replay.status_code == 200
+    assert first.json() == inflight.json() == replay.json()
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert conflict.status_code == 422
+
+    world = first.json()
+    assert world["game_id"] == game_id
+    with Session(engine) as session:
+        game = session.get(Game, game_id)
+        assert game.ending == world["ending"] and len(game.acts) == 2
+        chars = session.exec(select(Character).where(Character.game_id == game_id)).all()
+        npcs = session.exec(select(Npc).where(Npc.game_id == game_id)).all()
+    # 回應裡的 id 已經是 DB 的 id
+    assert sorted(c["id"] for c in world["characters"]) == sorted(c.id for c in chars)
+    npc_ids = {n.id for n in npcs}
+    assert set(world["locations"][0]["npcs"]) <= npc_ids
+    assert world["locations"][0]["objects"][0]["lock"] in npc_ids
+    with Session(engine) as session:
+        objects = session.exec(
+            select(GameObj).join(Location).where(Location.game_id == game_id).order_by(GameObj.id)
+        ).all()
+    assert [o["id"] for l in world["locations"] for o in l["objects"]] == [o.id for o in objects]
+
+
+@pytest.mark.asyncio
+async def test_unknown_lock_is_returned_as_none(game_id, fake_world_llm, monkeypatch):
+    async def locations(background, characters, npcs, model, temperature, fresh=False):
+        return [{"id": 1, "name": "書房", "npcs": [1], "objects": [{"id": 1, "name": "日記", "lock": 99, "clue": "撕掉的一頁"}]}]
+
+    monkeypatch.setattr(world_gen, "call_llm_for_locations", locations)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.post("/api/world/world/games/generate_full", json={**BODY, "game_id": game_id})
+    [obj] = r.json()["locations"][0]["objects"]
+    assert obj["lock"] is None
+    with Session(engine) as session:
+        assert session.get(GameObj, obj["id"]).lock is None
+
+
+@pytest.mark.asyncio
+async def test_game_with_players_is_not_overwritten(chat_game, count_generations):
+    game_id, player_id, _ = chat_game
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.post("/api/world/world/games/generate_full", json={**BODY, "game_id": game_id})
+    assert r.status_code == 409
+    assert count_generations == []      # 生成之前就擋下來
+
+
+@pytest.mark.asyncio
+async def test_failed_generation_is_not_stored(game_id, count_generations, monkeypatch):
+    async def broken(*args, **kwargs):
+        raise RuntimeError("LLM 掛了")
+
+    monkeypatch.setattr(world_gen, "call_llm_for_scenes_and_ending", broken)
+    body = {**BODY, "game_id": game_id}
+    headers = {"Idempotency-Key": f"broken-{game_id}"}
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        with pytest.raises(RuntimeError):
+            await ac.post("/api/world/world/games/generate_full", json=body, headers=headers)
+        assert (await ac.post("/api/world/world/games/generate_full", json=BODY, headers=headers)).status_code == 422
+    with Session(engine) as session:
+        assert MemoryService(session).get_idempotency(headers["Idempotency-Key"]) is None
+        assert session.exec(select(Character).where(Character.game_id == game_id)).all() == []
@@ -0,0 +1,56 @@
+# backend/tests/test_history_manager.py
+import pytest
+from sqlmodel import Session
+
+from backend.app.database import engine
+from backend.app.services import llm_service
+from backend.app.services.conversation_store import ConversationStore
+from backend.app.services.history_manager import HistoryManager, SUMMARY_PREFIX, history_tokens
+from backend.app.services.memory_services import MemoryService
+
+
+@pytest.mark.asyncio
+async def test_long_history_is_folded_into_rolling_summary(chat_game):
+    _, player_id, npc_id = chat_game
+    calls = []
+
+    async def fake_summarize(previous_summary, messages, npc_name):
+        calls.append((previous_summary, [m["content"] for m in messages]))
+        return f"摘要{len(calls)}"
+
+    store = ConversationStore(max_messages=50)
+    manager = HistoryManager(store=store, summarize=fake_summarize, token_budget=60, keep_recent=4)
+
+    with Session(engine) as session:
+        mem = MemoryService(session)
+        for i in range(10):
+            store.append(mem, player_id, npc_id, "user", f"第{i}個問題" * 3)
+            store.append(mem, player_id, npc_id, "assistant", f"第{i}個回答" * 3)
+
+        # 超過預算：這回合先丟掉最舊的訊息，並在背景排程摘要
+        history = manager.prepare(mem, player_id, npc_id, "林管家")
+        assert history_tokens(history) <= 60
+        await manager.drain()
+
+        assert len(calls) == 1 and calls[0][0] is None
+        assert len(calls[0][1]) == 16       # 20 則只保留最近 4 則原文
+
+        history = manager.prepare(mem, player_id, npc_id, "林管家")
+        assert history[0] == {"role": "summary", "content": SUMMARY_PREFIX + "摘要1"}
+        # 送進 Gemini 時摘要在 user 端，但內容標明是系統備註，不是玩家說的話
+        contents = llm_service._build_chat_contents(history, "還有呢？")
+        assert contents[0].role == "user" and contents[0].parts[0].text.startswith("【系統備註")
+        assert [c.role for c in contents[1:]] == ["user", "model", "user", "model", "user"]
+        assert [m["content"] for m in history[1:]] == ["第8個問題" * 3, "第8個回答" * 3, "第9個問題" * 3, "第9個回答" * 3]
+
+        # 摘要存在 DB，換一個 store（重啟）也讀得到
+        fresh = ConversationStore(max_messages=50)
+        assert fresh.summary(mem, player_id, npc_id)["content"] == "摘要1"
+
+        # 再聊下去，舊摘要會被接著更新
+        for i in range(10, 16):
+            store.append(mem, player_id, npc_id, "user", f"第{i}個問題" * 3)
+        manager.prepare(mem, player_id, npc_id, "林管家")
+        await manager.drain()
+        assert calls[1][0] == "摘要1"
+        assert store.summary(mem, player_id, npc_id)["content"] == "摘要2"
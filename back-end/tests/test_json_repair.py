@@ -0,0 +1,93 @@
+# backend/tests/test_json_repair.py
+import json
+import pytest
+from types import SimpleNamespace
+
+from backend.app.services import llm_service
+from backend.app.services.json_stream import repair_json
+
+CHARACTERS = [{"name": "甲"}, {"name": "乙"}]
+
+
+def _act(n):
+    return {"act_number": n, "scripts": [{"character": "甲", "dialogue": f"第{n}幕"}]}
+
+
+def test_valid_json_is_unchanged():
+    text = json.dumps({"acts": [_act(1)], "ending": "完"}, ensure_ascii=False)
+    parsed = repair_json(text)
+    assert parsed.complete and parsed.value == json.loads(text)
+
+
+def test_truncated_json_keeps_complete_prefix():
+    text = '```json\n{"acts": [' + json.dumps(_act(1), ensure_ascii=False) + ', {"act_number": 2, "scripts": [{"character": "甲", "dia'
+    parsed = repair_json(text)
+    assert not parsed.complete
+    assert parsed.value["acts"][0] == _act(1)
+    assert parsed.is_complete("$.acts[0]") and not parsed.is_complete("$.acts[1]")
+    assert "ending" not in parsed.value
+
+    # 數字、字串停在一半都不能當作完整的值
+    assert repair_json('[1, 2, 3').value == [1, 2]
+    assert repair_json('{"a": "半').value == {}
+    assert repair_json('[1, 2,]').complete
+
+
+@pytest.mark.asyncio
+async def test_truncated_act_keeps_complete_scripts(monkeypatch):
+    full = {"act_number": 1, "scripts": [{"character": "甲", "dialogue": "一"}, {"character": "乙", "dialogue": "二"}]}
+    text = json.dumps(full, ensure_ascii=False)
+    calls = []
+
+    async def fake_generate(model, contents, config=None, cache=False, fresh=False, task=None):
+        calls.append((contents[1], config.response_schema))
+        if len(calls) == 1:
+            return SimpleNamespace(text=text[:text.index("二") - 3])     # 第二段 script 被截斷
+        return SimpleNamespace(text=json.dumps({"act_number": 1, "scripts": [full["scripts"][1]]}, ensure_ascii=False))
+
+    monkeypatch.setattr(llm_service, "_generate", fake_generate)
+    act = await llm_service._generate_act("sys", "base", "{}", 1, 1, ["甲", "乙"],
+                                          model="m", temperature=0.7, max_tokens=100, fresh=False)
+    assert act == full
+    # 只補生成缺少的角色，已完成的那段不重寫
+    assert len(calls) == 2
+    prompt, schema = calls[1]
+    assert '請只輸出這些角色的 script：["乙"]' in prompt
+    assert schema["properties"]["scripts"]["items"]["properties"]["character"]["enum"] == ["乙"]
+
+
+@pytest.mark.asyncio
+async def test_truncated_locations_keep_complete_ones(monkeypatch):
+    loc = {"id": 1, "name": "大廳", "npcs": [1], "objects": [{"id": 1, "name": "箱子", "lock": 1, "clue": "鑰匙"}]}
+    calls = []
+
+    async def fake_generate(model, contents, config=None, cache=False, fresh=False, task=None):
+        calls.append(contents[1])
+        if len(calls) == 1:
+            return SimpleNamespace(text="[" + json.dumps(loc, ensure_ascii=False) + ', {"id": 2, "name": "書')
+        return SimpleNamespace(text=json.dumps([
+            {"id": 1, "name": "書房", "npcs": [2], "objects": []},
+            {"id": 3, "name": "花園", "npcs": [], "objects": []},
+        ], ensure_ascii=False))
+
+    monkeypatch.setattr(llm_service, "_generate", fake_generate)
+    locations = await llm_service.call_llm_for_locations("背景", CHARACTERS, [{"id": 1}, {"id": 2}])
+
+    assert locations[0] == loc
+    assert [l["name"] for l in locations] == ["大廳", "書房", "花園"]
+    assert len({l["id"] for l in locations}) == 3      # 重複的 id 已重新編號
+    assert "id 從 2 開始" in calls[1]
+
+
+def test_truncated_location_keeps_complete_objects():
+    text = json.dumps([
+        {"id": 1, "name": "大廳", "npcs": [1], "objects": [
+            {"id": 1, "name": "箱子", "lock": 1, "clue": "鑰匙"},
+            {"id": 2, "name": "信", "lock": 1, "clue": "撕掉的一頁"},
+        ]},
+    ], ensure_ascii=False)
+    locations = llm_service._complete_locations(repair_json(text[:text.index("撕掉")]))
+    assert [(l["name"], [o["name"] for o in l["objects"]]) for l in locations] == [("大廳", ["箱子"])]
+
+    # npcs 還沒收完的地點不能用
+    assert llm_service._complete_locations(repair_json('[{"id": 1, "name": "大廳", "npcs": [1, 2')) == []
@@ -0,0 +1,50 @@
+# backend/tests/test_llm_backend.py
+import asyncio
+import pytest
+
+from backend.app.services.fake_backend import FakeBackend
+from backend.app.services.llm_backend import GeminiBackend, create_backend
+
+
+def _patched_backend(monkeypatch, delay, **kwargs):
+    backend = GeminiBackend(api_key="test-key", **kwargs)
+    state = {"active": 0, "peak": 0}
+
+    async def fake_generate_content(model, contents, config=None):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            state["active"] -= 1
+        return f"{model}:{contents}"
+
+    monkeypatch.setattr(backend.client.aio.models, "generate_content", fake_generate_content)
+    return backend, state
+
+
+@pytest.mark.asyncio
+async def test_generate_respects_concurrency_limit(monkeypatch):
+    backend, state = _patched_backend(monkeypatch, 0.02, max_concurrency=3)
+    results = await asyncio.gather(*(backend.generate("m", i) for i in range(10)))
+    assert results == [f"m:{i}" for i in range(10)]
+    assert state["peak"] == 3
+
+
+@pytest.mark.asyncio
+async def test_generate_times_out(monkeypatch):
+    backend, _ = _patched_backend(monkeypatch, 1, timeout=0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        await backend.generate("m", "slow")
+
+
+@pytest.mark.asyncio
+async def test_missing_api_key_fails_on_first_call_not_on_import():
+    backend = create_backend("gemini", api_key=None)
+    with pytest.raises(RuntimeError, match="GOOGLE_API_KEY"):
+        await backend.generate("m", "hi")
+    await backend.aclose()
+
+
+def test_fake_backend_is_selectable():
+    assert isinstance(create_backend("fake"), FakeBackend)
@@ -0,0 +1,99 @@
+# backend/tests/test_llm_resilience.py
+import asyncio
+import pytest
+from google.genai import errors as genai_errors
+
+from backend.app.services.llm_resilience import CircuitBreaker, CircuitOpen, ResilientCaller
+
+
+def _server_error(code=503):
+    return genai_errors.APIError(code, {"error": {"message": "boom", "status": "UNAVAILABLE"}})
+
+
+def _flaky(failures, result="ok", exc=None):
+    calls = []
+
+    async def attempt(remaining):
+        calls.append(remaining)
+        if len(calls) <= failures:
+            raise exc or _server_error()
+        return result
+
+    return attempt, calls
+
+
+@pytest.mark.asyncio
+async def test_retries_transient_errors_but_not_bad_requests():
+    caller = ResilientCaller(attempts=3, base_delay=0.001, breaker=CircuitBreaker(failure_threshold=10))
+    attempt, calls = _flaky(2)
+    assert await caller.call(attempt) == "ok"
+    assert len(calls) == 3 and caller.stats()["retries"] == 2
+
+    attempt, calls = _flaky(1, exc=_server_error(400))
+    with pytest.raises(genai_errors.APIError):
+        await caller.call(attempt)
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_deadline_bounds_the_whole_call():
+    caller = ResilientCaller(attempts=5, base_delay=0.001)
+
+    async def slow(remaining):
+        await asyncio.sleep(10)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(caller.call(slow, deadline=0.05), 1)
+    assert caller.stats()["deadline_exceeded"] == 1
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_then_lets_one_probe_through():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+    caller = ResilientCaller(attempts=1, breaker=breaker)
+    attempt, calls = _flaky(2)
+    for _ in range(2):
+        with pytest.raises(genai_errors.APIError):
+            await caller.call(attempt)
+    assert breaker.state == "open"
+
+    with pytest.raises(CircuitOpen) as exc:
+        await caller.call(attempt)
+    assert exc.value.status_code == 503 and "Retry-After" in exc.value.headers
+    assert len(calls) == 2
+
+    now[0] = 31
+    assert await caller.call(attempt) == "ok"
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_hedge_returns_the_faster_copy():
+    caller = ResilientCaller(hedge=True, hedge_min_samples=1)
+    caller.latency.record(0.01)
+    started = []
+
+    async def attempt(remaining):
+        started.append(len(started))
+        await asyncio.sleep(5 if len(started) == 1 else 0)   # 第一個卡住，hedge 的馬上回來
+        return "fast"
+
+    assert await asyncio.wait_for(caller.call(attempt), 1) == "fast"
+    assert caller.stats()["hedge_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_retries_only_before_first_chunk():
+    caller = ResilientCaller(attempts=3, base_delay=0.001)
+    opened = []
+
+    async def open_stream(timeout):
+        opened.append(timeout)
+        if len(opened) == 1:
+            raise _server_error()
+        yield "a"
+        yield "b"
+
+    assert [c async for c in caller.stream(open_stream)] == ["a", "b"]
+    assert len(opened) == 2
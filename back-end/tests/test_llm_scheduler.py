@@ -0,0 +1,110 @@
+# backend/tests/test_llm_scheduler.py
+import asyncio
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from backend.app.main import app
+from backend.app.routers import chat
+from backend.app.services.llm_scheduler import LlmOverloaded, LlmScheduler, Priority
+
+
+async def _hold(scheduler, priority, user, started, release, order):
+    async with scheduler.slot(priority, user):
+        order.append((priority, user))
+        started.set()
+        await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_higher_priority_and_other_users_go_first():
+    scheduler = LlmScheduler(max_concurrency=1, reserved_interactive=0)
+    order, release = [], asyncio.Event()
+    first = asyncio.Event()
+    tasks = [asyncio.create_task(_hold(scheduler, Priority.WORLD_GEN, "a", first, release, order))]
+    await first.wait()
+
+    # 排隊順序：a 的兩個世界生成、b 的世界生成、最後才來的對話
+    for priority, user in [(Priority.WORLD_GEN, "a"), (Priority.WORLD_GEN, "a"),
+                           (Priority.WORLD_GEN, "b"), (Priority.PREGEN, "pool"),
+                           (Priority.INTERACTIVE, "p1")]:
+        tasks.append(asyncio.create_task(_hold(scheduler, priority, user, asyncio.Event(), release, order)))
+        await asyncio.sleep(0)
+    assert scheduler.stats()["classes"]["world_gen"]["queued_now"] == 3
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == [
+        (Priority.WORLD_GEN, "a"),
+        (Priority.INTERACTIVE, "p1"),
+        (Priority.WORLD_GEN, "a"),
+        (Priority.WORLD_GEN, "b"),      # a 還有一個在排，但先輪到 b
+        (Priority.WORLD_GEN, "a"),
+        (Priority.PREGEN, "pool"),
+    ]
+    assert scheduler.stats()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_is_rejected_with_retry_after_and_cancel_cleans_up():
+    scheduler = LlmScheduler(max_concurrency=2, reserved_interactive=1,
+                             queue_limits={Priority.INTERACTIVE: 1, Priority.WORLD_GEN: 1, Priority.PREGEN: 1})
+    release = asyncio.Event()
+    running = asyncio.create_task(_hold(scheduler, Priority.WORLD_GEN, "a", asyncio.Event(), release, []))
+    await asyncio.sleep(0)
+    queued = asyncio.create_task(_hold(scheduler, Priority.WORLD_GEN, "b", asyncio.Event(), release, []))
+    await asyncio.sleep(0)
+
+    with pytest.raises(LlmOverloaded) as exc:
+        await scheduler.acquire(Priority.WORLD_GEN, "c")
+    assert exc.value.status_code == 429 and int(exc.value.headers["Retry-After"]) >= 1
+    # 保留給對話的名額還在
+    scheduler.check_admission(Priority.INTERACTIVE)
+
+    queued.cancel()
+    await asyncio.gather(queued, return_exceptions=True)
+    assert scheduler.stats()["classes"]["world_gen"]["queued_now"] == 0
+    release.set()
+    await running
+    assert scheduler.stats()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_world_gen_and_pregen_together_leave_the_reserved_slots():
+    scheduler = LlmScheduler(max_concurrency=4, reserved_interactive=2, max_pregen=2)
+    release = asyncio.Event()
+    background = [asyncio.create_task(_hold(scheduler, p, "gen", asyncio.Event(), release, []))
+                  for p in (Priority.WORLD_GEN, Priority.PREGEN, Priority.PREGEN)]
+    await asyncio.sleep(0)
+    classes = scheduler.stats()["classes"]
+    # 世界生成 + 預先生成合計只能用 4 - 2 = 2 個名額
+    assert classes["world_gen"]["active"] + classes["pregen"]["active"] == 2
+    assert classes["pregen"]["queued_now"] == 1
+
+    # 保留的 2 個名額對話可以直接拿到，不用排隊
+    for user in ("p1", "p2"):
+        await scheduler.acquire(Priority.INTERACTIVE, user)
+    assert scheduler.stats()["classes"]["interactive"]["queued"] == 0
+    assert scheduler.stats()["active"] == 4
+
+    scheduler.release(Priority.INTERACTIVE)
+    scheduler.release(Priority.INTERACTIVE)
+    release.set()
+    await asyncio.gather(*background)
+    assert scheduler.stats()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_returns_429_when_saturated(monkeypatch, chat_game):
+    scheduler = LlmScheduler(max_concurrency=1, reserved_interactive=0,
+                             queue_limits={Priority.INTERACTIVE: 0, Priority.WORLD_GEN: 0, Priority.PREGEN: 0})
+    monkeypatch.setattr(chat, "llm_scheduler", scheduler)
+    await scheduler.acquire(Priority.WORLD_GEN, "someone")
+
+    game_id, player_id, npc_id = chat_game
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.post("/api/chat/npc/stream", json={
+            "game_id": game_id, "player_id": player_id, "npc_id": npc_id, "text": "你好",
+        })
+    assert r.status_code == 429
+    assert "Retry-After" in r.headers
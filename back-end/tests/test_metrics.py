@@ -0,0 +1,67 @@
+# backend/tests/test_metrics.py
+import json
+import pytest
+from types import SimpleNamespace
+from httpx import AsyncClient, ASGITransport
+
+from backend.app.main import app
+from backend.app.services import llm_service
+from backend.app.services.metrics import Histogram
+
+
+def test_histogram_renders_cumulative_buckets():
+    h = Histogram("demo_seconds", "demo", ["route"], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        h.observe(value, route="/x")
+    assert h.render()[2:] == [
+        'demo_seconds_bucket{route="/x",le="0.1"} 1',
+        'demo_seconds_bucket{route="/x",le="1"} 2',
+        'demo_seconds_bucket{route="/x",le="+Inf"} 3',
+        'demo_seconds_sum{route="/x"} 5.55',
+        'demo_seconds_count{route="/x"} 3',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_metrics_cover_routes_llm_stages_tokens_and_db(monkeypatch, chat_game, capsys):
+    async def fake_generate(model, contents, config=None, timeout=None):
+        return SimpleNamespace(
+            text=json.dumps({"dialogue": "我什麼都不知道", "hint": None, "evidence": None}),
+            usage_metadata=SimpleNamespace(prompt_token_count=321, candidates_token_count=12,
+                                           cached_content_token_count=None),
+        )
+
+    monkeypatch.setattr(llm_service.backend, "generate", fake_generate)
+    game_id, player_id, npc_id = chat_game
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.post("/api/chat/npc", json={
+            "game_id": game_id, "player_id": player_id, "npc_id": npc_id, "text": "昨晚你在哪裡？",
+        })
+        assert r.status_code == 200
+        body = (await ac.get("/metrics")).text
+
+    assert 'http_request_duration_seconds_count{method="POST",route="/api/chat/npc",status="200"}' in body
+    assert 'http_request_db_seconds_count{route="/api/chat/npc"}' in body
+    for phase in ("queue", "llm", "parse"):
+        assert f'llm_stage_duration_seconds_count{{stage="chat",phase="{phase}"}}' in body
+    assert 'llm_tokens_total{stage="chat",model="gemini-2.0-flash",kind="prompt"}' in body
+    assert 'db_query_duration_seconds_count{operation="SELECT"}' in body
+    # 熱路徑不再把整段請求印到 stdout
+    assert "昨晚你在哪裡" not in capsys.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_component_stats_live_under_one_router():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        everything = (await ac.get("/api/stats")).json()
+        scheduler = await ac.get("/api/stats/llm-scheduler")
+        unknown = await ac.get("/api/stats/nope")
+        old = await ac.get("/api/world/llm-scheduler/stats")
+
+    assert {"llm-cache", "llm-scheduler", "llm-resilience", "model-routes", "read-cache",
+            "llm-single-flight", "rooms", "world-pool", "chat-context-cache"} <= set(everything)
+    assert scheduler.status_code == 200 and scheduler.json().keys() == everything["llm-scheduler"].keys()
+    assert unknown.status_code == 404
+    assert old.status_code == 404
@@ -0,0 +1,80 @@
+# backend/tests/test_migrations.py
+import pytest
+from sqlalchemy import event, inspect
+from sqlmodel import Session, SQLModel, create_engine
+
+from backend.app.database import engine
+from backend.app.migrations import MIGRATIONS, current_version, run_migrations
+from backend.app.services.memory_services import MemoryService
+
+
+def test_migrations_upgrade_an_old_database(tmp_path):
+    old = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    SQLModel.metadata.create_all(old)
+    # 還原成加索引與 npc_id 之前的 schema
+    with old.begin() as conn:
+        for name in [r[0] for r in conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'"
+        )]:
+            conn.exec_driver_sql(f"DROP INDEX {name}")
+        conn.exec_driver_sql("DROP TABLE message")
+        conn.exec_driver_sql(
+            "CREATE TABLE message (id INTEGER NOT NULL PRIMARY KEY, player_id INTEGER NOT NULL REFERENCES player (id),"
+            " role VARCHAR NOT NULL, content VARCHAR NOT NULL, timestamp DATETIME NOT NULL)"
+        )
+        conn.exec_driver_sql("DROP TABLE gameobj")
+        conn.exec_driver_sql(
+            "CREATE TABLE gameobj (id INTEGER NOT NULL PRIMARY KEY, location_id INTEGER NOT NULL REFERENCES location (id),"
+            " name VARCHAR NOT NULL, lock INTEGER NOT NULL, clue VARCHAR, owner_id INTEGER REFERENCES player (id))"
+        )
+        conn.exec_driver_sql("INSERT INTO game (id, created_at) VALUES (1, CURRENT_TIMESTAMP)")
+        conn.exec_driver_sql("INSERT INTO location (id, game_id, name) VALUES (1, 1, '書房')")
+        conn.exec_driver_sql("INSERT INTO gameobj (id, location_id, name, lock, clue) VALUES (7, 1, '日記', 3, '撕掉的一頁')")
+
+    assert run_migrations(old) == MIGRATIONS[-1][0]
+    insp = inspect(old)
+    assert "npc_id" in [c["name"] for c in insp.get_columns("message")]
+    assert "ix_message_player_id_timestamp" in [i["name"] for i in insp.get_indexes("message")]
+    assert "ix_npc_game_id" in [i["name"] for i in insp.get_indexes("npc")]
+    assert next(c for c in insp.get_columns("gameobj") if c["name"] == "lock")["nullable"]
+    assert "ix_gameobj_location_id" in [i["name"] for i in insp.get_indexes("gameobj")]
+    with old.connect() as conn:
+        assert conn.exec_driver_sql("SELECT id, name, lock FROM gameobj").all() == [(7, "日記", 3)]
+
+    # 再跑一次什麼都不做
+    assert run_migrations(old) == current_version(old) == MIGRATIONS[-1][0]
+
+
+def _query_plan(run):
+    """
+    執行 run(mem)，對它發出的最後一個 SELECT 做 EXPLAIN QUERY PLAN
+    """
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        with Session(engine) as session:
+            run(MemoryService(session))
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    statement, parameters = captured[-1]
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+    return " | ".join(r[-1] for r in rows)
+
+
+@pytest.mark.parametrize("run, index", [
+    (lambda mem, ids: mem.get_conversation_context(ids[1], limit=20, npc_id=ids[2]),
+     "ix_message_player_id_npc_id_timestamp"),
+    (lambda mem, ids: mem.get_conversation_context(ids[1], limit=20), "ix_message_player_id_timestamp"),
+    (lambda mem, ids: mem.get_npcs(ids[0]), "ix_npc_game_id"),
+    (lambda mem, ids: mem.get_locations(ids[0]), "ix_location_game_id"),
+])
+def test_hot_queries_use_indexes(chat_game, run, index):
+    plan = _query_plan(lambda mem: run(mem, chat_game))
+    assert index in plan, plan
+    assert "TEMP B-TREE" not in plan, plan
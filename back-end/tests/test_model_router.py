@@ -0,0 +1,57 @@
+# backend/tests/test_model_router.py
+import asyncio
+import pytest
+from types import SimpleNamespace
+
+from backend.app.services import llm_service
+from backend.app.services.model_router import ModelRouter, Route
+
+
+def _router(now):
+    routes = {"chat": Route(primary="big", fallback="small", temperature=0.5, max_tokens=500, slo_seconds=2)}
+    return ModelRouter(routes, min_samples=5, cooldown=60, clock=lambda: now[0])
+
+
+def test_resolve_fills_task_defaults_and_keeps_explicit_values():
+    router = _router([0.0])
+    assert router.resolve("chat") == ("big", 0.5, 500)
+    assert router.resolve("chat", model="other", temperature=0.9, max_tokens=100) == ("other", 0.9, 100)
+
+
+def test_slow_primary_moves_traffic_to_fallback_until_cooldown():
+    now = [0.0]
+    router = _router(now)
+    for _ in range(4):
+        router.record("chat", "big", 3.0)
+    assert router.current_model("chat") == "big"      # 樣本還不夠
+
+    router.record("chat", "big", 3.0)
+    assert router.resolve("chat")[0] == "small"
+    assert router.stats()["chat"]["switches"] == 1
+
+    now[0] = 61
+    assert router.resolve("chat")[0] == "big"
+    # 回到主模型後重新量測，快的樣本不會再觸發切換
+    for _ in range(5):
+        router.record("chat", "big", 0.5)
+    assert router.current_model("chat") == "big"
+
+
+@pytest.mark.asyncio
+async def test_llm_calls_use_routed_model(monkeypatch):
+    router = ModelRouter(
+        {"background": Route(primary="big", fallback="small", temperature=0.7, max_tokens=300, slo_seconds=0.01)},
+        min_samples=1,
+    )
+    monkeypatch.setattr(llm_service, "model_router", router)
+    seen = []
+
+    async def fake_generate(model, contents, config=None, timeout=None):
+        seen.append((model, config.max_output_tokens))
+        await asyncio.sleep(0.02)      # 超過 SLO
+        return SimpleNamespace(text="背景")
+
+    monkeypatch.setattr(llm_service.backend, "generate", fake_generate)
+    await llm_service.call_llm_for_background("古堡", fresh=True)
+    await llm_service.call_llm_for_background("古堡", fresh=True)
+    assert seen == [("big", 300), ("small", 300)]
@@ -0,0 +1,115 @@
+# backend/tests/test_object_unlock.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlmodel import Session
+
+from backend.app.main import app
+from backend.app.database import async_engine, engine
+from backend.app.models import GameObj, Location, Message, Npc, Player
+from backend.app.routers import games
+from backend.app.services.memory_services import MemoryService
+
+PLAYERS = 200
+
+
+def _make_game(num_players: int):
+    """
+    一場有兩個 NPC、三個物件的遊戲；所有玩家都跟 NPC A 說過話，沒有人跟 NPC B 說過話
+    """
+    with Session(engine) as session:
+        game = MemoryService(session).create_game()
+        npc_a = Npc(game_id=game.id, name="林管家", description="管家")
+        npc_b = Npc(game_id=game.id, name="陳廚師", description="廚師")
+        location = Location(game_id=game.id, name="書房")
+        session.add_all([npc_a, npc_b, location])
+        session.flush()
+        objects = [
+            GameObj(location_id=location.id, name="日記", lock=npc_a.id, clue="撕掉的一頁"),
+            GameObj(location_id=location.id, name="保險箱", lock=npc_b.id, clue="遺囑"),
+            GameObj(location_id=location.id, name="酒杯", lock=npc_a.id, clue="杯底有藥粉"),
+        ]
+        players = [Player(game_id=game.id, user_id=f"user-{i}") for i in range(num_players)]
+        session.add_all(objects + players)
+        session.flush()
+        session.add_all([
+            Message(player_id=p.id, npc_id=npc_a.id, role="user", content="昨晚你在哪裡？") for p in players
+        ])
+        session.commit()
+        return game.id, [o.id for o in objects], [p.id for p in players]
+
+
+def _owner(object_id: int):
+    with Session(engine) as session:
+        return session.get(GameObj, object_id).owner_id
+
+
+@pytest.mark.asyncio
+async def test_parallel_http_unlocks_have_exactly_one_winner():
+    game_id, (diary, _, _), players = _make_game(PLAYERS)
+    # 連線池排隊用的 asyncio.Queue 會綁在第一次需要等待的 event loop 上，
+    # 每個測試都是新的 loop，這裡會把池子用滿，先換一個新的池子
+    await async_engine.dispose()
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        responses = await asyncio.gather(*(
+            ac.post(f"/api/games/{game_id}/objects/{diary}/unlock", json={"player_id": p}) for p in players
+        ))
+
+    codes = [r.status_code for r in responses]
+    assert codes.count(200) == 1 and codes.count(409) == PLAYERS - 1
+    winner = players[codes.index(200)]
+    assert responses[codes.index(200)].json() == {"object_id": diary, "status": "unlocked", "clue": "撕掉的一頁"}
+    assert _owner(diary) == winner
+
+
+def test_parallel_threads_have_exactly_one_winner():
+    game_id, (_, _, cup), players = _make_game(PLAYERS)
+
+    def attempt(player_id: int) -> str:
+        with Session(engine) as session:
+            return MemoryService(session).unlock_objects(game_id, player_id, [cup])[cup]
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        statuses = list(pool.map(attempt, players))
+    assert statuses.count("unlocked") == 1 and statuses.count("taken") == PLAYERS - 1
+    assert _owner(cup) == players[statuses.index("unlocked")]
+
+
+@pytest.mark.asyncio
+async def test_batch_unlock_reports_each_object_and_broadcasts_wins(monkeypatch):
+    game_id, (diary, safe, cup), (alice, bob) = _make_game(2)
+    other_game, _, (stranger,) = _make_game(1)
+    published = []
+    monkeypatch.setattr(games.game_rooms, "publish", lambda gid, type, data, exclude=None: published.append((gid, type, data)))
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        url = f"/api/games/{game_id}/objects/unlock"
+        r = await ac.post(url, json={"player_id": alice, "object_ids": [diary, safe, 999999, diary]})
+        assert r.status_code == 200
+        assert r.json()["results"] == [
+            {"object_id": diary, "status": "unlocked", "clue": "撕掉的一頁"},
+            {"object_id": safe, "status": "locked", "clue": None},        # 沒跟陳廚師說過話
+            {"object_id": 999999, "status": "not_found", "clue": None},
+        ]
+        r = await ac.post(url, json={"player_id": alice, "object_ids": [diary, cup]})
+        assert [x["status"] for x in r.json()["results"]] == ["already_owned", "unlocked"]
+
+        r = await ac.post(url, json={"player_id": bob, "object_ids": [diary, cup]})
+        assert r.json()["results"] == [
+            {"object_id": diary, "status": "taken", "clue": None},
+            {"object_id": cup, "status": "taken", "clue": None},
+        ]
+        r = await ac.post(f"/api/games/{game_id}/objects/{safe}/unlock", json={"player_id": bob})
+        assert r.status_code == 403
+        # 別場遊戲的玩家
+        r = await ac.post(url, json={"player_id": stranger, "object_ids": [diary]})
+        assert r.status_code == 404
+
+    assert published == [
+        (game_id, "object_unlocked", {"object_id": diary, "player_id": alice}),
+        (game_id, "object_unlocked", {"object_id": cup, "player_id": alice}),
+    ]
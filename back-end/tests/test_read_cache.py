@@ -0,0 +1,47 @@
+# backend/tests/test_read_cache.py
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import event
+from sqlmodel import Session
+
+from backend.app.main import app
+from backend.app.database import async_engine, engine
+from backend.app.services.memory_services import MemoryService
+from backend.app.services.read_cache import read_cache
+
+
+@pytest.mark.asyncio
+async def test_repeat_polls_never_touch_the_database(chat_game):
+    game_id, _, _ = chat_game
+    statements = []
+    listener = lambda conn, cursor, sql, params, context, many: statements.append(sql)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", listener)
+    transport = ASGITransport(app=app)
+    try:
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            first = await ac.get(f"/api/games/{game_id}/npcs")
+            assert first.status_code == 200 and [n["name"] for n in first.json()] == ["林管家"]
+            assert statements
+
+            statements.clear()
+            hits = read_cache.stats()["hits"]
+            again = await ac.get(f"/api/games/{game_id}/npcs")
+            assert again.content == first.content and again.headers["etag"] == first.headers["etag"]
+            not_modified = await ac.get(f"/api/games/{game_id}/npcs", headers={"If-None-Match": first.headers["etag"]})
+            assert not_modified.status_code == 304
+            assert statements == []
+            assert read_cache.stats()["hits"] == hits + 1
+
+            # MemoryService 寫入後版本改變，拿到新的內容
+            with Session(engine) as session:
+                MemoryService(session).save_npcs(game_id, [{"name": "陳園丁", "description": "園丁"}])
+            changed = await ac.get(f"/api/games/{game_id}/npcs", headers={"If-None-Match": first.headers["etag"]})
+            assert changed.status_code == 200
+            assert [n["name"] for n in changed.json()] == ["陳園丁"]
+            assert changed.headers["etag"] != first.headers["etag"]
+
+            # 找不到的遊戲不會被快取
+            assert (await ac.get("/api/games/999999/npcs")).status_code == 404
+            assert (await ac.get("/api/games/999999/npcs")).status_code == 404
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", listener)
@@ -0,0 +1,83 @@
+# backend/tests/test_response_cache.py
+import time
+import threading
+import pytest
+from types import SimpleNamespace
+from google.genai import types
+
+from backend.app.services import llm_service
+from backend.app.services.response_cache import (
+    MemoryTier, ResponseCache, SqliteTier, cache_key, response_cache,
+)
+
+
+def test_key_depends_on_prompt_model_and_sampling_params():
+    cfg = types.GenerateContentConfig(temperature=0.7)
+    base = cache_key("m", ["系統", "雨夜"], cfg)
+    assert base == cache_key("m", ["系統", "雨夜"], types.GenerateContentConfig(temperature=0.7))
+    assert base != cache_key("m", ["系統", "雪夜"], cfg)
+    assert base != cache_key("m2", ["系統", "雨夜"], cfg)
+    assert base != cache_key("m", ["系統", "雨夜"], types.GenerateContentConfig(temperature=0.2))
+
+
+def test_disk_tier_survives_restart_and_refills_memory(tmp_path):
+    path = str(tmp_path / "cache.db")
+    ResponseCache([MemoryTier(), SqliteTier(path)]).set("k", "背景")
+
+    memory = MemoryTier()
+    cache = ResponseCache([memory, SqliteTier(path)])
+    assert cache.get("k") == "背景"
+    assert memory.get("k") is not None
+    assert cache.get("k") == "背景"
+    stats = cache.stats()
+    assert stats["disk_hits"] == 1 and stats["memory_hits"] == 1 and stats["hit_ratio"] == 1.0
+
+
+def test_ttl_and_size_bounded_eviction(tmp_path):
+    disk = SqliteTier(str(tmp_path / "cache.db"), max_entries=2)
+    cache = ResponseCache([MemoryTier(max_entries=2), disk], ttl=60)
+    cache.set("old", "x", ttl=-1)
+    assert cache.get("old") is None and cache.stats()["expired"] >= 1
+
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+        time.sleep(0.01)
+    assert disk.size() == 2 and cache.stats()["entries"]["memory"] == 2
+    assert cache.get("a") is None and cache.get("c") == "c"
+
+
+@pytest.mark.asyncio
+async def test_background_uses_cache_unless_fresh(monkeypatch):
+    calls = []
+
+    async def fake_generate(model, contents, config=None, timeout=None):
+        calls.append(1)
+        return SimpleNamespace(text=f"莊園的故事{len(calls)}")
+
+    monkeypatch.setattr(llm_service.backend, "generate", fake_generate)
+    assert await llm_service.call_llm_for_background("莊園") == "莊園的故事1"
+    assert await llm_service.call_llm_for_background("莊園") == "莊園的故事1"
+    assert await llm_service.call_llm_for_background("莊園", fresh=True) == "莊園的故事2"
+    # 重新生成的結果會寫回快取
+    assert await llm_service.call_llm_for_background("莊園") == "莊園的故事2"
+    assert len(calls) == 2 and response_cache.stats()["bypass"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_async_access_keeps_sqlite_off_the_event_loop(tmp_path):
+    threads = []
+
+    class SpyTier(SqliteTier):
+        def get(self, key):
+            threads.append(threading.get_ident())
+            return super().get(key)
+
+    path = tmp_path / "data" / "cache.db"
+    disk = SpyTier(str(path))
+    # 建立時不開檔，第一次用到才建目錄與檔案
+    assert not path.exists() and disk.size() == 0
+    cache = ResponseCache([disk])
+    await cache.aset("k", "背景")
+    assert path.exists()
+    assert await cache.aget("k") == "背景"
+    assert threads and threading.get_ident() not in threads
@@ -0,0 +1,126 @@
+# backend/tests/test_save_world.py
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+import pytest
+from backend.app.database import engine
+from backend.app.models import Character, GameObj, Location, Message, Npc, Player
+from backend.app.services import memory_services
+from backend.app.services.memory_services import GameHasPlayers, MemoryService
+
+
+def _world(num_npcs=3):
+    return {
+        "background": "雨夜的莊園",
+        "characters": [
+            {"id": i + 1, "name": f"角色{i}", "role": "嫌疑人", "public_info": "你是…", "secret": "秘密", "mission": "任務"}
+            for i in range(4)
+        ],
+        "npcs": [{"id": i + 1, "name": f"NPC{i}", "description": "路人"} for i in range(num_npcs)],
+        "acts": [{"act_number": 1, "scripts": []}],
+        "ending": "兇手是管家",
+        "locations": [
+            {"id": 1, "name": "書房", "npcs": [1, 2], "objects": [{"id": 1, "name": "日記", "lock": 2, "clue": "撕掉的一頁"}]},
+            {"id": 2, "name": "花園", "npcs": [3], "objects": [{"id": 1, "name": "鏟子", "lock": 3, "clue": None}]},
+        ],
+    }
+
+
+def _new_game():
+    with Session(engine) as session:
+        return MemoryService(session).create_game().id
+
+
+def test_save_world_commits_once_and_maps_ids():
+    game_id = _new_game()
+    commits = []
+    listener = lambda conn: commits.append(1)
+    event.listen(engine, "commit", listener)
+    try:
+        with Session(engine) as session:
+            ids = MemoryService(session).save_world(game_id, _world())
+    finally:
+        event.remove(engine, "commit", listener)
+    assert len(commits) == 1
+
+    with Session(engine) as session:
+        npcs = session.exec(select(Npc).where(Npc.game_id == game_id)).all()
+        assert sorted(n.name for n in npcs) == ["NPC0", "NPC1", "NPC2"]
+        assert session.exec(select(Character).where(Character.game_id == game_id)).all().__len__() == 4
+
+        study = session.get(Location, ids["locations"][1])
+        garden = session.get(Location, ids["locations"][2])
+        by_name = {n.name: n for n in npcs}
+        assert by_name["NPC0"].location_id == study.id and by_name["NPC1"].location_id == study.id
+        assert by_name["NPC2"].location_id == garden.id
+        diary = session.exec(select(GameObj).where(GameObj.location_id == study.id)).one()
+        assert diary.lock == ids["npcs"][2] == by_name["NPC1"].id
+        # 物件的 id 只在地點內唯一，用 (地點, 物件) 對應到 DB id
+        spade = session.exec(select(GameObj).where(GameObj.location_id == garden.id)).one()
+        assert ids["objects"] == {(1, 1): diary.id, (2, 1): spade.id}
+
+        game = MemoryService(session).get_game(game_id)
+        assert game.ending == "兇手是管家" and game.acts[0]["act_number"] == 1
+
+
+def test_unknown_lock_is_saved_as_unlocked():
+    world = _world()
+    world["locations"][1]["objects"][0]["lock"] = 99      # LLM 編了一個不存在的 NPC
+    game_id = _new_game()
+    with Session(engine) as session:
+        ids = MemoryService(session).save_world(game_id, world)
+        assert session.get(GameObj, ids["objects"][(2, 1)]).lock is None
+        assert session.get(GameObj, ids["objects"][(1, 1)]).lock == ids["npcs"][2]
+
+
+def test_save_world_refuses_games_with_players(chat_game):
+    game_id, player_id, npc_id = chat_game
+    with Session(engine) as session:
+        MemoryService(session).append_message(player_id, "user", "你好", npc_id=npc_id)
+        with pytest.raises(GameHasPlayers):
+            MemoryService(session).save_world(game_id, _world())
+    with Session(engine) as session:
+        # 玩家、對話與原本的世界都沒被動到
+        assert session.get(Player, player_id) is not None
+        assert session.get(Npc, npc_id) is not None
+        assert len(session.exec(select(Message).where(Message.player_id == player_id)).all()) == 1
+
+
+def test_save_world_rolls_back_on_error():
+    game_id = _new_game()
+    with Session(engine) as session:
+        npc = Npc(game_id=game_id, name="林管家", description="服侍莊園三十年")
+        session.add(npc)
+        session.commit()
+        npc_id = npc.id
+    bad = _world()
+    bad["npcs"][0] = {"id": 1}      # 少了必填欄位
+    with Session(engine) as session:
+        try:
+            MemoryService(session).save_world(game_id, bad)
+        except Exception:
+            pass
+        else:
+            raise AssertionError("應該要失敗")
+    with Session(engine) as session:
+        # 原本的 NPC 還在
+        assert session.get(Npc, npc_id) is not None
+
+
+def test_chat_cache_is_invalidated_only_after_the_caller_commits(monkeypatch):
+    invalidated = []
+
+    class RecordingCache:
+        def invalidate_game(self, game_id):
+            invalidated.append(game_id)
+
+    monkeypatch.setattr(memory_services, "chat_context_cache", RecordingCache())
+    game_id = _new_game()
+    with Session(engine) as session:
+        MemoryService(session).save_world(game_id, _world(), commit=False)
+        # 還沒 commit：這時作廢的話，同時進來的對話會把舊資料放回快取
+        assert invalidated == []
+        session.commit()
+        assert invalidated == [game_id]
+        session.commit()
+        assert invalidated == [game_id]
@@ -0,0 +1,43 @@
+# backend/tests/test_scene_fanout.py
+import re
+import json
+import time
+import asyncio
+import pytest
+from types import SimpleNamespace
+
+from backend.app.services import llm_service
+
+
+@pytest.mark.asyncio
+async def test_acts_are_generated_concurrently_from_one_outline(monkeypatch):
+    prompts = []
+
+    async def fake_generate(model, contents, config=None, cache=False, fresh=False, task=None):
+        prompt = contents[1]
+        prompts.append(prompt)
+        await asyncio.sleep(0.1)
+        if "先不要寫劇本" in prompt:
+            return SimpleNamespace(text=json.dumps({
+                "truth": "管家下毒", "acts": [{"act_number": 1, "summary": "晚宴"}], "ending": "揭穿",
+            }, ensure_ascii=False))
+        if "ending (字串)" in prompt:
+            return SimpleNamespace(text=json.dumps({"ending": "管家認罪"}, ensure_ascii=False))
+        n = int(re.search(r"只寫第 (\d+) 幕", prompt).group(1))
+        return SimpleNamespace(text=json.dumps({
+            "act_number": n, "scripts": [{"character": "甲", "dialogue": f"第{n}幕"}],
+        }, ensure_ascii=False))
+
+    monkeypatch.setattr(llm_service, "_generate", fake_generate)
+    start = time.perf_counter()
+    acts, ending = await llm_service.call_llm_for_scenes_and_ending(
+        "背景", [{"name": "甲"}], [], [], num_acts=6,
+    )
+    elapsed = time.perf_counter() - start
+
+    assert [a["act_number"] for a in acts] == [1, 2, 3, 4, 5, 6]
+    assert acts[2]["scripts"][0]["dialogue"] == "第3幕"
+    assert ending == "管家認罪"
+    assert len(prompts) == 8                        # 大綱 + 6 幕 + 結局
+    assert all("管家下毒" in p for p in prompts[1:])  # 每一幕都拿到同一份大綱
+    assert elapsed < 0.5                            # 大綱 + 一輪並行，而不是 8 次依序
@@ -0,0 +1,69 @@
+# backend/tests/test_single_flight.py
+import asyncio
+import pytest
+from types import SimpleNamespace
+
+from backend.app.services import llm_service
+from backend.app.services.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "結果"
+
+    results = await asyncio.gather(*[flight.do("k", work) for _ in range(5)])
+    assert results == ["結果"] * 5 and len(calls) == 1
+    stats = flight.stats()
+    assert stats["executed"] == 1 and stats["coalesced"] == 4 and stats["max_waiters"] == 5
+    assert stats["coalescing_ratio"] == 0.8 and stats["in_flight"] == 0
+
+    # 完成之後再呼叫會重新執行
+    assert await flight.do("k", work) == "結果" and len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_waiter_and_first_caller_cancel_is_isolated():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    results = await asyncio.gather(flight.do("e", fail), flight.do("e", fail), return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight.stats()["errors"] == 1
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    first = asyncio.create_task(flight.do("s", slow))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(flight.do("s", slow))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "ok"
+
+
+@pytest.mark.asyncio
+async def test_duplicate_background_requests_hit_gemini_once(monkeypatch):
+    calls = []
+
+    async def fake_generate(model, contents, config=None, timeout=None):
+        calls.append(contents)
+        await asyncio.sleep(0.02)
+        return SimpleNamespace(text="古堡的雨夜")
+
+    monkeypatch.setattr(llm_service.backend, "generate", fake_generate)
+    texts = await asyncio.gather(*[llm_service.call_llm_for_background("古堡") for _ in range(3)])
+    assert texts == ["古堡的雨夜"] * 3 and len(calls) == 1
+
+    # fresh 的請求各自生成
+    await asyncio.gather(*[llm_service.call_llm_for_background("莊園", fresh=True) for _ in range(2)])
+    assert len(calls) == 3
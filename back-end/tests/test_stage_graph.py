@@ -0,0 +1,81 @@
+# backend/tests/test_stage_graph.py
+import asyncio
+import pytest
+
+from backend.app.services.stage_graph import StageGraph
+
+
+def _sleeper(delay, value, log=None):
+    async def stage(**deps):
+        if log is not None:
+            log.append(("start", value, sorted(deps)))
+        await asyncio.sleep(delay)
+        return value
+    return stage
+
+
+@pytest.mark.asyncio
+async def test_independent_stages_run_concurrently():
+    log = []
+    graph = (
+        StageGraph()
+        .add("characters", _sleeper(0.05, "c", log))
+        .add("npcs",       _sleeper(0.05, "n", log), deps=["characters"])
+        .add("scenes",     _sleeper(0.2, "s", log),  deps=["characters", "npcs"])
+        .add("locations",  _sleeper(0.2, "l", log),  deps=["characters", "npcs"])
+    )
+    run = await graph.run()
+
+    assert run.results == {"characters": "c", "npcs": "n", "scenes": "s", "locations": "l"}
+    # 最長依賴鏈 = 0.05 + 0.05 + 0.2，串行的話會是 0.5
+    assert run.total < 0.45
+    # scenes 與 locations 幾乎同時開始
+    assert abs(run.timings["scenes"].started_at - run.timings["locations"].started_at) < 0.03
+    assert run.timings["npcs"].started_at >= run.timings["characters"].finished_at
+    assert ("start", "s", ["characters", "npcs"]) in log
+    assert "scenes;dur=" in run.server_timing()
+
+
+@pytest.mark.asyncio
+async def test_failure_cancels_running_stages():
+    cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def boom():
+        raise RuntimeError("LLM 失敗")
+
+    graph = StageGraph().add("slow", slow).add("boom", boom)
+    with pytest.raises(RuntimeError):
+        await graph.run()
+    assert cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_invalid_graphs_are_rejected():
+    async def noop(**_):
+        return None
+
+    with pytest.raises(ValueError):
+        await StageGraph().add("a", noop, deps=["missing"]).run()
+    with pytest.raises(ValueError):
+        await StageGraph().add("a", noop, deps=["b"]).add("b", noop, deps=["a"]).run()
+    with pytest.raises(ValueError):
+        StageGraph().add("a", noop).add("a", noop)
+
+
+@pytest.mark.asyncio
+async def test_iter_completed_yields_in_completion_order():
+    graph = (
+        StageGraph()
+        .add("characters", _sleeper(0.01, "c"))
+        .add("scenes",     _sleeper(0.1, "s"),  deps=["characters"])
+        .add("locations",  _sleeper(0.02, "l"), deps=["characters"])
+    )
+    names = [name async for name, _, _ in graph.iter_completed()]
+    assert names == ["characters", "locations", "scenes"]
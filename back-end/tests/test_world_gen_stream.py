@@ -0,0 +1,92 @@
+# backend/tests/test_world_gen_stream.py
+import json
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlmodel import Session, select
+
+from backend.app.main import app
+from backend.app.database import engine
+from backend.app.models import Npc
+from backend.app.routers import world_gen
+from backend.app.services.memory_services import MemoryService
+
+
+BODY = {"background": "雨夜的莊園", "num_characters": 3, "num_npcs": 2, "num_acts": 2}
+
+
+@pytest.mark.asyncio
+async def test_generate_full_stream_emits_sections_as_ndjson(fake_world_llm):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.post("/api/world/world/games/generate_full/stream", json=BODY)
+
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in r.text.splitlines()]
+    names = [e["event"] for e in events]
+    assert names == ["characters", "npcs", "locations", "acts", "ending", "done"]
+    assert [c["id"] for c in events[0]["data"]] == [1, 2, 3]
+    assert events[2]["data"][0]["objects"][0]["name"] == "日記"
+    assert set(events[-1]["data"]["timings"]) == {"characters", "npcs", "scenes", "locations"}
+
+
+@pytest.mark.asyncio
+async def test_generate_full_matches_stream_sections(fake_world_llm):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        full = await ac.post("/api/world/world/games/generate_full", json=BODY)
+        sse = await ac.post(
+            "/api/world/world/games/generate_full/stream", json=BODY,
+            headers={"Accept": "text/event-stream"},
+        )
+
+    assert "Server-Timing" in full.headers
+    data = full.json()
+    sections = {}
+    for block in sse.text.strip().split("\n\n"):
+        event, payload = block.split("\n", 1)
+        sections[event[len("event: "):]] = json.loads(payload[len("data: "):])
+    for key in ("characters", "npcs", "acts", "ending", "locations"):
+        assert sections[key] == data[key]
+
+
+@pytest.mark.asyncio
+async def test_stream_saves_into_game_and_replays_idempotency_key(fake_world_llm, monkeypatch, chat_game):
+    calls = []
+    characters = world_gen.call_llm_for_characters
+
+    async def counted(*args, **kwargs):
+        calls.append(1)
+        return await characters(*args, **kwargs)
+
+    monkeypatch.setattr(world_gen, "call_llm_for_characters", counted)
+    with Session(engine) as session:
+        game_id = MemoryService(session).create_game().id
+    body = {**BODY, "game_id": game_id}
+    headers = {"Idempotency-Key": f"stream-{game_id}"}
+    url = "/api/world/world/games/generate_full/stream"
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        first = await ac.post(url, json=body, headers=headers)
+        replay = await ac.post(url, json=body, headers=headers)
+        plain = await ac.post("/api/world/world/games/generate_full", json=body, headers=headers)
+        no_game = await ac.post(url, json=BODY, headers=headers)
+        has_players = await ac.post(url, json={**BODY, "game_id": chat_game[0]})
+
+    events = [json.loads(line) for line in first.text.splitlines()]
+    assert [e["event"] for e in events][-2:] == ["saved", "done"]
+    saved = events[-2]["data"]
+    assert saved["game_id"] == game_id
+    with Session(engine) as session:
+        npcs = session.exec(select(Npc).where(Npc.game_id == game_id)).all()
+    assert sorted(n["id"] for n in saved["npcs"]) == sorted(n.id for n in npcs)
+
+    # 同一個 key 重送（串流或非串流）重播存好的結果，不會再生成
+    assert len(calls) == 1
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    replayed = {e["event"]: e["data"] for e in map(json.loads, replay.text.splitlines())}
+    assert replayed["saved"] == saved and replayed["characters"] == saved["characters"]
+    assert plain.json() == saved
+
+    assert no_game.status_code == 422
+    assert has_players.status_code == 409
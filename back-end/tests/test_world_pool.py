@@ -0,0 +1,130 @@
+# backend/tests/test_world_pool.py
+import asyncio
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlmodel import Session
+
+from backend.app.main import app
+from backend.app.database import engine
+from backend.app.models import GameObj, Npc
+from backend.app.routers import stats as stats_router, world_gen
+from backend.app.services.memory_services import MemoryService
+from backend.app.services.world_pool import WorldPool
+
+
+async def _wait_ready(pool, theme, n):
+    for _ in range(100):
+        if pool.stats()["themes"][theme]["ready"] >= n:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(pool.stats())
+
+
+@pytest.mark.asyncio
+async def test_pool_fills_claims_and_refills():
+    made = []
+
+    async def generate(theme):
+        made.append(theme)
+        await asyncio.sleep(0.01)
+        return {"background": f"{theme}{len(made)}"}
+
+    pool = WorldPool(themes=["莊園"], target_size=2, refill_concurrency=1, refill_interval=60)
+    pool.start(generate)
+    try:
+        await _wait_ready(pool, "莊園", 2)
+        assert pool.claim("莊園")["background"] == "莊園1"
+        assert pool.claim("太空站") is None
+        # 被拿走後馬上補貨，不用等定期檢查
+        await _wait_ready(pool, "莊園", 2)
+        assert len(made) == 3
+    finally:
+        await pool.stop()
+
+    stats = pool.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["generated"] == 3
+
+
+@pytest.mark.asyncio
+async def test_stale_worlds_are_dropped():
+    async def generate(theme):
+        return {"background": theme}
+
+    pool = WorldPool(themes=["莊園"], target_size=1, max_age=0, refill_interval=60)
+    pool.start(generate)
+    try:
+        await _wait_ready(pool, "莊園", 1)
+        await asyncio.sleep(0.01)
+        assert pool.claim("莊園") is None
+        assert pool.stats()["expired"] >= 1
+    finally:
+        await pool.stop()
+
+
+@pytest.mark.asyncio
+async def test_claim_endpoint(monkeypatch):
+    pool = WorldPool(themes=["莊園"], target_size=1, refill_interval=60)
+    world = {"background": "雨夜", "characters": [], "npcs": [], "acts": [], "ending": "完", "locations": []}
+
+    async def generate(theme):
+        return world
+
+    monkeypatch.setattr(world_gen, "world_pool", pool)
+    monkeypatch.setattr(stats_router, "world_pool", pool)
+    pool.start(generate)
+    try:
+        await _wait_ready(pool, "莊園", 1)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            hit = await ac.post("/api/world/world/games/pool/claim", json={"theme": "莊園"})
+            miss = await ac.post("/api/world/world/games/pool/claim", json={"theme": "太空站"})
+            stats = await ac.get("/api/stats/world-pool")
+    finally:
+        await pool.stop()
+
+    assert hit.status_code == 200 and hit.json() == {**world, "game_id": None}   # 沒給 game_id 只是預覽
+    assert miss.status_code == 404
+    assert stats.json()["claims"] == 2
+
+
+@pytest.mark.asyncio
+async def test_claim_into_game_saves_world_with_db_ids(monkeypatch):
+    pool = WorldPool(themes=["莊園"], target_size=1, refill_interval=60)
+    world = {
+        "background": "雨夜",
+        "characters": [{"id": 1, "name": "王偵探", "role": "偵探", "public_info": "你是偵探", "secret": "無", "mission": "破案"}],
+        "npcs": [{"id": 1, "name": "林管家", "description": "老管家"}],
+        "acts": [{"act_number": 1, "scripts": [{"character": "王偵探", "dialogue": "開始調查"}]}],
+        "ending": "完",
+        "locations": [{"id": 1, "name": "書房", "npcs": [1],
+                       "objects": [{"id": 1, "name": "日記", "lock": 1, "clue": "撕掉的一頁", "owner_id": None}]}],
+    }
+
+    async def generate(theme):
+        return world
+
+    monkeypatch.setattr(world_gen, "world_pool", pool)
+    with Session(engine) as session:
+        game_id = MemoryService(session).create_game().id
+    pool.start(generate)
+    try:
+        await _wait_ready(pool, "莊園", 1)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            missing = await ac.post("/api/world/world/games/pool/claim", json={"theme": "莊園", "game_id": 999999})
+            r = await ac.post("/api/world/world/games/pool/claim", json={"theme": "莊園", "game_id": game_id})
+            # 被拿走後馬上補貨（claim 在 event loop 上叫醒 worker），不用等 refill_interval
+            await _wait_ready(pool, "莊園", 1)
+    finally:
+        await pool.stop()
+
+    assert missing.status_code == 404
+    assert r.status_code == 200
+    claimed = r.json()
+    assert claimed["game_id"] == game_id and claimed["background"] == "雨夜"
+    [obj] = claimed["locations"][0]["objects"]
+    with Session(engine) as session:
+        npc = session.get(Npc, claimed["npcs"][0]["id"])
+        assert npc.game_id == game_id and npc.location_id == claimed["locations"][0]["id"]
+        assert session.get(GameObj, obj["id"]).lock == npc.id == obj["lock"]
+        assert MemoryService(session).get_game(game_id).background == "雨夜"